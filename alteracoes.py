@@ -0,0 +1,63 @@
+"""Feed de alterações (change data capture) de livros, usuários e empréstimos
+
+Gatilhos do SQLite gravam em `alteracoes` uma linha por INSERT, UPDATE ou
+DELETE nessas tabelas, na mesma transação da alteração, com um `seq`
+sempre crescente. Sistemas externos guardam o último `seq` que
+processaram e pedem só o que veio depois. Cada alteração vem com o estado
+atual do registro (None se ele foi apagado): quem aplica as alterações em
+ordem termina com o mesmo estado do banco.
+
+As alterações antigas são apagadas pelo `seq` (pela chave primária). Quem
+parou em um `seq` anterior ao primeiro que restou perdeu alterações e
+precisa ressincronizar.
+"""
+import consultas
+
+# Tabela observada -> consulta do registro que traz o estado atual de uma linha
+TABELAS = {
+    'livros': 'alteracoes.livro',
+    'usuarios': 'alteracoes.usuario',
+    'emprestimos': 'alteracoes.emprestimo',
+}
+
+OPERACOES = {'INSERT': 'NEW', 'UPDATE': 'NEW', 'DELETE': 'OLD'}
+
+
+def criar_gatilhos(cursor):
+    """Cria os gatilhos que alimentam a tabela de alterações (idempotente)"""
+    for tabela in TABELAS:
+        for operacao, linha in OPERACOES.items():
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS cdc_{tabela}_{operacao.lower()}
+                AFTER {operacao} ON {tabela}
+                BEGIN
+                    INSERT INTO alteracoes (tabela, registro_id, operacao, criado_em)
+                    VALUES ('{tabela}', {linha}.id, '{operacao.lower()}',
+                            strftime('%Y-%m-%d %H:%M:%S', 'now', 'localtime'));
+                END
+            """)
+
+
+def primeiro(cursor):
+    """O menor `seq` ainda guardado (None se não há alterações)"""
+    return consultas.buscar_um(cursor, 'alteracoes.primeiro')['primeiro']
+
+
+def ler(cursor, desde=0, limite=100):
+    """Retorna as alterações com `seq` maior que `desde`, com o estado atual de cada registro"""
+    atuais = {}
+    lista = []
+    for alteracao in consultas.buscar_todos(cursor, 'alteracoes.desde', (desde, limite)):
+        chave = (alteracao['tabela'], alteracao['registro_id'])
+        if chave not in atuais:
+            linha = consultas.buscar_um(cursor, TABELAS[alteracao['tabela']], (alteracao['registro_id'],))
+            atuais[chave] = dict(linha) if linha else None
+        lista.append({
+            'seq': alteracao['seq'],
+            'tabela': alteracao['tabela'],
+            'id': alteracao['registro_id'],
+            'operacao': alteracao['operacao'],
+            'criado_em': alteracao['criado_em'],
+            'registro': atuais[chave],
+        })
+    return lista
@@ -0,0 +1,126 @@
+"""Anexos dos livros (capas e sumários) guardados por conteúdo
+
+Os arquivos ficam no disco com o nome do seu SHA-256, em subpastas pelos
+primeiros caracteres (ab/cd/abcd...), e o SQLite guarda só os metadados
+em `anexos`. O mesmo arquivo enviado duas vezes ocupa espaço uma vez só,
+e como o conteúdo de um endereço nunca muda ele pode ficar em cache no
+navegador para sempre. As listagens nunca leem o conteúdo: só o hash.
+
+As miniaturas das capas usam o Pillow, se estiver instalado; sem ele, a
+listagem mostra a própria capa reduzida pelo navegador.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow é opcional: sem ele não há miniaturas
+    Image = None
+
+# Tipos aceitos, reconhecidos pelos primeiros bytes (não pelo que o navegador diz)
+ASSINATURAS = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'%PDF-', 'application/pdf'),
+)
+
+HASH_VALIDO = re.compile(r'^[0-9a-f]{64}$')
+
+
+class ErroAnexo(Exception):
+    """Arquivo recusado pelo armazenamento de anexos"""
+
+
+def detectar_tipo(cabecalho):
+    """Tipo MIME pelo início do arquivo, ou None se não for um tipo aceito"""
+    for assinatura, mime in ASSINATURAS:
+        if cabecalho.startswith(assinatura):
+            return mime
+    if cabecalho[:4] == b'RIFF' and cabecalho[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+class ArmazemAnexos:
+    """Arquivos endereçados pelo SHA-256 do conteúdo, abaixo de `raiz`"""
+
+    def __init__(self, raiz, tamanho_maximo=20 * 2 ** 20):
+        self.raiz = raiz
+        self.tamanho_maximo = tamanho_maximo
+
+    def caminho(self, sha256):
+        if not HASH_VALIDO.match(sha256 or ''):
+            raise ErroAnexo("Endereço de anexo inválido!")
+        return os.path.join(self.raiz, sha256[:2], sha256[2:4], sha256)
+
+    def caminho_miniatura(self, sha256, largura):
+        return os.path.join(self.raiz, 'miniaturas', sha256[:2], f"{sha256}_{int(largura)}.jpg")
+
+    def guardar(self, entrada, bloco=1024 * 1024):
+        """Grava o conteúdo de `entrada` (um arquivo aberto) e retorna (sha256, mime, tamanho)
+
+        O arquivo é escrito em um temporário enquanto o hash é calculado e
+        só então movido para o endereço definitivo; se o endereço já
+        existe, o conteúdo é o mesmo e o temporário é descartado.
+        """
+        os.makedirs(self.raiz, exist_ok=True)
+        descritor, temporario = tempfile.mkstemp(dir=self.raiz, suffix='.tmp')
+        resumo = hashlib.sha256()
+        tamanho = 0
+        mime = None
+        try:
+            with os.fdopen(descritor, 'wb') as saida:
+                while True:
+                    pedaco = entrada.read(bloco)
+                    if not pedaco:
+                        break
+                    if mime is None:
+                        mime = detectar_tipo(pedaco[:16])
+                        if mime is None:
+                            raise ErroAnexo("Tipo de arquivo não aceito (use JPEG, PNG, WebP ou PDF)!")
+                    tamanho += len(pedaco)
+                    if tamanho > self.tamanho_maximo:
+                        raise ErroAnexo(f"Arquivo maior que {self.tamanho_maximo // 2 ** 20} MB!")
+                    resumo.update(pedaco)
+                    saida.write(pedaco)
+            if not tamanho:
+                raise ErroAnexo("Arquivo vazio!")
+
+            sha256 = resumo.hexdigest()
+            destino = self.caminho(sha256)
+            if os.path.exists(destino):
+                os.remove(temporario)
+            else:
+                os.makedirs(os.path.dirname(destino), exist_ok=True)
+                os.replace(temporario, destino)
+            return sha256, mime, tamanho
+        except BaseException:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+
+    def apagar(self, sha256):
+        """Apaga o conteúdo e as miniaturas de um endereço que não é mais usado"""
+        caminhos = [self.caminho(sha256)]
+        pasta_miniaturas = os.path.dirname(self.caminho_miniatura(sha256, 0))
+        if os.path.isdir(pasta_miniaturas):
+            caminhos += [os.path.join(pasta_miniaturas, nome) for nome in os.listdir(pasta_miniaturas)
+                         if nome.startswith(f"{sha256}_")]
+        for caminho in caminhos:
+            if os.path.exists(caminho):
+                os.remove(caminho)
+
+    def gerar_miniatura(self, sha256, largura):
+        """Gera a miniatura JPEG de uma imagem (no pool de miniaturas); retorna se gerou"""
+        destino = self.caminho_miniatura(sha256, largura)
+        if Image is None or os.path.exists(destino):
+            return False
+        os.makedirs(os.path.dirname(destino), exist_ok=True)
+        with Image.open(self.caminho(sha256)) as imagem:
+            imagem.thumbnail((largura, largura * 2))
+            temporario = f"{destino}.{os.getpid()}.tmp"
+            imagem.convert('RGB').save(temporario, 'JPEG', quality=85)
+        os.replace(temporario, destino)
+        return True
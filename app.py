@@ -1,22 +1,503 @@
-from flask import Flask, request, redirect, render_template_string, flash, url_for, session
+from flask import (Blueprint, Flask, Response, abort, current_app, has_request_context, request, redirect,
+                   render_template_string, flash, send_file, url_for, session, g, jsonify,
+                   before_render_template, template_rendered)
 import sqlite3
+import click
+from flask.cli import ScriptInfo
+from markupsafe import escape
+import csv
+import hmac
+import io
+import json
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 import os
+import re
+from pathlib import Path
+import threading
+import time
+
+import alteracoes
+from anexos import ArmazemAnexos, ErroAnexo
+import backup
+import consultas
+from cache import criar_backend_cache
+from chaves import chave_texto, faixa_prefixo
+from credenciais import ServicoCredenciais, gerar_hash
+from escrita import ErroOperacao, FilaEscrita
+import eventos
+import isbn
+import perfis
+from limite import criar_limitador
+from registros import Emprestimo, Livro, Usuario
+from replica import CopiaLeitura, caminho_replica
+from sessoes import criar_interface_sessao
+from tarefas import TarefaPeriodica
+import tracos
+import unidades
+from unidades import UNIDADE_PRINCIPAL
+
+bp = Blueprint('biblioteca', __name__, cli_group=None)
+logger = logging.getLogger(__name__)
+
+def configuracao_padrao():
+    """Configuração padrão da aplicação (valores podem vir de variáveis de ambiente)"""
+    cache_arquivo = os.environ.get('BIBLIOTECA_CACHE_ARQUIVO', 'cache.db')
+    cache_backend = os.environ.get('BIBLIOTECA_CACHE', 'memoria')
+    return {
+        'SECRET_KEY': os.environ.get('BIBLIOTECA_SECRET_KEY', 'biblioteca_secreta_2024'),
+        'DATABASE': os.environ.get('BIBLIOTECA_DB', 'biblioteca.db'),
+        # Cada unidade da rede em seu próprio arquivo SQLite (ver unidades.py)
+        'UNIDADES_SEPARADAS': os.environ.get('BIBLIOTECA_UNIDADES_SEPARADAS', '0') == '1',
+
+        # Cria/atualiza o esquema ao criar o app. Desligado: o esquema é feito por
+        # `flask init-db`/`flask migrar` e o app só confere a versão de cada arquivo
+        'CRIAR_TABELAS': False,
+        # Aquecimento opcional: executa as consultas quentes e preenche o cache
+        'AQUECER': os.environ.get('BIBLIOTECA_AQUECER', '0') == '1',
+
+        # Cache das páginas e estatísticas ('memoria' por worker ou 'sqlite' compartilhado)
+        'CACHE_BACKEND': cache_backend,
+        'CACHE_ARQUIVO': cache_arquivo,
+        'CACHE_TTL': 300,
+
+        # Limite de empréstimos simultâneos por tipo de usuário
+        'LIMITES_EMPRESTIMO': {'aluno': 3, 'professor': 10, 'servidor': 5},
+
+        # Prazo do empréstimo em dias e renovações permitidas por empréstimo
+        'EMPRESTIMO_PRAZO': 7,
+        'RENOVACOES_MAXIMO': 2,
+
+        # Multas por atraso por tipo de usuário, em centavos: valor por dia, dias de carência
+        # (atrasos até a carência não geram multa; acima dela são cobrados os dias excedentes)
+        # e teto por empréstimo. O cálculo roda a cada N segundos (0 desliga) e na devolução
+        'MULTAS': {
+            'aluno': {'valor_dia': 100, 'carencia': 2, 'teto': 3000},
+            'professor': {'valor_dia': 100, 'carencia': 5, 'teto': 5000},
+            'servidor': {'valor_dia': 100, 'carencia': 3, 'teto': 4000},
+        },
+        'MULTAS_CALCULAR_A_CADA': int(os.environ.get('BIBLIOTECA_MULTAS_INTERVALO', 3600)),
+
+        # Reservas: dias para retirar um exemplar separado, intervalo (s) da
+        # expiração em segundo plano (0 desliga) e reservas expiradas por transação
+        'RESERVA_PRAZO_RETIRADA': 3,
+        'RESERVAS_EXPIRAR_A_CADA': int(os.environ.get('BIBLIOTECA_RESERVAS_INTERVALO', 300)),
+        'RESERVAS_LOTE': 500,
+
+        # Máximo de operações gravadas juntas em uma transação pela fila de escrita
+        'ESCRITA_LOTE_MAXIMO': 64,
+
+        # Custo do scrypt das senhas (N = 2 ** custo) e processos usados no hash
+        'SENHA_CUSTO': int(os.environ.get('BIBLIOTECA_SENHA_CUSTO', 14)),
+        'SENHA_PROCESSOS': int(os.environ['BIBLIOTECA_SENHA_PROCESSOS']) if 'BIBLIOTECA_SENHA_PROCESSOS' in os.environ else None,
+
+        # Limite de tentativas de login: (tentativas, período em segundos)
+        'LIMITE_BACKEND': os.environ.get('BIBLIOTECA_LIMITE', cache_backend),
+        'LIMITE_ARQUIVO': cache_arquivo,
+        'LIMITE_LOGIN_IP': (20, 60),
+        'LIMITE_LOGIN_CONTA': (5, 300),
+
+        # Sessões: 'cookie' (assinada, padrão do Flask), 'memoria' ou 'sqlite' (no servidor)
+        'SESSAO_BACKEND': os.environ.get('BIBLIOTECA_SESSAO', 'cookie'),
+        'SESSAO_ARQUIVO': cache_arquivo,
+        'SESSAO_TTL': 8 * 3600,
+
+        # Feed de alterações: token dos sistemas externos (sem ele, só admins logados),
+        # máximo de alterações por resposta e espera máxima (s) do long-poll
+        'ALTERACOES_TOKEN': os.environ.get('BIBLIOTECA_ALTERACOES_TOKEN'),
+        'ALTERACOES_LIMITE': 1000,
+        'ALTERACOES_ESPERA_MAXIMA': 30,
+        'ALTERACOES_INTERVALO': 0.5,
+
+        # Cópia de leitura para relatórios e listagens: atualizada a cada N segundos
+        # (a defasagem máxima aparece nas páginas); o diretório pode ser um tmpfs
+        'REPLICA_LEITURA': os.environ.get('BIBLIOTECA_REPLICA', '0') == '1',
+        'REPLICA_ATUALIZAR_A_CADA': int(os.environ.get('BIBLIOTECA_REPLICA_INTERVALO', 60)),
+        'REPLICA_DIRETORIO': os.environ.get('BIBLIOTECA_REPLICA_DIRETORIO'),
+
+        # Backup online: intervalo (s) dos backups automáticos (0 desliga), quantos manter
+        # por arquivo e páginas copiadas por passo, com uma pausa (s) entre os passos
+        'BACKUP_DIRETORIO': os.environ.get('BIBLIOTECA_BACKUP_DIRETORIO', 'backups'),
+        'BACKUP_A_CADA': int(os.environ.get('BIBLIOTECA_BACKUP_INTERVALO', 0)),
+        'BACKUP_MANTER': int(os.environ.get('BIBLIOTECA_BACKUP_MANTER', 7)),
+        'BACKUP_PAGINAS': 256,
+        'BACKUP_PAUSA': 0.005,
+
+        # Anexos (capas e sumários): diretório dos arquivos, tamanho máximo por arquivo,
+        # largura das miniaturas e threads que as geram (miniaturas exigem o Pillow)
+        'ANEXOS_DIRETORIO': os.environ.get('BIBLIOTECA_ANEXOS_DIRETORIO', 'anexos'),
+        'ANEXOS_TAMANHO_MAXIMO': 20 * 2 ** 20,
+        'MINIATURAS_LARGURA': 160,
+        'MINIATURAS_THREADS': 2,
+
+        # Perfil de uma requisição, pedido por um admin com ?perfil=cprofile|amostras
+        # (ou o cabeçalho X-Perfil): diretório, quantos perfis manter e intervalo (s)
+        # entre as amostras da pilha
+        'PERFIS_DIRETORIO': os.environ.get('BIBLIOTECA_PERFIS_DIRETORIO', 'perfis'),
+        'PERFIS_MANTER': 50,
+        'PERFIS_INTERVALO_AMOSTRAS': 0.002,
+
+        # Traços das requisições (spans da rota, das consultas e dos templates) em JSONL
+        # no formato OTLP/JSON: arquivo (sem ele, desligado), fração das requisições
+        # gravadas e duração (ms) a partir da qual a requisição é sempre gravada
+        'TRACOS_ARQUIVO': os.environ.get('BIBLIOTECA_TRACOS_ARQUIVO'),
+        'TRACOS_AMOSTRAGEM': float(os.environ.get('BIBLIOTECA_TRACOS_AMOSTRAGEM', 0.01)),
+        'TRACOS_LENTO_MS': float(os.environ.get('BIBLIOTECA_TRACOS_LENTO_MS', 500)),
+    }
+
+def criar_app(config=None):
+    """Cria e configura a aplicação Flask
+
+    Não altera o banco: use `flask init-db` (ou `flask migrar`, em um
+    banco existente) e `flask seed` para isso. Um arquivo sem o esquema
+    da versão atual impede o app de subir.
+    """
+    app = Flask(__name__)
+    app.config.from_mapping(configuracao_padrao())
+    if config:
+        app.config.from_mapping(config)
+
+    interface_sessao = criar_interface_sessao(app.config)
+    if interface_sessao is not None:
+        app.session_interface = interface_sessao
+
+    app.register_blueprint(bp)
+
+    if app.config['TRACOS_ARQUIVO']:
+        if tracos.observar_consulta not in consultas.observadores:
+            consultas.observadores.append(tracos.observar_consulta)
+        before_render_template.connect(abrir_span_template, app)
+        template_rendered.connect(fechar_span_template, app)
+
+    with app.app_context():
+        if app.config['CRIAR_TABELAS']:
+            migrar_esquema()
+        else:
+            verificar_esquema()
+        if app.config['AQUECER']:
+            aquecer()
+
+    return app
+
+_recursos_lock = threading.Lock()
+
+def recurso(nome, criar):
+    """Retorna um recurso compartilhado do app (cache, fila...), criando-o no primeiro uso"""
+    app = current_app._get_current_object()
+    recursos = app.extensions.setdefault('biblioteca', {})
+    if nome not in recursos:
+        with _recursos_lock:
+            if nome not in recursos:
+                recursos[nome] = criar(app)
+    return recursos[nome]
+
+def encerrar_recursos(app):
+    """Encerra as threads e processos auxiliares criados pelo app"""
+    recursos = app.extensions.get('biblioteca', {})
+    if 'executor_miniaturas' in recursos:
+        recursos.pop('executor_miniaturas').shutdown(wait=False)
+    for nome in [nome for nome in recursos if nome.startswith('fila_escrita:')]:
+        recursos.pop(nome).encerrar()
+    if 'credenciais' in recursos:
+        recursos.pop('credenciais').encerrar()
+    if 'tarefa_reservas' in recursos:
+        recursos.pop('tarefa_reservas').encerrar()
+    if 'tarefa_replica' in recursos:
+        recursos.pop('tarefa_replica').encerrar()
+    if 'tarefa_backup' in recursos:
+        recursos.pop('tarefa_backup').encerrar()
+    if 'tarefa_multas' in recursos:
+        recursos.pop('tarefa_multas').encerrar()
+
+def unidade_atual():
+    """Unidade em que o usuário logado está (fora de uma requisição, a principal)"""
+    if has_request_context():
+        return session.get('unidade_id', UNIDADE_PRINCIPAL)
+    return UNIDADE_PRINCIPAL
+
+def arquivo_banco(unidade_id=None):
+    """Arquivo SQLite de uma unidade (por padrão, a da requisição atual)"""
+    config = current_app.config
+    if not config['UNIDADES_SEPARADAS']:
+        return config['DATABASE']
+    return unidades.arquivo_unidade(config['DATABASE'], unidade_id or unidade_atual())
+
+def listar_unidades():
+    """Retorna as unidades cadastradas no banco principal"""
+    conn = conectar(current_app.config['DATABASE'])
+    cursor = conn.cursor()
+    lista = consultas.buscar_todos(cursor, 'unidades.listar')
+    conn.close()
+    return lista
+
+def ids_unidades():
+    """Unidades com arquivo próprio (só a principal quando estão todas no mesmo banco)"""
+    if not current_app.config['UNIDADES_SEPARADAS']:
+        return [UNIDADE_PRINCIPAL]
+    return [unidade['id'] for unidade in listar_unidades()]
+
+def arquivos_unidades():
+    """Arquivos SQLite de todas as unidades, começando pelo banco principal"""
+    return [arquivo_banco(unidade_id) for unidade_id in ids_unidades()]
+
+def chave_unidade(chave):
+    """Chave de cache de uma página que muda conforme o arquivo da unidade"""
+    if current_app.config['UNIDADES_SEPARADAS']:
+        return f"{chave}:unidade{unidade_atual()}"
+    return chave
+
+def iterar_rede(nome, parametros=(), registro=None, chave=None, reverso=False):
+    """Percorre uma consulta em todas as unidades, mesclando pela ordem da própria consulta"""
+    conexoes = [conectar_leitura(arquivo) for arquivo in arquivos_unidades()]
+    try:
+        yield from unidades.mesclar(
+            [consultas.iterar(conn.cursor(), nome, parametros, registro) for conn in conexoes],
+            chave, reverso
+        )
+    finally:
+        for conn in conexoes:
+            conn.close()
 
-app = Flask(__name__)
-app.secret_key = 'biblioteca_secreta_2024'
-
-def conectar():
-    """Abre conexão com o banco de dados SQLite"""
-    conn = sqlite3.connect("biblioteca.db")
+def somar_rede(nome, parametros=()):
+    """Soma o 'total' de uma consulta de contagem em todas as unidades"""
+    total = 0
+    for arquivo in arquivos_unidades():
+        conn = conectar_leitura(arquivo)
+        total += consultas.buscar_um(conn.cursor(), nome, parametros)['total']
+        conn.close()
+    return total
+
+def conectar(caminho=None, somente_leitura=False, criar=False):
+    """Abre conexão com o banco de dados SQLite (por padrão, o da unidade atual)
+
+    Só `criar` (usado por criar_tabelas) cria o arquivo se ele não existir:
+    um id de unidade inválido nunca deixa um banco vazio no disco.
+    """
+    caminho = caminho or arquivo_banco()
+    modo = 'ro' if somente_leitura else ('rwc' if criar else 'rw')
+    conn = sqlite3.connect(
+        f"{Path(caminho).resolve().as_uri()}?mode={modo}", uri=True,
+        cached_statements=consultas.TAMANHO_CACHE
+    )
     conn.row_factory = sqlite3.Row
     return conn
 
-def criar_tabelas():
+def replica(caminho=None):
+    """Retorna a cópia de leitura de um arquivo (uma por arquivo no processo)"""
+    caminho = caminho or arquivo_banco()
+    return recurso(f'replica:{caminho}', lambda app: CopiaLeitura(
+        caminho, caminho_replica(caminho, app.config['REPLICA_DIRETORIO']),
+        app.config['REPLICA_ATUALIZAR_A_CADA']
+    ))
+
+def caminho_leitura(caminho=None):
+    """Arquivo de onde relatórios e listagens leem: a cópia, se ativa, ou o próprio banco"""
+    caminho = caminho or arquivo_banco()
+    if not current_app.config['REPLICA_LEITURA']:
+        return caminho
+    return replica(caminho).garantir()
+
+def conectar_leitura(caminho=None):
+    """Abre conexão para consultas de relatório e listagem (nunca para escrever)"""
+    if not current_app.config['REPLICA_LEITURA']:
+        return conectar(caminho)
+    return conectar(caminho_leitura(caminho), somente_leitura=True)
+
+def momento_leitura():
+    """Instante da cópia de leitura mais antiga da rede (None sem cópia de leitura)"""
+    if not current_app.config['REPLICA_LEITURA']:
+        return None
+    momentos = []
+    for arquivo in arquivos_unidades():
+        copia = replica(arquivo)
+        copia.garantir()
+        momentos.append(copia.atualizado_em())
+    return min(momentos)
+
+def chave_leitura(chave):
+    """Chave de cache de um fragmento lido da cópia: muda a cada atualização da cópia"""
+    chave = chave_unidade(chave)
+    momento = momento_leitura()
+    if momento is None:
+        return chave
+    return f"{chave}:copia{int(momento)}"
+
+def aviso_leitura():
+    """Aviso com a idade dos dados exibidos, quando vêm da cópia de leitura"""
+    momento = momento_leitura()
+    if momento is None:
+        return ""
+    idade = max(0, int(time.time() - momento))
+    return f'''
+    <p style="color: #666; font-size: 0.9em;">
+        📸 Dados de {datetime.fromtimestamp(momento).strftime('%d/%m/%Y %H:%M:%S')} (há {idade} s;
+        atualizados a cada {current_app.config['REPLICA_ATUALIZAR_A_CADA']} s).
+        Empréstimos e devoluções recentes podem ainda não aparecer.
+    </p>
+    '''
+
+def executor_miniaturas():
+    """Retorna o pool que gera as miniaturas das capas fora das requisições"""
+    return recurso('executor_miniaturas', lambda app: ThreadPoolExecutor(
+        max_workers=app.config['MINIATURAS_THREADS'], thread_name_prefix='miniaturas'
+    ))
+
+def armazem_anexos(unidade_id=None):
+    """Retorna o armazenamento de anexos do arquivo da unidade (um diretório por arquivo)"""
+    if not current_app.config['UNIDADES_SEPARADAS']:
+        unidade_id = UNIDADE_PRINCIPAL
+    unidade_id = unidade_id or unidade_atual()
+    def criar(app):
+        raiz = app.config['ANEXOS_DIRETORIO']
+        if unidade_id != UNIDADE_PRINCIPAL:
+            raiz = os.path.join(raiz, f"unidade{unidade_id}")
+        return ArmazemAnexos(raiz, app.config['ANEXOS_TAMANHO_MAXIMO'])
+    return recurso(f'anexos:{unidade_id}', criar)
+
+def _gerar_csv(caminhos, nome, parametros, somente_leitura=False):
+    saida = io.StringIO()
+    escritor = csv.writer(saida)
+    for indice, caminho in enumerate(caminhos):
+        conn = conectar(caminho, somente_leitura)
+        try:
+            cursor = conn.cursor()
+            linhas = consultas.iterar(cursor, nome, parametros)
+            primeira = next(linhas, None)
+
+            if indice == 0:
+                escritor.writerow([coluna[0] for coluna in cursor.description])
+            if primeira is not None:
+                escritor.writerow(primeira)
+                escritor.writerows(linhas)
+        finally:
+            conn.close()
+    return saida.getvalue()
+
+def gerar_csv(nome, parametros=()):
+    """Gera o CSV de uma consulta do registro
+
+    As linhas são lidas em lotes e escritas direto no CSV. Com as unidades
+    em arquivos separados, as linhas de cada unidade vêm uma após a outra.
+    Com a cópia de leitura ativa, o CSV sai da cópia.
+    """
+    caminhos = [caminho_leitura(arquivo) for arquivo in arquivos_unidades()]
+    return _gerar_csv(caminhos, nome, parametros, current_app.config['REPLICA_LEITURA'])
+
+def fila_escrita(unidade_id=None):
+    """Retorna a fila de escrita do arquivo da unidade (uma por arquivo no processo)"""
+    caminho = arquivo_banco(unidade_id)
+    def criar(app):
+        return FilaEscrita(lambda: conectar(caminho), lote_maximo=app.config['ESCRITA_LOTE_MAXIMO'])
+    return recurso(f'fila_escrita:{caminho}', criar)
+
+def credenciais():
+    """Retorna o serviço de hash de senhas do processo"""
+    return recurso('credenciais', lambda app: ServicoCredenciais(
+        custo=app.config['SENHA_CUSTO'], processos=app.config['SENHA_PROCESSOS']
+    ))
+
+def limitador():
+    """Retorna o armazenamento dos baldes de tentativas de login"""
+    return recurso('limitador', lambda app: criar_limitador(app.config))
+
+def chave_login(tipo_usuario, identificador):
+    # Só pela conta, de qualquer IP: trocar de endereço não dá mais tentativas contra ela
+    return f"conta:{tipo_usuario}:{identificador}"
+
+def espera_login(tipo_usuario, identificador):
+    """Consome uma tentativa de login; retorna os segundos de espera se bloqueado"""
+    capacidade, periodo = current_app.config['LIMITE_LOGIN_IP']
+    permitido, espera = limitador().consumir(f"ip:{request.remote_addr}", capacidade, periodo)
+    if not permitido:
+        return espera
+
+    capacidade, periodo = current_app.config['LIMITE_LOGIN_CONTA']
+    permitido, espera = limitador().consumir(chave_login(tipo_usuario, identificador), capacidade, periodo)
+    return 0 if permitido else espera
+
+def login_aceito(tipo_usuario, identificador):
+    """Devolve a ficha da conta: só as tentativas que falharam contam para o bloqueio"""
+    capacidade, periodo = current_app.config['LIMITE_LOGIN_CONTA']
+    limitador().devolver(chave_login(tipo_usuario, identificador), capacidade, periodo)
+
+def operacao_inserir(cursor, nome, parametros):
+    """Executa um INSERT do registro pela fila de escrita e retorna o id gerado"""
+    return consultas.executar(cursor, nome, parametros).lastrowid
+
+def obter_cache():
+    """Retorna o backend de cache do app, criando-o no primeiro uso"""
+    return recurso('cache', lambda app: criar_backend_cache(app.config))
+
+def invalidar_cache(*namespaces):
+    """Invalida as páginas em cache afetadas por uma alteração no acervo"""
+    obter_cache().invalidar(*namespaces)
+
+# Versão do esquema gravada em PRAGMA user_version por criar_tabelas; aumente a
+# cada migração nova para que os workers não subam sobre um banco sem ela
+VERSAO_ESQUEMA = 3
+
+class EsquemaDesatualizado(RuntimeError):
+    """Arquivo do banco sem o esquema da versão atual"""
+
+def versao_esquema(caminho):
+    """Versão do esquema de um arquivo (None se o arquivo não existe)"""
+    if not os.path.exists(caminho):
+        return None
+    conn = conectar(caminho, somente_leitura=True)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+def em_comando_flask():
+    """Se o app está sendo carregado pelo CLI do Flask (flask init-db, flask migrar...)"""
+    contexto = click.get_current_context(silent=True)
+    return contexto is not None and contexto.find_object(ScriptInfo) is not None
+
+def verificar_esquema():
+    """Confere a versão do esquema de todos os arquivos; levanta EsquemaDesatualizado
+
+    Pelo CLI do Flask só avisa, para que `flask init-db` e `flask migrar`
+    possam rodar justamente sobre esses arquivos.
+    """
+    # As unidades são listadas pelo banco principal: só depois de ele estar em dia
+    principal = current_app.config['DATABASE']
+    em_dia = (versao_esquema(principal) or 0) >= VERSAO_ESQUEMA
+    for arquivo in arquivos_unidades() if em_dia else [principal]:
+        versao = versao_esquema(arquivo)
+        if versao is not None and versao >= VERSAO_ESQUEMA:
+            continue
+        mensagem = (f"{arquivo}: esquema {'inexistente' if versao is None else f'na versão {versao}'}, "
+                    f"esperada {VERSAO_ESQUEMA}. Rode `flask --app app init-db` (banco novo) "
+                    f"ou `flask --app app migrar`.")
+        if em_comando_flask():
+            click.echo(f"Aviso: {mensagem}", err=True)
+            return
+        raise EsquemaDesatualizado(mensagem)
+
+def migrar_esquema():
+    """Cria ou atualiza o esquema do banco principal e dos arquivos das unidades"""
+    criar_tabelas()
+    for arquivo in arquivos_unidades()[1:]:
+        criar_tabelas(arquivo)
+
+def criar_tabelas(caminho=None):
     """Função para criar todas as tabelas necessárias"""
-    conn = conectar()
+    conn = conectar(caminho or current_app.config['DATABASE'], criar=True)
     cursor = conn.cursor()
 
+    # Tabela de unidades (bibliotecas dos campi); a unidade 1 é a principal
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS unidades (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            nome TEXT NOT NULL,
+            sigla TEXT UNIQUE NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO unidades (id, nome, sigla) VALUES (1, 'Biblioteca Central', 'CENTRAL')")
+
     # Tabela de livros
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS livros (
@@ -25,7 +506,10 @@ def criar_tabelas():
             autor TEXT NOT NULL,
             isbn TEXT UNIQUE,
             ano INTEGER,
-            quantidade INTEGER DEFAULT 1
+            quantidade INTEGER DEFAULT 1,
+            isbn13 TEXT,
+            titulo_chave TEXT,
+            autor_chave TEXT
         )
     ''')
 
@@ -35,7 +519,11 @@ def criar_tabelas():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             nome TEXT NOT NULL,
             matricula TEXT UNIQUE NOT NULL,
-            curso TEXT
+            curso TEXT,
+            tipo TEXT NOT NULL DEFAULT 'aluno',
+            emprestimos_ativos INTEGER NOT NULL DEFAULT 0,
+            unidade_id INTEGER NOT NULL DEFAULT 1 REFERENCES unidades(id),
+            nome_chave TEXT
         )
     ''')
 
@@ -49,11 +537,140 @@ def criar_tabelas():
             data_prevista DATE NOT NULL,
             data_devolucao DATE,
             status TEXT DEFAULT 'emprestado',
+            exemplar_id INTEGER REFERENCES exemplares(id),
+            renovacoes INTEGER NOT NULL DEFAULT 0,
+            unidade_id INTEGER NOT NULL DEFAULT 1 REFERENCES unidades(id),
             FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
             FOREIGN KEY (livro_id) REFERENCES livros(id)
         )
     ''')
 
+    # Tabela de exemplares (cada cópia física de um livro, com seu código de barras)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS exemplares (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            livro_id INTEGER NOT NULL,
+            codigo_barras TEXT UNIQUE NOT NULL,
+            status TEXT NOT NULL DEFAULT 'disponivel',
+            unidade_id INTEGER NOT NULL DEFAULT 1 REFERENCES unidades(id),
+            FOREIGN KEY (livro_id) REFERENCES livros(id)
+        )
+    ''')
+
+    # Tabela de reservas (fila de espera por livro)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reservas (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            livro_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            criado_em TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'aguardando',
+            exemplar_id INTEGER,
+            expira_em TEXT,
+            unidade_id INTEGER NOT NULL DEFAULT 1 REFERENCES unidades(id),
+            FOREIGN KEY (livro_id) REFERENCES livros(id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios(id),
+            FOREIGN KEY (exemplar_id) REFERENCES exemplares(id)
+        )
+    ''')
+
+    # Log de circulação: só recebe INSERTs, na mesma transação de cada operação
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS eventos_circulacao (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            criado_em TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            livro_id INTEGER,
+            usuario_id INTEGER,
+            exemplar_id INTEGER,
+            emprestimo_id INTEGER,
+            unidade_id INTEGER,
+            quantidade_delta INTEGER NOT NULL DEFAULT 0,
+            ativos_delta INTEGER NOT NULL DEFAULT 0,
+            dados TEXT
+        )
+    ''')
+
+    # Snapshots dos contadores, ponto de partida do replay do log
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS snapshots_circulacao (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            seq INTEGER NOT NULL,
+            criado_em TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS snapshot_livros (
+            snapshot_id INTEGER NOT NULL,
+            livro_id INTEGER NOT NULL,
+            quantidade INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, livro_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS snapshot_usuarios (
+            snapshot_id INTEGER NOT NULL,
+            usuario_id INTEGER NOT NULL,
+            emprestimos_ativos INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, usuario_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # Relatório de circulação: movimentos por dia e tipo, somados a cada evento do log
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS relatorio_circulacao (
+            dia TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            total INTEGER NOT NULL,
+            PRIMARY KEY (dia, tipo)
+        ) WITHOUT ROWID
+    ''')
+
+    # Feed de alterações de livros, usuários e empréstimos (gatilhos em alteracoes.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS alteracoes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabela TEXT NOT NULL,
+            registro_id INTEGER NOT NULL,
+            operacao TEXT NOT NULL,
+            criado_em TEXT NOT NULL
+        )
+    ''')
+
+    # Anexos dos livros: só metadados, o conteúdo fica no disco pelo SHA-256
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS anexos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            livro_id INTEGER NOT NULL REFERENCES livros(id),
+            tipo TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            mime TEXT NOT NULL,
+            nome TEXT,
+            tamanho INTEGER NOT NULL,
+            criado_em TEXT NOT NULL
+        )
+    ''')
+
+    # Livro-razão das multas: uma linha por empréstimo atrasado (recalculada em lote)
+    # e os pagamentos; o saldo do usuário é a diferença das duas somas
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS multas (
+            emprestimo_id INTEGER PRIMARY KEY REFERENCES emprestimos(id),
+            usuario_id INTEGER NOT NULL REFERENCES usuarios(id),
+            dias INTEGER NOT NULL,
+            valor INTEGER NOT NULL,
+            atualizado_em TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pagamentos_multa (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            usuario_id INTEGER NOT NULL REFERENCES usuarios(id),
+            valor INTEGER NOT NULL,
+            criado_em TEXT NOT NULL
+        )
+    ''')
+
     # Tabela de administradores
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS administradores (
@@ -64,20 +681,280 @@ def criar_tabelas():
         )
     ''')
 
+    # Índices das consultas do aluno (chaveadas pelo id guardado na sessão)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_emprestimos_usuario_status_data
+        ON emprestimos (usuario_id, status, data_emprestimo)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_emprestimos_usuario_status_devolucao
+        ON emprestimos (usuario_id, status, data_devolucao)
+    """)
+
+    # Índice de disponibilidade: acha uma cópia livre de um livro sem varrer a tabela
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_exemplares_livro_status
+        ON exemplares (livro_id, status)
+    """)
+
+    # Fila de reservas: o primeiro da fila de um livro é a primeira entrada do índice
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservas_livro_criado
+        ON reservas (livro_id, criado_em) WHERE status = 'aguardando'
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservas_usuario_livro
+        ON reservas (usuario_id, livro_id, status)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_reservas_separadas_expira
+        ON reservas (expira_em) WHERE status = 'separada'
+    """)
+
+    # Anexos: os de um livro (listagem e troca da capa) e os usos de um arquivo
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_anexos_livro_tipo ON anexos (livro_id, tipo)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_anexos_sha256 ON anexos (sha256)")
+
+    # Multas: o cálculo em lote parte dos empréstimos abertos já vencidos, e os saldos
+    # por usuário somam só o índice (usuario_id, valor), sem ler as tabelas
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_emprestimos_status_prevista
+        ON emprestimos (status, data_prevista)
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_multas_usuario_valor ON multas (usuario_id, valor)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pagamentos_multa_usuario_valor ON pagamentos_multa (usuario_id, valor)")
+
+    # Colunas adicionadas depois da primeira versão do banco
+    # (as chaves primeiro: as migrações abaixo já listam livros ordenados por elas)
+    if adicionar_coluna(cursor, 'livros', 'titulo_chave', "TEXT"):
+        adicionar_coluna(cursor, 'livros', 'autor_chave', "TEXT")
+        preencher_chaves(cursor, 'livros')
+    if adicionar_coluna(cursor, 'usuarios', 'nome_chave', "TEXT"):
+        preencher_chaves(cursor, 'usuarios')
+    adicionar_coluna(cursor, 'usuarios', 'tipo', "TEXT NOT NULL DEFAULT 'aluno'")
+    if adicionar_coluna(cursor, 'usuarios', 'emprestimos_ativos', "INTEGER NOT NULL DEFAULT 0"):
+        recalcular_emprestimos_ativos(cursor)
+    if adicionar_coluna(cursor, 'emprestimos', 'exemplar_id', "INTEGER REFERENCES exemplares(id)"):
+        criar_exemplares_existentes(cursor)
+    adicionar_coluna(cursor, 'emprestimos', 'renovacoes', "INTEGER NOT NULL DEFAULT 0")
+    for tabela in ('usuarios', 'emprestimos', 'exemplares'):
+        adicionar_coluna(cursor, tabela, 'unidade_id', "INTEGER NOT NULL DEFAULT 1")
+    if adicionar_coluna(cursor, 'reservas', 'unidade_id', "INTEGER NOT NULL DEFAULT 1"):
+        # Reservas já separadas ficam na unidade do exemplar que as espera
+        cursor.execute("""
+            UPDATE reservas SET unidade_id = (SELECT unidade_id FROM exemplares WHERE id = reservas.exemplar_id)
+            WHERE exemplar_id IS NOT NULL
+        """)
+    isbn13_novo = adicionar_coluna(cursor, 'livros', 'isbn13', "TEXT")
+
+    # ISBN normalizado: o índice barra duplicatas e a leitura do código de barras é uma busca só
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_livros_isbn13
+        ON livros (isbn13) WHERE isbn13 IS NOT NULL
+    """)
+    if isbn13_novo:
+        depois_de = 0
+        while depois_de is not None:
+            depois_de = operacao_normalizar_isbns(cursor, depois_de, 1000)[0]
+
+    # Índices por unidade: o balcão de uma unidade só percorre as suas linhas
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_exemplares_unidade_livro_status
+        ON exemplares (unidade_id, livro_id, status)
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_emprestimos_unidade_status_data
+        ON emprestimos (unidade_id, status, data_emprestimo)
+    """)
+    cursor.execute("DROP INDEX IF EXISTS idx_usuarios_unidade_nome")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_usuarios_unidade_nome_chave
+        ON usuarios (unidade_id, nome_chave)
+    """)
+
+    # Exemplares de outras unidades criados antes do prefixo da unidade no código de barras
+    consultas.executar(cursor, 'exemplares.prefixar_unidade')
+
+    # Chaves sem acento/maiúsculas: ordenação das listagens e busca por prefixo pelo índice
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_livros_titulo_chave ON livros (titulo_chave)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_livros_autor_chave ON livros (autor_chave)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_usuarios_nome_chave ON usuarios (nome_chave)")
+
+    # As colunas das tabelas observadas já existem: os gatilhos podem ser criados
+    alteracoes.criar_gatilhos(cursor)
+
+    # Bancos anteriores ao log de circulação partem de um snapshot do estado atual
+    if consultas.buscar_um(cursor, 'snapshots.ultimo') is None:
+        eventos.criar_snapshot(cursor)
+
+    # Bancos anteriores ao relatório de circulação têm o log, mas não a tabela
+    if eventos.circulacao_divergente(cursor):
+        eventos.reconstruir_circulacao(cursor)
+
+    cursor.execute(f"PRAGMA user_version = {VERSAO_ESQUEMA}")
     conn.commit()
     conn.close()
 
+def adicionar_coluna(cursor, tabela, coluna, definicao):
+    """Adiciona uma coluna a uma tabela existente, se ainda não existir"""
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    if coluna in [linha['name'] for linha in cursor.fetchall()]:
+        return False
+    cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+    return True
+
+def recalcular_emprestimos_ativos(cursor):
+    """Recalcula o contador de empréstimos ativos de todos os usuários"""
+    consultas.executar(cursor, 'usuarios.recalcular_contadores')
+
+# Tabela -> (consulta das linhas sem chave, atualização das chaves)
+CONSULTAS_CHAVES = {
+    'livros': ('chaves.livros_pendentes', 'chaves.definir_livro'),
+    'usuarios': ('chaves.usuarios_pendentes', 'chaves.definir_usuario'),
+}
+
+def operacao_preencher_chaves(cursor, tabela, depois_de, lote):
+    """Calcula as chaves de ordenação de um lote de linhas (executada pela fila de escrita)
+
+    Retorna (último id do lote ou None no fim, linhas preenchidas).
+    """
+    pendentes, definir = CONSULTAS_CHAVES[tabela]
+    linhas = consultas.buscar_todos(cursor, pendentes, (depois_de, lote))
+    for linha in linhas:
+        valores = tuple(linha)
+        consultas.executar(cursor, definir, tuple(chave_texto(valor) for valor in valores[1:]) + (valores[0],))
+    return (linhas[-1]['id'] if len(linhas) == lote else None), len(linhas)
+
+def preencher_chaves(cursor, tabela, lote=1000):
+    """Preenche as chaves de todas as linhas de uma tabela, um lote por vez (migração)"""
+    depois_de = 0
+    while depois_de is not None:
+        depois_de = operacao_preencher_chaves(cursor, tabela, depois_de, lote)[0]
+
+def operacao_normalizar_isbns(cursor, depois_de, lote):
+    """Preenche o ISBN-13 de um lote de livros (executada pela fila de escrita)
+
+    Migração dos cadastros antigos: um ISBN com o dígito verificador errado
+    é reparado, e cada livro reparado vai para o log. Livros cujo ISBN
+    normalizado já pertence a outro livro ficam sem ISBN-13: são as
+    duplicatas que `flask mesclar-isbn` junta.
+    Retorna (último id do lote ou None no fim, preenchidos, duplicados, reparados).
+    """
+    livros = consultas.buscar_todos(cursor, 'livros.sem_isbn13', (depois_de, lote))
+    preenchidos = duplicados = reparados = 0
+    for livro in livros:
+        normalizado = isbn.reparar(livro['isbn'])
+        if normalizado is None:
+            continue
+        if consultas.buscar_um(cursor, 'livros.por_isbn13', (normalizado,)):
+            duplicados += 1
+            continue
+        consultas.executar(cursor, 'livros.definir_isbn13', (normalizado, livro['id']))
+        preenchidos += 1
+        if isbn.normalizar(livro['isbn']) is None:
+            reparados += 1
+            logger.warning("Livro %s (%s): ISBN %s com dígito verificador errado; ISBN-13 gravado como %s",
+                           livro['id'], livro['titulo'], livro['isbn'], normalizado)
+    return (livros[-1]['id'] if len(livros) == lote else None), preenchidos, duplicados, reparados
+
+def codigo_barras(livro_id, sequencia, unidade_id=UNIDADE_PRINCIPAL):
+    """Código de barras de um exemplar: id do livro seguido do número da cópia
+
+    Fora da unidade principal o código começa com o id da unidade ("2-0000010001"):
+    com as unidades em arquivos separados, o mesmo livro_id existe em cada arquivo
+    e o código precisa continuar único na rede.
+    """
+    codigo = f"{livro_id:06d}{sequencia:04d}"
+    if int(unidade_id) == UNIDADE_PRINCIPAL:
+        return codigo
+    return f"{int(unidade_id)}-{codigo}"
+
+def criar_exemplares(cursor, livro_id, quantidade, status='disponivel', unidade_id=UNIDADE_PRINCIPAL):
+    """Cadastra `quantidade` exemplares de um livro na unidade e retorna os seus ids"""
+    inicio = consultas.buscar_um(cursor, 'exemplares.contar_do_livro', (livro_id,))['total']
+    return [
+        consultas.executar(cursor, 'exemplares.inserir', (
+            livro_id, codigo_barras(livro_id, sequencia, unidade_id), status, unidade_id
+        )).lastrowid
+        for sequencia in range(inicio + 1, inicio + quantidade + 1)
+    ]
+
+def criar_exemplares_existentes(cursor):
+    """Cria os exemplares dos livros cadastrados antes da tabela de exemplares"""
+    for livro in consultas.buscar_todos(cursor, 'livros.listar'):
+        # Uma cópia para cada empréstimo ativo e o restante da quantidade como disponível
+        ativos = consultas.buscar_todos(cursor, 'emprestimos.ativos_do_livro', (livro['id'],))
+        emprestados = criar_exemplares(cursor, livro['id'], len(ativos), 'emprestado')
+        for emprestimo, exemplar_id in zip(ativos, emprestados):
+            consultas.executar(cursor, 'emprestimos.vincular_exemplar', (exemplar_id, emprestimo['id']))
+        criar_exemplares(cursor, livro['id'], max(livro['quantidade'], 0))
+
+def verificar_contadores(corrigir=False):
+    """Compara o contador de empréstimos ativos com a tabela de empréstimos"""
+    divergencias = []
+    for arquivo in arquivos_unidades():
+        conn = conectar(arquivo)
+        cursor = conn.cursor()
+        encontradas = consultas.buscar_todos(cursor, 'usuarios.contadores_divergentes')
+
+        if encontradas and corrigir:
+            recalcular_emprestimos_ativos(cursor)
+            eventos.criar_snapshot(cursor)
+            conn.commit()
+            invalidar_cache('estatisticas')
+
+        conn.close()
+        divergencias.extend(encontradas)
+    return divergencias
+
+def verificar_quantidades(corrigir=False):
+    """Compara a quantidade disponível de cada livro com os seus exemplares"""
+    divergencias = []
+    for arquivo in arquivos_unidades():
+        conn = conectar(arquivo)
+        cursor = conn.cursor()
+        encontradas = consultas.buscar_todos(cursor, 'livros.quantidades_divergentes')
+
+        if encontradas and corrigir:
+            consultas.executar(cursor, 'livros.recalcular_quantidades')
+            eventos.criar_snapshot(cursor)
+            conn.commit()
+            invalidar_cache('estatisticas', 'livros', 'relatorios')
+
+        conn.close()
+        divergencias.extend(encontradas)
+    return divergencias
+
+def limite_emprestimos(tipo):
+    """Retorna o limite de empréstimos simultâneos para o tipo de usuário"""
+    limites = current_app.config['LIMITES_EMPRESTIMO']
+    return limites.get(tipo, limites['aluno'])
+
+def formatar_reais(centavos):
+    """Valor em centavos como texto em reais (R$ 1.234,50)"""
+    texto = f"{abs(centavos or 0) / 100:,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+    return f"{'-' if (centavos or 0) < 0 else ''}R$ {texto}"
+
+def ler_reais(texto):
+    """Centavos de um valor digitado em reais ("12,50", "1.234,50" ou "12.50")"""
+    texto = (texto or '').strip().replace('R$', '').strip()
+    if ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    return round(float(texto) * 100)
+
+def regras_multas():
+    """Regras de multa da configuração no formato JSON lido pelo cálculo no SQLite"""
+    return json.dumps(current_app.config['MULTAS'])
+
 def criar_admin_padrao():
     """Cria um administrador padrão se não existir"""
-    conn = conectar()
+    conn = conectar(current_app.config['DATABASE'])
     cursor = conn.cursor()
 
-    cursor.execute("SELECT COUNT(*) as total FROM administradores")
-    if cursor.fetchone()['total'] == 0:
-        cursor.execute("""
-            INSERT INTO administradores (nome, usuario, senha)
-            VALUES ('Administrador', 'admin', 'admin123')
-        """)
+    if consultas.buscar_um(cursor, 'admin.contar')['total'] == 0:
+        consultas.executar(cursor, 'admin.inserir', (
+            'Administrador', 'admin', gerar_hash('admin123', current_app.config['SENHA_CUSTO'])
+        ))
         conn.commit()
 
     conn.close()
@@ -90,12 +967,93 @@ def verificar_aluno():
     """Verifica se o usuário é aluno"""
     return session.get('tipo_usuario') == 'aluno'
 
+def usuario_logado():
+    """Retorna o registro do aluno logado, buscando no banco uma vez por requisição"""
+    if 'usuario_logado' not in g:
+        conn = conectar()
+        cursor = conn.cursor()
+        g.usuario_logado = consultas.buscar_um(cursor, 'usuarios.por_id', (session.get('usuario_id'),))
+        conn.close()
+    return g.usuario_logado
+
+def emprestimos_do_usuario(limite_historico=10):
+    """Retorna os empréstimos do aluno logado (ativos e últimas devoluções)
+
+    O resultado fica guardado em `g`, então as várias seções de uma mesma
+    página compartilham uma única consulta ao banco.
+    """
+    if 'emprestimos_usuario' not in g:
+        usuario_id = session.get('usuario_id')
+        conn = conectar()
+        cursor = conn.cursor()
+        g.emprestimos_usuario = list(consultas.iterar(
+            cursor, 'emprestimos.do_usuario', (usuario_id, usuario_id, limite_historico), Emprestimo
+        ))
+        conn.close()
+    return g.emprestimos_usuario
+
+def iniciar_sessao():
+    """Prepara a sessão para um novo login"""
+    # Nas sessões do servidor o identificador é trocado para evitar fixação de sessão
+    if hasattr(session, 'regenerar'):
+        session.regenerar()
+
+def unidade_cadastrada(unidade_id):
+    """Registro da unidade no cadastro do banco principal, ou None se ela não existir"""
+    if unidade_id is None:
+        return None
+    conn = conectar(current_app.config['DATABASE'])
+    unidade = consultas.buscar_um(conn.cursor(), 'unidades.por_id', (unidade_id,))
+    conn.close()
+    return unidade
+
+def unidade_escolhida():
+    """Unidade escolhida no formulário (a principal se não houver escolha)
+
+    Retorna None se o id não estiver no cadastro de unidades: ele nunca
+    chega a virar o nome de um arquivo de banco.
+    """
+    try:
+        unidade_id = int(request.form.get('unidade_id') or UNIDADE_PRINCIPAL)
+    except ValueError:
+        return UNIDADE_PRINCIPAL
+    return unidade_id if unidade_cadastrada(unidade_id) else None
+
+def entrar_na_unidade(unidade_id):
+    """Passa a sessão para a unidade indicada; retorna False se ela não existir"""
+    unidade = unidade_cadastrada(unidade_id)
+    if not unidade:
+        return False
+    session['unidade_id'] = unidade['id']
+    session['unidade_nome'] = unidade['nome']
+    return True
+
+def campo_unidade(selecionada=None, rotulo="Unidade:"):
+    """Campo de escolha da unidade (vazio quando a rede só tem uma unidade)"""
+    lista = listar_unidades()
+    if len(lista) < 2:
+        return ""
+    opcoes = "".join(
+        f'<option value="{unidade["id"]}" {"selected" if unidade["id"] == selecionada else ""}>'
+        f'{unidade["nome"]} ({unidade["sigla"]})</option>'
+        for unidade in lista
+    )
+    return f'''
+            <div class="form-group">
+                <label for="unidade_id">{rotulo}</label>
+                <select id="unidade_id" name="unidade_id">
+                    {opcoes}
+                </select>
+            </div>
+    '''
+
 def login_requerido(f):
     """Decorator para páginas que requerem login"""
     def decorated_function(*args, **kwargs):
         if 'tipo_usuario' not in session:
-            return redirect(url_for('login'))
+            return redirect(url_for('.login'))
         return f(*args, **kwargs)
+
     decorated_function.__name__ = f.__name__
     return decorated_function
 
@@ -104,8 +1062,9 @@ def admin_requerido(f):
     def decorated_function(*args, **kwargs):
         if not verificar_admin():
             flash("Acesso negado! Apenas administradores podem acessar esta página.")
-            return redirect(url_for('home'))
+            return redirect(url_for('.home'))
         return f(*args, **kwargs)
+
     decorated_function.__name__ = f.__name__
     return decorated_function
 
@@ -326,7 +1285,7 @@ HTML_TEMPLATE = '''
                 | <a href="/logout" style="color: white; text-decoration: underline;">Sair</a>
             </div>
             <h1>📚 Sistema de Gestão de Biblioteca</h1>
-            <p>Biblioteca</p>
+            <p>{{ session.get('unidade_nome', 'Biblioteca') }}</p>
         </div>
 
         <div class="nav">
@@ -358,33 +1317,34 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
-@app.route("/")
+def calcular_estatisticas():
+    """Calcula os contadores exibidos na página inicial (somando todas as unidades)"""
+    total_livros = somar_rede('livros.contar')
+    total_usuarios = somar_rede('usuarios.contar')
+    total_emprestados = somar_rede('emprestimos.contar_ativos')
+    total_atrasados = somar_rede('emprestimos.contar_atrasados')
+
+    return {
+        'total_livros': total_livros,
+        'total_usuarios': total_usuarios,
+        'total_emprestados': total_emprestados,
+        'total_atrasados': total_atrasados,
+    }
+
+@bp.route("/")
 def home():
     """Página inicial - redireciona para login se não autenticado"""
     if 'tipo_usuario' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
 
     """Página inicial com estatísticas"""
-    conn = conectar()
-    cursor = conn.cursor()
-
-    # Buscar estatísticas
-    cursor.execute("SELECT COUNT(*) as total FROM livros")
-    total_livros = cursor.fetchone()['total']
-
-    cursor.execute("SELECT COUNT(*) as total FROM usuarios")
-    total_usuarios = cursor.fetchone()['total']
-
-    cursor.execute("SELECT COUNT(*) as total FROM emprestimos WHERE status = 'emprestado'")
-    total_emprestados = cursor.fetchone()['total']
-
-    cursor.execute("""
-        SELECT COUNT(*) as total FROM emprestimos 
-        WHERE status = 'emprestado' AND data_prevista < DATE('now')
-    """)
-    total_atrasados = cursor.fetchone()['total']
-
-    conn.close()
+    estatisticas = obter_cache().obter_ou_calcular(
+        'estatisticas', chave_leitura(datetime.now().strftime('%Y-%m-%d')), calcular_estatisticas
+    )
+    total_livros = estatisticas['total_livros']
+    total_usuarios = estatisticas['total_usuarios']
+    total_emprestados = estatisticas['total_emprestados']
+    total_atrasados = estatisticas['total_atrasados']
 
     # Conteúdo diferente para admin e aluno
     if verificar_admin():
@@ -414,14 +1374,10 @@ def home():
         </div>
         '''
     else:
-        # Buscar empréstimos do aluno
-        cursor = conectar().cursor()
-        cursor.execute("""
-            SELECT COUNT(*) as total FROM emprestimos e
-            JOIN usuarios u ON e.usuario_id = u.id
-            WHERE u.matricula = ? AND e.status = 'emprestado'
-        """, (session.get('matricula_usuario'),))
-        meus_emprestimos = cursor.fetchone()['total']
+        # Buscar empréstimos do aluno (contador mantido na tabela de usuários)
+        usuario = usuario_logado()
+        meus_emprestimos = usuario['emprestimos_ativos'] if usuario else 0
+        limite = limite_emprestimos(usuario['tipo'] if usuario else 'aluno')
 
         conteudo = f'''
         <h2>📚 Portal do Aluno</h2>
@@ -439,7 +1395,7 @@ def home():
                 <div>Meus Empréstimos</div>
             </div>
             <div class="stat-card">
-                <div class="stat-number">3</div>
+                <div class="stat-number">{limite}</div>
                 <div>Limite de Empréstimos</div>
             </div>
         </div>
@@ -451,50 +1407,75 @@ def home():
 
     return render_template_string(HTML_TEMPLATE, titulo="Sistema de Biblioteca", conteudo=conteudo)
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     """Página de login"""
+    espera = 0
     if request.method == "POST":
         tipo_usuario = request.form.get('tipo_usuario')
+        identificador = request.form.get('usuario' if tipo_usuario == 'admin' else 'matricula')
+
+        # Tentativas em excesso são recusadas antes de qualquer consulta ao banco
+        espera = espera_login(tipo_usuario, identificador)
+
+        if espera:
+            flash(f"Muitas tentativas de login! Tente novamente em {math.ceil(espera)} segundos.")
 
-        if tipo_usuario == 'admin':
+        elif tipo_usuario == 'admin':
             usuario = request.form.get('usuario')
             senha = request.form.get('senha')
 
-            conn = conectar()
+            conn = conectar(current_app.config['DATABASE'])
             cursor = conn.cursor()
-            cursor.execute("""
-                SELECT * FROM administradores 
-                WHERE usuario = ? AND senha = ?
-            """, (usuario, senha))
-            admin = cursor.fetchone()
+            admin = consultas.buscar_um(cursor, 'admin.por_usuario', (usuario,))
             conn.close()
 
-            if admin:
+            # Verificação feita no pool de processos (scrypt é caro de propósito)
+            senha_valida, precisa_rehash = credenciais().verificar(
+                senha or '', admin['senha'] if admin else None
+            )
+
+            if admin and senha_valida:
+                if precisa_rehash:
+                    fila_escrita(UNIDADE_PRINCIPAL).executar(
+                        operacao_atualizar_senha, admin['id'], admin['senha'], credenciais().gerar(senha)
+                    )
+                login_aceito(tipo_usuario, identificador)
+                iniciar_sessao()
                 session['tipo_usuario'] = 'admin'
                 session['nome_usuario'] = admin['nome']
                 session['usuario_id'] = admin['id']
+                entrar_na_unidade(unidade_escolhida())
                 flash("Login de administrador realizado com sucesso!")
-                return redirect(url_for('home'))
+                return redirect(url_for('.home'))
             else:
                 flash("Usuário ou senha de administrador incorretos!")
 
         elif tipo_usuario == 'aluno':
             matricula = request.form.get('matricula')
 
-            conn = conectar()
-            cursor = conn.cursor()
-            cursor.execute("SELECT * FROM usuarios WHERE matricula = ?", (matricula,))
-            usuario = cursor.fetchone()
-            conn.close()
+            # Com as unidades separadas o aluno está no arquivo da unidade escolhida
+            separadas = current_app.config['UNIDADES_SEPARADAS']
+            unidade = unidade_escolhida() if separadas else None
+            usuario = None
+            if not separadas or unidade is not None:
+                conn = conectar(arquivo_banco(unidade or UNIDADE_PRINCIPAL))
+                cursor = conn.cursor()
+                usuario = consultas.buscar_um(cursor, 'usuarios.por_matricula', (matricula,))
+                conn.close()
 
-            if usuario:
+            if separadas and unidade is None:
+                flash("Unidade não encontrada!")
+            elif usuario:
+                login_aceito(tipo_usuario, identificador)
+                iniciar_sessao()
                 session['tipo_usuario'] = 'aluno'
                 session['nome_usuario'] = usuario['nome']
                 session['matricula_usuario'] = usuario['matricula']
                 session['usuario_id'] = usuario['id']
+                entrar_na_unidade(unidade or usuario['unidade_id'])
                 flash(f"Bem-vindo, {usuario['nome']}!")
-                return redirect(url_for('home'))
+                return redirect(url_for('.home'))
             else:
                 flash("Matrícula não encontrada! Procure um administrador para se cadastrar.")
 
@@ -533,7 +1514,7 @@ def login():
                     <input type="text" id="matricula" name="matricula" placeholder="Digite sua matrícula">
                 </div>
             </div>
-
+    ''' + campo_unidade() + '''
             <button type="submit" class="btn" id="login-btn" style="width: 100%; display: none;">Entrar</button>
         </form>
 
@@ -569,9 +1550,26 @@ def login():
     </script>
     '''
 
+    if espera:
+        return (render_template_string(HTML_TEMPLATE, titulo="Login", conteudo=conteudo),
+                429, {'Retry-After': str(math.ceil(espera))})
     return render_template_string(HTML_TEMPLATE, titulo="Login", conteudo=conteudo)
 
-@app.route("/cadastro", methods=["GET", "POST"])
+def operacao_atualizar_senha(cursor, admin_id, senha_atual, novo_hash):
+    """Troca o hash da senha de um admin, se ninguém o alterou antes"""
+    return consultas.executar(cursor, 'admin.atualizar_senha', (novo_hash, admin_id, senha_atual)).rowcount
+
+@bp.route("/trocar_unidade", methods=["POST"])
+@admin_requerido
+def trocar_unidade():
+    """Troca a unidade em que o admin está trabalhando"""
+    if entrar_na_unidade(unidade_escolhida()):
+        flash(f"Unidade alterada para {session['unidade_nome']}.")
+    else:
+        flash("Erro: Unidade não encontrada!")
+    return redirect(url_for('.gerenciar_emprestimos'))
+
+@bp.route("/cadastro", methods=["GET", "POST"])
 def cadastro():
     """Página de cadastro de administradores"""
     if request.method == "POST":
@@ -588,23 +1586,16 @@ def cadastro():
         elif len(senha) < 6:
             flash("A senha deve ter pelo menos 6 caracteres!")
         else:
-            conn = conectar()
-            cursor = conn.cursor()
-
             try:
-                cursor.execute("""
-                    INSERT INTO administradores (nome, usuario, senha)
-                    VALUES (?, ?, ?)
-                """, (nome, usuario, senha))
-                conn.commit()
+                fila_escrita(UNIDADE_PRINCIPAL).executar(
+                    operacao_inserir, 'admin.inserir', (nome, usuario, credenciais().gerar(senha))
+                )
                 flash("Administrador cadastrado com sucesso! Faça login agora.")
-                return redirect(url_for('login'))
+                return redirect(url_for('.login'))
             except sqlite3.IntegrityError:
                 flash("Nome de usuário já existe! Escolha outro.")
             except Exception as e:
                 flash(f"Erro ao cadastrar administrador: {str(e)}")
-            finally:
-                conn.close()
 
     conteudo = '''
     <div class="login-form">
@@ -650,59 +1641,87 @@ def cadastro():
 
     return render_template_string(HTML_TEMPLATE, titulo="Cadastro", conteudo=conteudo)
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     """Logout do sistema"""
     session.clear()
     flash("Logout realizado com sucesso!")
-    return redirect(url_for('login'))
+    return redirect(url_for('.login'))
 
 # ROTAS PARA LIVROS
-@app.route("/livros")
-@login_requerido
-def listar_livros():
-    """Lista todos os livros cadastrados"""
-    conn = conectar()
+def gerar_tabela_livros(busca=None):
+    """Gera a tabela HTML do acervo (ou dos livros cujo título ou autor começa com `busca`)"""
+    conn = conectar_leitura()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM livros ORDER BY titulo")
-    livros = cursor.fetchall()
-    conn.close()
-
-    tabela_livros = ""
-    if livros:
-        tabela_livros = '''
-        <table class="table">
-            <thead>
-                <tr>
-                    <th>ID</th>
-                    <th>Título</th>
-                    <th>Autor</th>
-                    <th>ISBN</th>
-                    <th>Ano</th>
-                    <th>Quantidade</th>
-                    <th>Status</th>
-                </tr>
-            </thead>
-            <tbody>
-        '''
-        for livro in livros:
-            status = "✅ Disponível" if livro['quantidade'] > 0 else "❌ Indisponível"
-            status_color = "green" if livro['quantidade'] > 0 else "red"
 
-            tabela_livros += f'''
+    # Só o endereço dos anexos: o conteúdo é servido por /anexos/<sha256>
+    anexos_livros = {}
+    for livro_id, tipo, sha256 in consultas.iterar(cursor, 'anexos.listar'):
+        anexos_livros.setdefault(livro_id, {})[tipo] = sha256
+
+    tabela_livros = '''
+    <table class="table">
+        <thead>
+            <tr>
+                <th>Capa</th>
+                <th>ID</th>
+                <th>Título</th>
+                <th>Autor</th>
+                <th>ISBN</th>
+                <th>Ano</th>
+                <th>Quantidade</th>
+                <th>Status</th>
+            </tr>
+        </thead>
+        <tbody>
+    '''
+    # As linhas são lidas em lotes e viram HTML na hora, sem guardar o acervo inteiro
+    vazio = True
+    if busca:
+        consulta, parametros = 'livros.buscar', faixa_prefixo(busca) * 2
+    else:
+        consulta, parametros = 'livros.listar', ()
+    for livro in consultas.iterar(cursor, consulta, parametros, registro=Livro):
+        vazio = False
+        status = "✅ Disponível" if livro.quantidade > 0 else "❌ Indisponível"
+        status_color = "green" if livro.quantidade > 0 else "red"
+        anexos_livro = anexos_livros.get(livro.id, {})
+        capa = (f'<img src="/anexos/{anexos_livro["capa"]}/miniatura" alt="" width="48" loading="lazy">'
+                if 'capa' in anexos_livro else '')
+        sumario = (f' <a href="/anexos/{anexos_livro["sumario"]}" target="_blank">📄 Sumário</a>'
+                   if 'sumario' in anexos_livro else '')
+
+        tabela_livros += f'''
                 <tr>
-                    <td>{livro['id']}</td>
-                    <td>{livro['titulo']}</td>
-                    <td>{livro['autor']}</td>
-                    <td>{livro['isbn'] or 'N/A'}</td>
-                    <td>{livro['ano'] or 'N/A'}</td>
-                    <td>{livro['quantidade']}</td>
+                    <td>{capa}</td>
+                    <td>{livro.id}</td>
+                    <td>{livro.titulo}{sumario}</td>
+                    <td>{livro.autor}</td>
+                    <td>{livro.isbn or 'N/A'}</td>
+                    <td>{livro.ano or 'N/A'}</td>
+                    <td>{livro.quantidade}</td>
                     <td style="color: {status_color}; font-weight: bold;">{status}</td>
                 </tr>
             '''
+    conn.close()
+
+    if vazio:
+        tabela_livros = "<p>Nenhum livro encontrado.</p>" if busca else "<p>Nenhum livro cadastrado ainda.</p>"
+    else:
         tabela_livros += "</tbody></table>"
+
+    return tabela_livros
+
+@bp.route("/livros")
+@login_requerido
+def listar_livros():
+    """Lista todos os livros cadastrados (ou os da busca por título/autor)"""
+    busca = (request.args.get('busca') or '').strip()
+    if busca:
+        tabela_livros = gerar_tabela_livros(busca)
     else:
-        tabela_livros = "<p>Nenhum livro cadastrado ainda.</p>"
+        tabela_livros = obter_cache().obter_ou_calcular('livros', chave_leitura('tabela'), gerar_tabela_livros)
+    tabela_livros = aviso_leitura() + tabela_livros
 
     # Formulário de cadastro apenas para admins
     form_cadastro = ""
@@ -732,6 +1751,27 @@ def listar_livros():
             </div>
             <button type="submit" class="btn">Cadastrar Livro</button>
         </form>
+
+        <h3>🖼️ Capa e Sumário</h3>
+        <form method="POST" action="/livros/anexar" enctype="multipart/form-data">
+            <div class="form-group">
+                <label for="anexo_livro_id">ID do Livro:</label>
+                <input type="number" id="anexo_livro_id" name="livro_id" min="1" required>
+            </div>
+            <div class="form-group">
+                <label for="anexo_tipo">Anexo:</label>
+                <select id="anexo_tipo" name="tipo">
+                    <option value="capa">Capa (JPEG, PNG ou WebP)</option>
+                    <option value="sumario">Sumário (PDF ou imagem)</option>
+                </select>
+            </div>
+            <div class="form-group">
+                <label for="arquivo">Arquivo:</label>
+                <input type="file" id="arquivo" name="arquivo" accept="image/jpeg,image/png,image/webp,application/pdf" required>
+            </div>
+            <button type="submit" class="btn">Enviar</button>
+            <button type="submit" class="btn btn-secondary" formaction="/livros/remover_anexo" formnovalidate>Remover</button>
+        </form>
         '''
 
     titulo_secao = "📖 Livros Cadastrados" if verificar_aluno() else "📖 Gerenciar Livros"
@@ -742,77 +1782,261 @@ def listar_livros():
     {form_cadastro}
 
     <h3>📚 Acervo da Biblioteca</h3>
+    <form method="GET" action="/livros" style="margin-bottom: 15px;">
+        <input type="text" name="busca" value="{escape(busca)}" placeholder="Início do título ou do autor (sem se preocupar com acentos)">
+        <button type="submit" class="btn">🔍 Buscar</button>
+        {'<a href="/livros">Limpar</a>' if busca else ''}
+    </form>
     {tabela_livros}
     '''
 
     return render_template_string(HTML_TEMPLATE, titulo="Livros", conteudo=conteudo)
 
-@app.route("/cadastrar_livro", methods=["POST"])
+TIPOS_ANEXO = {'capa': 'Capa', 'sumario': 'Sumário'}
+
+def operacao_anexar(cursor, armazem, livro_id, tipo, sha256, mime, nome, tamanho):
+    """Grava os metadados de um anexo, no lugar do anterior do mesmo tipo (executada pela fila de escrita)
+
+    Retorna os endereços que ficaram sem uso, para apagar do disco.
+    """
+    if consultas.buscar_um(cursor, 'livros.existe', (livro_id,)) is None:
+        raise ErroOperacao("Livro não encontrado!")
+    if tipo == 'capa' and not mime.startswith('image/'):
+        raise ErroOperacao("A capa deve ser uma imagem!")
+    # Outra requisição pode ter apagado o mesmo conteúdo entre o envio e esta transação
+    if not os.path.exists(armazem.caminho(sha256)):
+        raise ErroOperacao("O arquivo foi removido durante o envio. Envie de novo.")
+    anteriores = consultas.buscar_todos(cursor, 'anexos.do_livro', (livro_id, tipo))
+    for anterior in anteriores:
+        consultas.executar(cursor, 'anexos.apagar', (anterior['id'],))
+    consultas.executar(cursor, 'anexos.inserir', (
+        livro_id, tipo, sha256, mime, nome, tamanho, datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    ))
+    return sem_uso(cursor, {anterior['sha256'] for anterior in anteriores})
+
+def operacao_remover_anexo(cursor, livro_id, tipo):
+    """Remove o anexo de um tipo de um livro (executada pela fila de escrita)"""
+    anteriores = consultas.buscar_todos(cursor, 'anexos.do_livro', (livro_id, tipo))
+    if not anteriores:
+        raise ErroOperacao("Este livro não tem esse anexo!")
+    for anterior in anteriores:
+        consultas.executar(cursor, 'anexos.apagar', (anterior['id'],))
+    return sem_uso(cursor, {anterior['sha256'] for anterior in anteriores})
+
+def sem_uso(cursor, enderecos):
+    """Endereços de anexo que nenhum livro usa mais"""
+    return [sha256 for sha256 in enderecos
+            if consultas.buscar_um(cursor, 'anexos.usos', (sha256,))['total'] == 0]
+
+def operacao_apagar_sem_uso(cursor, armazem, enderecos):
+    """Apaga do disco os endereços que continuam sem uso (executada pela fila de escrita)
+
+    Roda depois do COMMIT que os liberou, com o banco travado para escrita:
+    um envio do mesmo conteúdo ou já está gravado (e o arquivo fica) ou
+    grava depois e confere se o arquivo ainda existe.
+    """
+    for sha256 in sem_uso(cursor, enderecos):
+        armazem.apagar(sha256)
+
+def gerar_miniatura(sha256):
+    """Agenda a miniatura de uma capa no pool (sem esperar)"""
+    executor_miniaturas().submit(armazem_anexos().gerar_miniatura, sha256, current_app.config['MINIATURAS_LARGURA'])
+
+@bp.route("/livros/anexar", methods=["POST"])
+@admin_requerido
+def anexar_livro():
+    """Envia a capa ou o sumário de um livro - apenas admins"""
+    tipo = request.form.get('tipo')
+    arquivo = request.files.get('arquivo')
+    armazem = armazem_anexos()
+
+    try:
+        if tipo not in TIPOS_ANEXO or arquivo is None:
+            raise ErroOperacao("Escolha o tipo de anexo e o arquivo!")
+        sha256, mime, tamanho = armazem.guardar(arquivo.stream)
+        try:
+            anteriores = fila_escrita().executar(
+                operacao_anexar, armazem, request.form.get('livro_id'), tipo, sha256, mime,
+                arquivo.filename, tamanho
+            )
+        except ErroOperacao:
+            # O arquivo já foi gravado: sai do disco se nenhum outro livro o usa
+            fila_escrita().executar(operacao_apagar_sem_uso, armazem, {sha256})
+            raise
+        if anteriores:
+            fila_escrita().executar(operacao_apagar_sem_uso, armazem, anteriores)
+        if tipo == 'capa':
+            gerar_miniatura(sha256)
+        invalidar_cache('livros')
+        flash(f"{TIPOS_ANEXO[tipo]}: anexo enviado com sucesso!")
+    except (ErroOperacao, ErroAnexo) as e:
+        flash(f"Erro: {e}")
+    except Exception as e:
+        flash(f"Erro ao enviar anexo: {str(e)}")
+
+    return redirect(url_for('.listar_livros'))
+
+@bp.route("/livros/remover_anexo", methods=["POST"])
+@admin_requerido
+def remover_anexo():
+    """Remove a capa ou o sumário de um livro - apenas admins"""
+    try:
+        anteriores = fila_escrita().executar(
+            operacao_remover_anexo, request.form.get('livro_id'), request.form.get('tipo')
+        )
+        if anteriores:
+            fila_escrita().executar(operacao_apagar_sem_uso, armazem_anexos(), anteriores)
+        invalidar_cache('livros')
+        flash("Anexo removido com sucesso!")
+    except ErroOperacao as e:
+        flash(f"Erro: {e}")
+    except Exception as e:
+        flash(f"Erro ao remover anexo: {str(e)}")
+
+    return redirect(url_for('.listar_livros'))
+
+def metadados_anexo(sha256):
+    """Tipo MIME e nome original de um anexo (404 se o endereço não é de nenhum livro)"""
+    conn = conectar()
+    anexo = consultas.buscar_um(conn.cursor(), 'anexos.por_sha', (sha256,))
+    conn.close()
+    if anexo is None:
+        abort(404)
+    return anexo
+
+@bp.route("/anexos/<sha256>")
+@login_requerido
+def servir_anexo(sha256):
+    """Serve um anexo direto do disco (com suporte a Range e cache permanente)"""
+    try:
+        caminho = armazem_anexos().caminho(sha256)
+    except ErroAnexo:
+        abort(404)
+    anexo = metadados_anexo(sha256)
+    # O conteúdo de um endereço nunca muda: o navegador pode guardá-lo para sempre
+    return send_file(caminho, mimetype=anexo['mime'], download_name=anexo['nome'],
+                     conditional=True, etag=sha256, max_age=365 * 24 * 3600)
+
+@bp.route("/anexos/<sha256>/miniatura")
+@login_requerido
+def servir_miniatura(sha256):
+    """Serve a miniatura de uma capa (ou a própria capa, enquanto a miniatura não existe)"""
+    armazem = armazem_anexos()
+    try:
+        caminho = armazem.caminho(sha256)
+    except ErroAnexo:
+        abort(404)
+    miniatura = armazem.caminho_miniatura(sha256, current_app.config['MINIATURAS_LARGURA'])
+    if os.path.exists(miniatura):
+        return send_file(miniatura, mimetype='image/jpeg', conditional=True,
+                         etag=f"{sha256}-mini", max_age=365 * 24 * 3600)
+
+    anexo = metadados_anexo(sha256)
+    if anexo['mime'].startswith('image/'):
+        gerar_miniatura(sha256)
+    return send_file(caminho, mimetype=anexo['mime'], conditional=True, etag=sha256, max_age=60)
+
+def operacao_cadastrar_livro(cursor, titulo, autor, isbn_digitado, ano, quantidade, unidade_id=UNIDADE_PRINCIPAL):
+    """Cadastra um livro e os seus exemplares na unidade (executada pela fila de escrita)"""
+    isbn13 = isbn.normalizar(isbn_digitado)
+    if isbn_digitado and isbn13 is None:
+        raise ErroOperacao("ISBN inválido! Use o ISBN-10 ou ISBN-13, com ou sem hífens, e confira o dígito verificador.")
+    existente = consultas.buscar_um(cursor, 'livros.por_isbn13', (isbn13,)) if isbn13 else None
+    if existente:
+        raise ErroOperacao(f"ISBN já cadastrado: '{existente['titulo']}' (livro {existente['id']})!")
+
+    livro_id = consultas.executar(cursor, 'livros.inserir', (
+        titulo, autor, isbn_digitado, ano, quantidade, isbn13, chave_texto(titulo), chave_texto(autor)
+    )).lastrowid
+    criar_exemplares(cursor, livro_id, quantidade, unidade_id=unidade_id)
+    eventos.registrar(cursor, 'importacao', livro_id=livro_id, unidade_id=unidade_id,
+                      quantidade_delta=quantidade, exemplares=quantidade)
+    return livro_id
+
+@bp.route("/cadastrar_livro", methods=["POST"])
 @admin_requerido
 def cadastrar_livro():
     """Cadastra um novo livro - apenas admins"""
     titulo = request.form.get('titulo')
     autor = request.form.get('autor')
-    isbn = request.form.get('isbn') or None
+    isbn_digitado = request.form.get('isbn') or None
     ano = request.form.get('ano') or None
     quantidade = request.form.get('quantidade', 1)
 
-    conn = conectar()
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("""
-            INSERT INTO livros (titulo, autor, isbn, ano, quantidade)
-            VALUES (?, ?, ?, ?, ?)
-        """, (titulo, autor, isbn, ano, quantidade))
-        conn.commit()
+        fila_escrita().executar(
+            operacao_cadastrar_livro, titulo, autor, isbn_digitado, ano, int(quantidade), unidade_atual()
+        )
+        invalidar_cache('estatisticas', 'livros', 'relatorios')
         flash(f"Livro '{titulo}' cadastrado com sucesso!")
+    except ErroOperacao as e:
+        flash(f"Erro: {e}")
     except sqlite3.IntegrityError:
         flash("Erro: ISBN já existe no sistema!")
     except Exception as e:
         flash(f"Erro ao cadastrar livro: {str(e)}")
-    finally:
-        conn.close()
 
-    return redirect(url_for('listar_livros'))
+    return redirect(url_for('.listar_livros'))
 
 # ROTAS PARA USUÁRIOS (apenas admins)
-@app.route("/usuarios")
+@bp.route("/usuarios")
 @admin_requerido
 def listar_usuarios():
-    """Lista todos os usuários cadastrados - apenas admins"""
+    """Lista os usuários da unidade atual - apenas admins"""
     conn = conectar()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM usuarios ORDER BY nome")
-    usuarios = cursor.fetchall()
-    conn.close()
-
-    tabela_usuarios = ""
-    if usuarios:
-        tabela_usuarios = '''
-        <table class="table">
-            <thead>
-                <tr>
-                    <th>ID</th>
-                    <th>Nome</th>
-                    <th>Matrícula</th>
-                    <th>Curso</th>
-                </tr>
-            </thead>
-            <tbody>
-        '''
-        for usuario in usuarios:
-            tabela_usuarios += f'''
+    saldos = dict(consultas.iterar(cursor, 'multas.saldos'))
+
+    tabela_usuarios = '''
+    <table class="table">
+        <thead>
+            <tr>
+                <th>ID</th>
+                <th>Nome</th>
+                <th>Matrícula</th>
+                <th>Curso</th>
+                <th>Tipo</th>
+                <th>Empréstimos Ativos</th>
+                <th>Multas</th>
+            </tr>
+        </thead>
+        <tbody>
+    '''
+    vazio = True
+    for usuario in consultas.iterar(cursor, 'usuarios.da_unidade', (unidade_atual(),), registro=Usuario):
+        vazio = False
+        saldo = saldos.get(usuario.id, 0)
+        coluna_multas = "-"
+        if saldo > 0:
+            coluna_multas = f'''
+                        <span style="color: red; font-weight: bold;">{formatar_reais(saldo)}</span>
+                        <form method="POST" action="/pagar_multa" style="display: inline;">
+                            <input type="hidden" name="usuario_id" value="{usuario.id}">
+                            <input type="text" name="valor" value="{saldo / 100:.2f}" size="7" required>
+                            <button type="submit" class="btn btn-secondary" style="padding: 5px 10px; font-size: 12px;">Pagar</button>
+                        </form>
+            '''
+        tabela_usuarios += f'''
                 <tr>
-                    <td>{usuario['id']}</td>
-                    <td>{usuario['nome']}</td>
-                    <td>{usuario['matricula']}</td>
-                    <td>{usuario['curso'] or 'N/A'}</td>
+                    <td>{usuario.id}</td>
+                    <td>{usuario.nome}</td>
+                    <td>{usuario.matricula}</td>
+                    <td>{usuario.curso or 'N/A'}</td>
+                    <td>{usuario.tipo.capitalize()}</td>
+                    <td>{usuario.emprestimos_ativos} / {limite_emprestimos(usuario.tipo)}</td>
+                    <td>{coluna_multas}</td>
                 </tr>
             '''
-        tabela_usuarios += "</tbody></table>"
-    else:
+    conn.close()
+
+    if vazio:
         tabela_usuarios = "<p>Nenhum usuário cadastrado ainda.</p>"
+    else:
+        tabela_usuarios += "</tbody></table>"
+
+    opcoes_tipos = ""
+    for tipo, limite in current_app.config['LIMITES_EMPRESTIMO'].items():
+        opcoes_tipos += f'<option value="{tipo}">{tipo.capitalize()} (até {limite} livros)</option>'
 
     conteudo = f'''
     <h2>👥 Gerenciar Usuários</h2>
@@ -831,6 +2055,12 @@ def listar_usuarios():
             <label for="curso">Curso:</label>
             <input type="text" id="curso" name="curso">
         </div>
+        <div class="form-group">
+            <label for="tipo">Tipo:</label>
+            <select id="tipo" name="tipo">
+                {opcoes_tipos}
+            </select>
+        </div>
         <button type="submit" class="btn">Cadastrar Usuário</button>
     </form>
 
@@ -840,117 +2070,157 @@ def listar_usuarios():
 
     return render_template_string(HTML_TEMPLATE, titulo="Usuários", conteudo=conteudo)
 
-@app.route("/cadastrar_usuario", methods=["POST"])
+@bp.route("/cadastrar_usuario", methods=["POST"])
 @admin_requerido
 def cadastrar_usuario():
     """Cadastra um novo usuário - apenas admins"""
     nome = request.form.get('nome')
     matricula = request.form.get('matricula')
     curso = request.form.get('curso') or None
+    tipo = request.form.get('tipo') or 'aluno'
 
-    conn = conectar()
-    cursor = conn.cursor()
+    if tipo not in current_app.config['LIMITES_EMPRESTIMO']:
+        flash("Erro: Tipo de usuário inválido!")
+        return redirect(url_for('.listar_usuarios'))
 
     try:
-        cursor.execute("""
-            INSERT INTO usuarios (nome, matricula, curso)
-            VALUES (?, ?, ?)
-        """, (nome, matricula, curso))
-        conn.commit()
+        fila_escrita().executar(
+            operacao_inserir, 'usuarios.inserir', (nome, matricula, curso, tipo, unidade_atual(), chave_texto(nome))
+        )
+        invalidar_cache('estatisticas')
         flash(f"Usuário '{nome}' cadastrado com sucesso!")
     except sqlite3.IntegrityError:
         flash("Erro: Matrícula já existe no sistema!")
     except Exception as e:
         flash(f"Erro ao cadastrar usuário: {str(e)}")
-    finally:
-        conn.close()
 
-    return redirect(url_for('listar_usuarios'))
+    return redirect(url_for('.listar_usuarios'))
+
+def gerar_tabela_reservas_separadas():
+    """Gera a tabela HTML dos exemplares separados esperando a retirada"""
+    conn = conectar()
+    cursor = conn.cursor()
+    reservas = consultas.buscar_todos(cursor, 'reservas.separadas', (unidade_atual(),))
+    conn.close()
+
+    if not reservas:
+        return "<p>Nenhum exemplar separado para reservas.</p>"
+
+    html = '''
+    <table class="table">
+        <thead>
+            <tr>
+                <th>Usuário</th>
+                <th>Livro</th>
+                <th>Código de Barras</th>
+                <th>Retirar até</th>
+            </tr>
+        </thead>
+        <tbody>
+    '''
+    for reserva in reservas:
+        expira_em = datetime.strptime(reserva['expira_em'], '%Y-%m-%d %H:%M:%S')
+        html += f'''
+            <tr>
+                <td>{reserva['usuario_nome']} ({reserva['matricula']})</td>
+                <td>{reserva['titulo']}</td>
+                <td>{reserva['codigo_barras']}</td>
+                <td>{expira_em.strftime('%d/%m/%Y %H:%M')}</td>
+            </tr>
+        '''
+    html += "</tbody></table>"
+    return html
 
 # ROTAS PARA EMPRÉSTIMOS
-@app.route("/emprestimos")
+@bp.route("/emprestimos")
 @admin_requerido
 def gerenciar_emprestimos():
     """Página para gerenciar empréstimos - apenas admins"""
     conn = conectar()
     cursor = conn.cursor()
 
-    # Buscar usuários para select
-    cursor.execute("SELECT * FROM usuarios ORDER BY nome")
-    usuarios = cursor.fetchall()
+    # Gerar opções para selects (usuários e livros disponíveis)
+    opcoes_usuarios = "".join(
+        f'<option value="{usuario.id}">{usuario.nome} ({usuario.matricula})</option>'
+        for usuario in consultas.iterar(cursor, 'usuarios.listar', registro=Usuario)
+    )
 
-    # Buscar livros disponíveis
-    cursor.execute("SELECT * FROM livros WHERE quantidade > 0 ORDER BY titulo")
-    livros = cursor.fetchall()
+    # Livros com exemplar disponível na unidade (Qtd: cópias livres nesta unidade)
+    opcoes_livros = "".join(
+        f'<option value="{livro.id}">{livro.titulo} - {livro.autor} (Qtd: {livro.quantidade})</option>'
+        for livro in consultas.iterar(cursor, 'livros.disponiveis_na_unidade', (unidade_atual(),), registro=Livro)
+    )
 
-    # Buscar empréstimos ativos
-    cursor.execute("""
-        SELECT e.*, u.nome as usuario_nome, u.matricula, l.titulo as livro_titulo
-        FROM emprestimos e
-        JOIN usuarios u ON e.usuario_id = u.id
-        JOIN livros l ON e.livro_id = l.id
-        WHERE e.status = 'emprestado'
-        ORDER BY e.data_emprestimo DESC
-    """)
-    emprestimos = cursor.fetchall()
-
-    conn.close()
-
-    # Gerar opções para selects
-    opcoes_usuarios = ""
-    for usuario in usuarios:
-        opcoes_usuarios += f'<option value="{usuario["id"]}">{usuario["nome"]} ({usuario["matricula"]})</option>'
-
-    opcoes_livros = ""
-    for livro in livros:
-        opcoes_livros += f'<option value="{livro["id"]}">{livro["titulo"]} - {livro["autor"]} (Qtd: {livro["quantidade"]})</option>'
-
-    # Gerar tabela de empréstimos
-    tabela_emprestimos = ""
-    if emprestimos:
-        tabela_emprestimos = '''
-        <table class="table">
-            <thead>
-                <tr>
-                    <th>ID</th>
-                    <th>Usuário</th>
-                    <th>Livro</th>
-                    <th>Data Empréstimo</th>
-                    <th>Data Prevista</th>
-                    <th>Status</th>
-                    <th>Ação</th>
-                </tr>
-            </thead>
-            <tbody>
-        '''
-        for emp in emprestimos:
-            data_prevista = datetime.strptime(emp['data_prevista'], '%Y-%m-%d')
-            hoje = datetime.now()
-            status_cor = "red" if data_prevista < hoje else "green"
-            status_texto = "ATRASADO" if data_prevista < hoje else "No prazo"
-
-            tabela_emprestimos += f'''
+    # Gerar tabela de empréstimos ativos
+    tabela_emprestimos = '''
+    <table class="table">
+        <thead>
+            <tr>
+                <th>ID</th>
+                <th>Usuário</th>
+                <th>Livro</th>
+                <th>Data Empréstimo</th>
+                <th>Data Prevista</th>
+                <th>Renovações</th>
+                <th>Status</th>
+                <th>Ação</th>
+            </tr>
+        </thead>
+        <tbody>
+    '''
+    renovacoes_maximo = current_app.config['RENOVACOES_MAXIMO']
+    hoje = datetime.now()
+    vazio = True
+    for emp in consultas.iterar(cursor, 'emprestimos.ativos_da_unidade', (unidade_atual(),), registro=Emprestimo):
+        vazio = False
+        data_prevista = datetime.strptime(emp.data_prevista, '%Y-%m-%d')
+        status_cor = "red" if data_prevista < hoje else "green"
+        status_texto = "ATRASADO" if data_prevista < hoje else "No prazo"
+
+        tabela_emprestimos += f'''
                 <tr>
-                    <td>{emp['id']}</td>
-                    <td>{emp['usuario_nome']} ({emp['matricula']})</td>
-                    <td>{emp['livro_titulo']}</td>
-                    <td>{datetime.strptime(emp['data_emprestimo'], '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+                    <td>{emp.id}</td>
+                    <td>{emp.usuario_nome} ({emp.matricula})</td>
+                    <td>{emp.livro_titulo}<br><small>{emp.codigo_barras or ''}</small></td>
+                    <td>{datetime.strptime(emp.data_emprestimo, '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
                     <td>{data_prevista.strftime('%d/%m/%Y')}</td>
+                    <td>{emp.renovacoes}/{renovacoes_maximo}</td>
                     <td style="color: {status_cor}; font-weight: bold;">{status_texto}</td>
                     <td>
                         <form method="POST" action="/devolver_livro" style="display: inline;">
-                            <input type="hidden" name="emprestimo_id" value="{emp['id']}">
+                            <input type="hidden" name="emprestimo_id" value="{emp.id}">
                             <button type="submit" class="btn" style="padding: 5px 10px; font-size: 12px;">Devolver</button>
                         </form>
+                        <form method="POST" action="/renovar_emprestimo" style="display: inline;">
+                            <input type="hidden" name="emprestimo_id" value="{emp.id}">
+                            <button type="submit" class="btn btn-secondary" style="padding: 5px 10px; font-size: 12px;">Renovar</button>
+                        </form>
                     </td>
                 </tr>
             '''
-        tabela_emprestimos += "</tbody></table>"
-    else:
+
+    conn.close()
+
+    if vazio:
         tabela_emprestimos = "<p>Nenhum empréstimo ativo no momento.</p>"
+    else:
+        tabela_emprestimos += "</tbody></table>"
+
+    tabela_reservas = gerar_tabela_reservas_separadas()
+
+    form_unidade = ""
+    campo = campo_unidade(unidade_atual(), "Unidade em que você está atendendo:")
+    if campo:
+        form_unidade = f'''
+    <form method="POST" action="/trocar_unidade">
+        {campo}
+        <button type="submit" class="btn btn-secondary">🏫 Trocar Unidade</button>
+    </form>
+    '''
 
     conteudo = f'''
     <h2>📋 Gerenciar Empréstimos</h2>
+    {form_unidade}
 
     <h3>➕ Realizar Novo Empréstimo</h3>
     <form method="POST" action="/realizar_emprestimo">
@@ -962,8 +2232,12 @@ def gerenciar_emprestimos():
             </select>
         </div>
         <div class="form-group">
-            <label for="livro_id">Livro:</label>
-            <select id="livro_id" name="livro_id" required>
+            <label for="codigo_barras">Código de Barras do Exemplar ou ISBN:</label>
+            <input type="text" id="codigo_barras" name="codigo_barras" placeholder="Leia o código do exemplar ou o ISBN do livro">
+        </div>
+        <div class="form-group">
+            <label for="livro_id">Ou Livro:</label>
+            <select id="livro_id" name="livro_id">
                 <option value="">Selecione um livro</option>
                 {opcoes_livros}
             </select>
@@ -971,47 +2245,161 @@ def gerenciar_emprestimos():
         <button type="submit" class="btn">Realizar Empréstimo</button>
     </form>
 
+    <h3>🔄 Renovar Todos os Empréstimos de um Usuário</h3>
+    <form method="POST" action="/renovar_todos">
+        <div class="form-group">
+            <label for="renovar_usuario_id">Usuário:</label>
+            <select id="renovar_usuario_id" name="usuario_id" required>
+                <option value="">Selecione um usuário</option>
+                {opcoes_usuarios}
+            </select>
+        </div>
+        <button type="submit" class="btn">Renovar Todos</button>
+    </form>
+
     <h3>📚 Empréstimos Ativos</h3>
     {tabela_emprestimos}
+
+    <h3>📌 Reservas Aguardando Retirada</h3>
+    {tabela_reservas}
     '''
 
     return render_template_string(HTML_TEMPLATE, titulo="Empréstimos", conteudo=conteudo)
 
-@app.route("/meus_emprestimos")
-@login_requerido
-def meus_emprestimos():
-    """Página para alunos visualizarem seus empréstimos"""
-    if not verificar_aluno():
-        return redirect(url_for('gerenciar_emprestimos'))
-
+def gerar_secao_reservas(usuario_id):
+    """Gera a lista de reservas do aluno e o formulário para reservar um livro"""
     conn = conectar()
     cursor = conn.cursor()
+    reservas = consultas.buscar_todos(cursor, 'reservas.do_usuario', (usuario_id,))
+    opcoes_livros = "".join(
+        f'<option value="{livro.id}">{livro.titulo} - {livro.autor}</option>'
+        for livro in consultas.iterar(cursor, 'livros.indisponiveis', registro=Livro)
+    )
+    conn.close()
 
-    # Buscar empréstimos do aluno logado
-    cursor.execute("""
-        SELECT e.*, l.titulo as livro_titulo, l.autor
-        FROM emprestimos e
-        JOIN livros l ON e.livro_id = l.id
-        JOIN usuarios u ON e.usuario_id = u.id
-        WHERE u.matricula = ? AND e.status = 'emprestado'
-        ORDER BY e.data_emprestimo DESC
-    """, (session.get('matricula_usuario'),))
-    emprestimos = cursor.fetchall()
-
-    # Buscar histórico de empréstimos
-    cursor.execute("""
-        SELECT e.*, l.titulo as livro_titulo, l.autor
-        FROM emprestimos e
-        JOIN livros l ON e.livro_id = l.id
-        JOIN usuarios u ON e.usuario_id = u.id
-        WHERE u.matricula = ? AND e.status = 'devolvido'
-        ORDER BY e.data_devolucao DESC
-        LIMIT 10
-    """, (session.get('matricula_usuario'),))
-    historico = cursor.fetchall()
+    tabela_reservas = ""
+    if reservas:
+        tabela_reservas = '''
+        <table class="table">
+            <thead>
+                <tr>
+                    <th>Livro</th>
+                    <th>Autor</th>
+                    <th>Reservado em</th>
+                    <th>Situação</th>
+                    <th>Ação</th>
+                </tr>
+            </thead>
+            <tbody>
+        '''
+        for reserva in reservas:
+            if reserva['status'] == 'separada':
+                expira_em = datetime.strptime(reserva['expira_em'], '%Y-%m-%d %H:%M:%S')
+                situacao = f"✅ Separado para você até {expira_em.strftime('%d/%m/%Y %H:%M')}"
+            else:
+                situacao = f"⏳ {reserva['posicao']}º na fila"
+
+            tabela_reservas += f'''
+                <tr>
+                    <td>{reserva['titulo']}</td>
+                    <td>{reserva['autor']}</td>
+                    <td>{datetime.strptime(reserva['criado_em'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y')}</td>
+                    <td style="font-weight: bold;">{situacao}</td>
+                    <td>
+                        <form method="POST" action="/cancelar_reserva" style="display: inline;">
+                            <input type="hidden" name="reserva_id" value="{reserva['id']}">
+                            <button type="submit" class="btn btn-secondary" style="padding: 5px 10px; font-size: 12px;">Cancelar</button>
+                        </form>
+                    </td>
+                </tr>
+            '''
+        tabela_reservas += "</tbody></table>"
+    else:
+        tabela_reservas = "<p>Você não possui reservas ativas.</p>"
+
+    form_reserva = ""
+    if opcoes_livros:
+        form_reserva = f'''
+        <form method="POST" action="/reservar">
+            <div class="form-group">
+                <label for="livro_id">Reservar livro indisponível:</label>
+                <select id="livro_id" name="livro_id" required>
+                    <option value="">Selecione um livro</option>
+                    {opcoes_livros}
+                </select>
+            </div>
+            <button type="submit" class="btn">Entrar na Fila</button>
+        </form>
+        '''
+
+    return tabela_reservas + form_reserva
 
+def gerar_secao_multas(usuario_id):
+    """Gera o saldo de multas do aluno e a multa de cada empréstimo atrasado"""
+    conn = conectar()
+    cursor = conn.cursor()
+    saldo = consultas.buscar_um(cursor, 'multas.saldo_do_usuario', {'usuario_id': usuario_id})['saldo']
+    multas = consultas.buscar_todos(cursor, 'multas.do_usuario', (usuario_id,))
     conn.close()
 
+    if not multas:
+        return "<p>Você não possui multas. 🎉</p>"
+
+    cor = "red" if saldo > 0 else "green"
+    html = f'''
+    <p style="font-size: 18px;">Saldo a pagar: <strong style="color: {cor};">{formatar_reais(saldo)}</strong></p>
+    <table class="table">
+        <thead>
+            <tr>
+                <th>Livro</th>
+                <th>Data Prevista</th>
+                <th>Devolvido em</th>
+                <th>Dias Cobrados</th>
+                <th>Multa</th>
+            </tr>
+        </thead>
+        <tbody>
+    '''
+    for multa in multas:
+        devolucao = (datetime.strptime(multa['data_devolucao'], '%Y-%m-%d').strftime('%d/%m/%Y')
+                     if multa['data_devolucao'] else "Em aberto")
+        html += f'''
+            <tr>
+                <td>{multa['titulo']}</td>
+                <td>{datetime.strptime(multa['data_prevista'], '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+                <td>{devolucao}</td>
+                <td>{multa['dias']}</td>
+                <td>{formatar_reais(multa['valor'])}</td>
+            </tr>
+        '''
+    html += "</tbody></table>"
+    return html
+
+@bp.route("/meus_emprestimos")
+@login_requerido
+def meus_emprestimos():
+    """Página para alunos visualizarem seus empréstimos"""
+    if not verificar_aluno():
+        return redirect(url_for('.gerenciar_emprestimos'))
+
+    # Buscar empréstimos do aluno logado (uma única consulta por requisição)
+    todos = emprestimos_do_usuario()
+    emprestimos = sorted(
+        (e for e in todos if e.status == 'emprestado'),
+        key=lambda e: e.data_emprestimo, reverse=True
+    )
+
+    # Histórico de empréstimos
+    historico = sorted(
+        (e for e in todos if e.status == 'devolvido'),
+        key=lambda e: e.data_devolucao, reverse=True
+    )
+
+    usuario = usuario_logado()
+    limite = limite_emprestimos(usuario['tipo'] if usuario else 'aluno')
+    prazo = current_app.config['EMPRESTIMO_PRAZO']
+    renovacoes_maximo = current_app.config['RENOVACOES_MAXIMO']
+
     # Gerar tabela de empréstimos ativos
     tabela_emprestimos = ""
     if emprestimos:
@@ -1023,27 +2411,42 @@ def meus_emprestimos():
                     <th>Autor</th>
                     <th>Data Empréstimo</th>
                     <th>Data Prevista</th>
+                    <th>Renovações</th>
                     <th>Status</th>
+                    <th>Ação</th>
                 </tr>
             </thead>
             <tbody>
         '''
         for emp in emprestimos:
-            data_prevista = datetime.strptime(emp['data_prevista'], '%Y-%m-%d')
+            data_prevista = datetime.strptime(emp.data_prevista, '%Y-%m-%d')
             hoje = datetime.now()
             status_cor = "red" if data_prevista < hoje else "green"
             status_texto = "ATRASADO" if data_prevista < hoje else "No prazo"
 
             tabela_emprestimos += f'''
                 <tr>
-                    <td>{emp['livro_titulo']}</td>
-                    <td>{emp['autor']}</td>
-                    <td>{datetime.strptime(emp['data_emprestimo'], '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+                    <td>{emp.livro_titulo}</td>
+                    <td>{emp.autor}</td>
+                    <td>{datetime.strptime(emp.data_emprestimo, '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
                     <td>{data_prevista.strftime('%d/%m/%Y')}</td>
+                    <td>{emp.renovacoes}/{renovacoes_maximo}</td>
                     <td style="color: {status_cor}; font-weight: bold;">{status_texto}</td>
+                    <td>
+                        <form method="POST" action="/renovar_emprestimo" style="display: inline;">
+                            <input type="hidden" name="emprestimo_id" value="{emp.id}">
+                            <button type="submit" class="btn btn-secondary" style="padding: 5px 10px; font-size: 12px;">Renovar</button>
+                        </form>
+                    </td>
                 </tr>
             '''
         tabela_emprestimos += "</tbody></table>"
+        if len(emprestimos) > 1:
+            tabela_emprestimos += '''
+            <form method="POST" action="/renovar_todos">
+                <button type="submit" class="btn">🔄 Renovar Todos</button>
+            </form>
+            '''
     else:
         tabela_emprestimos = "<p>Você não possui empréstimos ativos no momento.</p>"
 
@@ -1065,16 +2468,24 @@ def meus_emprestimos():
         for emp in historico:
             tabela_historico += f'''
                 <tr>
-                    <td>{emp['livro_titulo']}</td>
-                    <td>{emp['autor']}</td>
-                    <td>{datetime.strptime(emp['data_emprestimo'], '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
-                    <td>{datetime.strptime(emp['data_devolucao'], '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+                    <td>{emp.livro_titulo}</td>
+                    <td>{emp.autor}</td>
+                    <td>{datetime.strptime(emp.data_emprestimo, '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+                    <td>{datetime.strptime(emp.data_devolucao, '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
                 </tr>
             '''
         tabela_historico += "</tbody></table>"
     else:
         tabela_historico = "<p>Nenhum histórico de empréstimos encontrado.</p>"
 
+    secao_reservas = gerar_secao_reservas(session.get('usuario_id'))
+    secao_multas = gerar_secao_multas(session.get('usuario_id'))
+    regra = current_app.config['MULTAS'].get(usuario['tipo'] if usuario else 'aluno')
+    aviso_multa = ""
+    if regra:
+        aviso_multa = (f"<li>Após {regra['carencia']} dias de atraso, cada dia excedente gera multa de "
+                       f"{formatar_reais(regra['valor_dia'])}, até {formatar_reais(regra['teto'])} por empréstimo</li>")
+
     conteudo = f'''
     <h2>📋 Meus Empréstimos</h2>
 
@@ -1086,309 +2497,799 @@ def meus_emprestimos():
         {tabela_historico}
     </div>
 
+    <div style="margin-top: 40px;">
+        <h3>📌 Minhas Reservas</h3>
+        {secao_reservas}
+    </div>
+
+    <div style="margin-top: 40px;">
+        <h3>💰 Minhas Multas</h3>
+        {secao_multas}
+    </div>
+
     <div style="background: #f8f9fa; padding: 20px; border-radius: 10px; margin-top: 30px;">
         <h4>ℹ️ Informações Importantes:</h4>
         <ul>
-            <li>Você pode ter até 3 livros emprestados simultaneamente</li>
-            <li>O prazo de devolução é de 7 dias</li>
-            <li>Para renovar um empréstimo, procure um administrador</li>
+            <li>Você pode ter até {limite} livros emprestados simultaneamente</li>
+            <li>O prazo de devolução é de {prazo} dias</li>
+            <li>Cada empréstimo pode ser renovado até {renovacoes_maximo} vezes, por mais {prazo} dias a partir da renovação, se não estiver em atraso e ninguém estiver na fila de reservas do livro</li>
             <li>Empréstimos em atraso podem impedir novos empréstimos</li>
+            {aviso_multa}
+            <li>Livros sem exemplares disponíveis podem ser reservados; quando um exemplar for separado para você, retire-o em até {current_app.config['RESERVA_PRAZO_RETIRADA']} dias</li>
         </ul>
     </div>
     '''
 
     return render_template_string(HTML_TEMPLATE, titulo="Meus Empréstimos", conteudo=conteudo)
 
-@app.route("/realizar_emprestimo", methods=["POST"])
-@admin_requerido
-def realizar_emprestimo():
-    """Realiza um novo empréstimo - apenas admins"""
-    usuario_id = request.form.get('usuario_id')
-    livro_id = request.form.get('livro_id')
+def operacao_realizar_emprestimo(cursor, usuario_id, livro_id, limites, codigo=None, prazo=7,
+                                 unidade_id=UNIDADE_PRINCIPAL):
+    """Registra um empréstimo no balcão da unidade (executada pela fila de escrita)
+
+    Com `codigo` (código de barras lido do exemplar) empresta aquela cópia;
+    sem ele, qualquer cópia disponível do livro na unidade.
+    """
+    # Buscar tipo do usuário para saber o seu limite
+    usuario = consultas.buscar_um(cursor, 'usuarios.tipo', (usuario_id,))
+
+    if not usuario:
+        raise ErroOperacao("Usuário não encontrado!")
+
+    limite = limites.get(usuario['tipo'], limites['aluno'])
+
+    # Reservar uma vaga no contador do usuário (falha se já atingiu o limite)
+    if consultas.executar(cursor, 'usuarios.reservar_vaga', (usuario_id, limite)).rowcount == 0:
+        raise ErroOperacao(f"Usuário já possui {limite} livros emprestados (limite máximo)!")
+
+    exemplar = None
+    if codigo:
+        exemplar = consultas.buscar_um(cursor, 'exemplares.por_codigo', (codigo,))
+        if exemplar:
+            if exemplar['unidade_id'] != unidade_id:
+                raise ErroOperacao("Este exemplar é de outra unidade!")
+            if exemplar['status'] == 'emprestado':
+                raise ErroOperacao("Este exemplar já está emprestado!")
+            livro_id = exemplar['livro_id']
+        else:
+            # O leitor também pode ler o ISBN da contracapa: qualquer cópia livre do livro
+            normalizado = isbn.normalizar(codigo)
+            livro = consultas.buscar_um(cursor, 'livros.por_isbn13', (normalizado,)) if normalizado else None
+            if not livro:
+                raise ErroOperacao("Exemplar não encontrado!")
+            livro_id = livro['id']
+
+    # Um exemplar separado nesta unidade para a reserva deste usuário tem prioridade
+    reserva = consultas.buscar_um(cursor, 'reservas.separada_do_usuario', (usuario_id, livro_id, unidade_id))
+    if reserva and (exemplar is None or exemplar['id'] == reserva['exemplar_id']):
+        exemplar_id = reserva['exemplar_id']
+        consultas.executar(cursor, 'exemplares.emprestar_reservado', (exemplar_id,))
+        consultas.executar(cursor, 'reservas.atender', (reserva['id'],))
+        quantidade_delta = 0
+    else:
+        if exemplar is not None and exemplar['status'] == 'reservado':
+            raise ErroOperacao("Este exemplar está separado para a reserva de outro usuário!")
 
-    conn = conectar()
-    cursor = conn.cursor()
+        # Escolher o exemplar (o do código de barras ou um livre, pelo índice de disponibilidade)
+        if exemplar is None:
+            exemplar = consultas.buscar_um(cursor, 'exemplares.disponivel_na_unidade', (unidade_id, livro_id))
+            if not exemplar and consultas.buscar_um(cursor, 'exemplares.disponivel_do_livro', (livro_id,)):
+                raise ErroOperacao("Nenhum exemplar disponível nesta unidade! Há exemplares em outras unidades.")
 
-    try:
-        # Verificar se usuário não tem mais que 3 livros emprestados
-        cursor.execute("""
-            SELECT COUNT(*) as total FROM emprestimos 
-            WHERE usuario_id = ? AND status = 'emprestado'
-        """, (usuario_id,))
-        total_emprestimos = cursor.fetchone()['total']
+        if not exemplar or consultas.executar(cursor, 'exemplares.emprestar', (exemplar['id'],)).rowcount == 0:
+            raise ErroOperacao("Livro não disponível para empréstimo! O aluno pode entrar na fila de reservas.")
+        exemplar_id = exemplar['id']
 
-        if total_emprestimos >= 3:
-            flash("Erro: Usuário já possui 3 livros emprestados (limite máximo)!")
-            conn.close()
-            return redirect(url_for('gerenciar_emprestimos'))
+        # Diminuir quantidade disponível do livro
+        consultas.executar(cursor, 'livros.retirar_exemplar', (livro_id,))
+        quantidade_delta = -1
 
-        # Verificar se livro está disponível
-        cursor.execute("SELECT quantidade FROM livros WHERE id = ?", (livro_id,))
-        livro = cursor.fetchone()
+        # Quem estava na fila e pegou um exemplar da estante sai da fila
+        consultas.executar(cursor, 'reservas.atender_aguardando', (usuario_id, livro_id))
 
-        if not livro or livro['quantidade'] <= 0:
-            flash("Erro: Livro não disponível para empréstimo!")
-            conn.close()
-            return redirect(url_for('gerenciar_emprestimos'))
+    # Realizar empréstimo
+    data_emprestimo = datetime.now().strftime('%Y-%m-%d')
+    data_prevista = (datetime.now() + timedelta(days=prazo)).strftime('%Y-%m-%d')
 
-        # Realizar empréstimo
-        data_emprestimo = datetime.now().strftime('%Y-%m-%d')
-        data_prevista = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
+    emprestimo_id = consultas.executar(cursor, 'emprestimos.inserir', (
+        usuario_id, livro_id, exemplar_id, data_emprestimo, data_prevista, unidade_id
+    )).lastrowid
 
-        cursor.execute("""
-            INSERT INTO emprestimos (usuario_id, livro_id, data_emprestimo, data_prevista)
-            VALUES (?, ?, ?, ?)
-        """, (usuario_id, livro_id, data_emprestimo, data_prevista))
+    eventos.registrar(cursor, 'emprestimo', livro_id=livro_id, usuario_id=usuario_id,
+                      exemplar_id=exemplar_id, emprestimo_id=emprestimo_id, unidade_id=unidade_id,
+                      quantidade_delta=quantidade_delta, ativos_delta=1, data_prevista=data_prevista)
 
-        # Diminuir quantidade disponível do livro
-        cursor.execute("""
-            UPDATE livros SET quantidade = quantidade - 1 WHERE id = ?
-        """, (livro_id,))
+    return "Empréstimo realizado com sucesso!"
 
-        conn.commit()
-        flash("Empréstimo realizado com sucesso!")
+@bp.route("/realizar_emprestimo", methods=["POST"])
+@admin_requerido
+def realizar_emprestimo():
+    """Realiza um novo empréstimo - apenas admins"""
+    usuario_id = request.form.get('usuario_id')
+    livro_id = request.form.get('livro_id')
+    codigo = (request.form.get('codigo_barras') or '').strip() or None
+
+    if not livro_id and not codigo:
+        flash("Erro: Selecione um livro ou leia o código de barras do exemplar!")
+        return redirect(url_for('.gerenciar_emprestimos'))
 
+    try:
+        mensagem = fila_escrita().executar(
+            operacao_realizar_emprestimo, usuario_id, livro_id, current_app.config['LIMITES_EMPRESTIMO'],
+            codigo, current_app.config['EMPRESTIMO_PRAZO'], unidade_atual()
+        )
+        invalidar_cache('estatisticas', 'livros', 'relatorios')
+        flash(mensagem)
+    except ErroOperacao as e:
+        flash(f"Erro: {e}")
     except Exception as e:
         flash(f"Erro ao realizar empréstimo: {str(e)}")
-    finally:
-        conn.close()
-
-    return redirect(url_for('gerenciar_emprestimos'))
 
-@app.route("/devolver_livro", methods=["POST"])
+    return redirect(url_for('.gerenciar_emprestimos'))
+
+def destinar_exemplar(cursor, exemplar_id, livro_id, prazo_retirada):
+    """Separa um exemplar que voltou para o primeiro da fila de reservas do livro
+
+    Só entram as reservas para retirada na unidade do exemplar. Sem reservas
+    na fila, o exemplar volta a ficar disponível. Retorna o nome de quem vai
+    retirá-lo, ou None.
+    """
+    reserva = consultas.buscar_um(cursor, 'reservas.proxima_do_livro', (livro_id, exemplar_id))
+    if not reserva:
+        consultas.executar(cursor, 'exemplares.devolver', (exemplar_id,))
+        consultas.executar(cursor, 'livros.devolver_exemplar', (livro_id,))
+        return None
+
+    expira_em = (datetime.now() + timedelta(days=prazo_retirada)).strftime('%Y-%m-%d %H:%M:%S')
+    consultas.executar(cursor, 'exemplares.reservar', (exemplar_id,))
+    consultas.executar(cursor, 'reservas.separar', (exemplar_id, expira_em, reserva['id']))
+    return reserva['nome']
+
+def operacao_devolver_livro(cursor, emprestimo_id, prazo_retirada=3, regras=None):
+    """Registra a devolução de um empréstimo (executada pela fila de escrita)
+
+    Se houver fila de reservas para o livro, o exemplar devolvido já fica
+    separado para o próximo da fila, na mesma transação. Com as `regras` de
+    multa (JSON), a multa do empréstimo é fechada na data da devolução.
+    """
+    # Buscar dados do empréstimo
+    emprestimo = consultas.buscar_um(cursor, 'emprestimos.por_id', (emprestimo_id,))
+
+    if not emprestimo:
+        raise ErroOperacao("Empréstimo não encontrado!")
+
+    if emprestimo['status'] != 'emprestado':
+        raise ErroOperacao("Este empréstimo já foi devolvido!")
+
+    # Marcar como devolvido
+    data_devolucao = datetime.now().strftime('%Y-%m-%d')
+    consultas.executar(cursor, 'emprestimos.marcar_devolvido', (data_devolucao, emprestimo_id))
+
+    # Separar o exemplar para a próxima reserva ou devolvê-lo ao acervo
+    reservado_para = None
+    if emprestimo['exemplar_id'] is not None:
+        reservado_para = destinar_exemplar(
+            cursor, emprestimo['exemplar_id'], emprestimo['livro_id'], prazo_retirada
+        )
+    else:
+        consultas.executar(cursor, 'livros.devolver_exemplar', (emprestimo['livro_id'],))
+
+    # Liberar a vaga no contador do usuário
+    consultas.executar(cursor, 'usuarios.liberar_vaga', (emprestimo['usuario_id'],))
+
+    multa = None
+    if regras is not None:
+        consultas.executar(cursor, 'multas.calcular_emprestimo', {
+            'regras': regras, 'hoje': data_devolucao, 'emprestimo_id': emprestimo['id'],
+            'agora': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        })
+        multa = consultas.buscar_um(cursor, 'multas.do_emprestimo', (emprestimo['id'],))
+
+    eventos.registrar(cursor, 'devolucao', livro_id=emprestimo['livro_id'], usuario_id=emprestimo['usuario_id'],
+                      exemplar_id=emprestimo['exemplar_id'], emprestimo_id=emprestimo['id'],
+                      unidade_id=emprestimo['unidade_id'], quantidade_delta=0 if reservado_para else 1,
+                      ativos_delta=-1, reservado=bool(reservado_para))
+
+    mensagem = f"Livro '{emprestimo['titulo']}' devolvido com sucesso!"
+    if reservado_para:
+        mensagem += f" Exemplar separado para a reserva de {reservado_para}."
+    if multa:
+        mensagem += f" Multa por {multa['dias']} dia(s) de atraso: {formatar_reais(multa['valor'])}."
+    return mensagem
+
+@bp.route("/devolver_livro", methods=["POST"])
 @admin_requerido
 def devolver_livro():
     """Realiza a devolução de um livro - apenas admins"""
     emprestimo_id = request.form.get('emprestimo_id')
 
-    conn = conectar()
-    cursor = conn.cursor()
+    try:
+        mensagem = fila_escrita().executar(
+            operacao_devolver_livro, emprestimo_id, current_app.config['RESERVA_PRAZO_RETIRADA'], regras_multas()
+        )
+        invalidar_cache('estatisticas', 'livros', 'relatorios')
+        flash(mensagem)
+    except ErroOperacao as e:
+        flash(f"Erro: {e}")
+    except Exception as e:
+        flash(f"Erro ao devolver livro: {str(e)}")
 
+    return redirect(url_for('.gerenciar_emprestimos'))
+
+# MULTAS
+def operacao_calcular_multas(cursor, regras, hoje, agora):
+    """Recalcula as multas de todos os empréstimos abertos em atraso, em um único comando
+
+    Retorna quantas multas foram criadas ou mudaram de valor.
+    """
+    return consultas.executar(cursor, 'multas.calcular_abertas', {
+        'regras': regras, 'hoje': hoje, 'agora': agora,
+    }).rowcount
+
+def calcular_multas():
+    """Recalcula as multas em todas as unidades; retorna quantas mudaram"""
+    regras = regras_multas()
+    agora = datetime.now()
+    total = 0
+    for unidade_id in ids_unidades():
+        total += fila_escrita(unidade_id).executar(
+            operacao_calcular_multas, regras, agora.strftime('%Y-%m-%d'), agora.strftime('%Y-%m-%d %H:%M:%S')
+        )
+
+    if total:
+        invalidar_cache('relatorios')
+    return total
+
+def tarefa_multas():
+    """Retorna a tarefa periódica que recalcula as multas neste processo"""
+    def criar(app):
+        def executar():
+            with app.app_context():
+                calcular_multas()
+        return TarefaPeriodica(executar, app.config['MULTAS_CALCULAR_A_CADA'], nome='calcular-multas')
+    return recurso('tarefa_multas', criar)
+
+def operacao_pagar_multa(cursor, usuario_id, valor, agora):
+    """Registra o pagamento de multa de um usuário (até o valor do saldo devedor)"""
+    if not consultas.buscar_um(cursor, 'usuarios.tipo', (usuario_id,)):
+        raise ErroOperacao("Usuário não encontrado!")
+    if valor <= 0:
+        raise ErroOperacao("Informe um valor maior que zero!")
+
+    saldo = consultas.buscar_um(cursor, 'multas.saldo_do_usuario', {'usuario_id': usuario_id})['saldo']
+    if valor > saldo:
+        raise ErroOperacao(f"O valor é maior que o saldo devedor ({formatar_reais(saldo)})!")
+
+    consultas.executar(cursor, 'multas.pagar', (usuario_id, valor, agora))
+    return f"Pagamento de {formatar_reais(valor)} registrado. Saldo restante: {formatar_reais(saldo - valor)}."
+
+@bp.route("/pagar_multa", methods=["POST"])
+@admin_requerido
+def pagar_multa():
+    """Registra o pagamento de uma multa no balcão - apenas admins"""
     try:
-        # Buscar dados do empréstimo
-        cursor.execute("""
-            SELECT e.*, l.titulo FROM emprestimos e
-            JOIN livros l ON e.livro_id = l.id
-            WHERE e.id = ?
-        """, (emprestimo_id,))
-        emprestimo = cursor.fetchone()
-
-        if not emprestimo:
-            flash("Erro: Empréstimo não encontrado!")
-            conn.close()
-            return redirect(url_for('gerenciar_emprestimos'))
+        valor = ler_reais(request.form.get('valor'))
+    except (ValueError, OverflowError):
+        flash("Erro: valor inválido!")
+        return redirect(url_for('.listar_usuarios'))
 
-        # Marcar como devolvido
-        data_devolucao = datetime.now().strftime('%Y-%m-%d')
-        cursor.execute("""
-            UPDATE emprestimos 
-            SET data_devolucao = ?, status = 'devolvido'
-            WHERE id = ?
-        """, (data_devolucao, emprestimo_id))
+    try:
+        flash(fila_escrita().executar(
+            operacao_pagar_multa, request.form.get('usuario_id'), valor,
+            datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        ))
+    except ErroOperacao as e:
+        flash(f"Erro: {e}")
+    except Exception as e:
+        flash(f"Erro ao registrar pagamento: {str(e)}")
 
-        # Aumentar quantidade disponível do livro
-        cursor.execute("""
-            UPDATE livros SET quantidade = quantidade + 1 WHERE id = ?
-        """, (emprestimo['livro_id'],))
+    return redirect(url_for('.listar_usuarios'))
 
-        conn.commit()
-        flash(f"Livro '{emprestimo['titulo']}' devolvido com sucesso!")
+# ROTAS PARA RENOVAÇÕES
+def renovar(cursor, emprestimo, hoje, nova_data, maximo):
+    """Renova um empréstimo ativo, adiando a data prevista no próprio registro
 
-    except Exception as e:
-        flash(f"Erro ao devolver livro: {str(e)}")
-    finally:
-        conn.close()
+    Não renova empréstimos em atraso, cuja data prevista já é igual ou
+    posterior à nova (renovar não adiaria nada e gastaria uma renovação),
+    que já atingiram o limite de renovações ou cujo livro tem alguém na
+    fila de reservas (uma única consulta pelo índice da fila).
+    """
+    if emprestimo['data_prevista'] < hoje:
+        raise ErroOperacao("empréstimo em atraso, o livro precisa ser devolvido")
 
-    return redirect(url_for('gerenciar_emprestimos'))
+    if nova_data <= emprestimo['data_prevista']:
+        prevista = datetime.strptime(emprestimo['data_prevista'], '%Y-%m-%d').strftime('%d/%m/%Y')
+        raise ErroOperacao(f"a devolução já está prevista para {prevista}, renovar agora não adiaria o prazo")
 
-# ROTAS PARA RELATÓRIOS
-@app.route("/relatorios")
-@login_requerido
-def relatorios():
-    """Página de relatórios"""
-    conn = conectar()
-    cursor = conn.cursor()
+    if emprestimo['renovacoes'] >= maximo:
+        raise ErroOperacao(f"já foi renovado {maximo} vezes (limite máximo)")
+
+    if consultas.buscar_um(cursor, 'reservas.tem_fila', (emprestimo['livro_id'],)):
+        raise ErroOperacao("há reservas na fila para este livro")
+
+    if consultas.executar(cursor, 'emprestimos.renovar', (nova_data, emprestimo['id'], maximo)).rowcount == 0:
+        raise ErroOperacao("empréstimo não está mais ativo")
+
+    eventos.registrar(cursor, 'renovacao', livro_id=emprestimo['livro_id'], usuario_id=emprestimo['usuario_id'],
+                      emprestimo_id=emprestimo['id'], data_prevista=nova_data)
+
+def operacao_renovar_emprestimo(cursor, emprestimo_id, usuario_id, prazo, maximo):
+    """Renova um empréstimo (executada pela fila de escrita)
+
+    Com `usuario_id` só renova empréstimos daquele usuário (aluno logado).
+    """
+    emprestimo = consultas.buscar_um(cursor, 'emprestimos.por_id', (emprestimo_id,))
+    if not emprestimo or (usuario_id is not None and emprestimo['usuario_id'] != usuario_id):
+        raise ErroOperacao("Empréstimo não encontrado!")
+
+    if emprestimo['status'] != 'emprestado':
+        raise ErroOperacao("Este empréstimo já foi devolvido!")
 
+    hoje = datetime.now()
+    nova_data = (hoje + timedelta(days=prazo)).strftime('%Y-%m-%d')
+    try:
+        renovar(cursor, emprestimo, hoje.strftime('%Y-%m-%d'), nova_data, maximo)
+    except ErroOperacao as e:
+        raise ErroOperacao(f"Não foi possível renovar '{emprestimo['titulo']}': {e}.")
+
+    return (f"Empréstimo de '{emprestimo['titulo']}' renovado até "
+            f"{datetime.strptime(nova_data, '%Y-%m-%d').strftime('%d/%m/%Y')}!")
+
+def operacao_renovar_todos(cursor, usuario_id, prazo, maximo):
+    """Renova todos os empréstimos ativos de um usuário em uma só transação
+
+    Os empréstimos que não podem ser renovados ficam como estão e são
+    listados na mensagem com o motivo.
+    """
+    emprestimos = consultas.buscar_todos(cursor, 'emprestimos.ativos_para_renovar', (usuario_id,))
+    if not emprestimos:
+        raise ErroOperacao("Nenhum empréstimo ativo para renovar!")
+
+    hoje = datetime.now()
+    nova_data = (hoje + timedelta(days=prazo)).strftime('%Y-%m-%d')
+    renovados = 0
+    recusados = []
+    for emprestimo in emprestimos:
+        try:
+            renovar(cursor, emprestimo, hoje.strftime('%Y-%m-%d'), nova_data, maximo)
+            renovados += 1
+        except ErroOperacao as e:
+            recusados.append(f"'{emprestimo['titulo']}' ({e})")
+
+    mensagem = (f"{renovados} empréstimo(s) renovado(s) até "
+                f"{datetime.strptime(nova_data, '%Y-%m-%d').strftime('%d/%m/%Y')}.")
+    if recusados:
+        mensagem += " Não renovados: " + "; ".join(recusados) + "."
+    return mensagem
+
+def voltar_para_emprestimos():
+    """Redireciona para a página de empréstimos do tipo de usuário logado"""
     if verificar_admin():
-        # Relatórios completos para admins
+        return redirect(url_for('.gerenciar_emprestimos'))
+    return redirect(url_for('.meus_emprestimos'))
 
-        # Relatório de livros emprestados
-        cursor.execute("""
-            SELECT l.titulo, l.autor, u.nome as usuario_nome, u.matricula,
-                   e.data_emprestimo, e.data_prevista
-            FROM emprestimos e
-            JOIN livros l ON e.livro_id = l.id
-            JOIN usuarios u ON e.usuario_id = u.id
-            WHERE e.status = 'emprestado'
-            ORDER BY e.data_emprestimo DESC
-        """)
-        livros_emprestados = cursor.fetchall()
+@bp.route("/renovar_emprestimo", methods=["POST"])
+@login_requerido
+def renovar_emprestimo():
+    """Renova um empréstimo - admins renovam qualquer um, alunos só os seus"""
+    usuario_id = None if verificar_admin() else session.get('usuario_id')
 
-        # Relatório de usuários com empréstimos atrasados
-        cursor.execute("""
-            SELECT u.nome, u.matricula, u.curso, l.titulo, 
-                   e.data_emprestimo, e.data_prevista,
-                   julianday('now') - julianday(e.data_prevista) as dias_atraso
-            FROM emprestimos e
-            JOIN usuarios u ON e.usuario_id = u.id
-            JOIN livros l ON e.livro_id = l.id
-            WHERE e.status = 'emprestado' AND e.data_prevista < DATE('now')
-            ORDER BY dias_atraso DESC
-        """)
-        emprestimos_atrasados = cursor.fetchall()
+    try:
+        flash(fila_escrita().executar(
+            operacao_renovar_emprestimo, request.form.get('emprestimo_id'), usuario_id,
+            current_app.config['EMPRESTIMO_PRAZO'], current_app.config['RENOVACOES_MAXIMO']
+        ))
+        invalidar_cache('estatisticas', 'relatorios')
+    except ErroOperacao as e:
+        flash(f"Erro: {e}")
+    except Exception as e:
+        flash(f"Erro ao renovar empréstimo: {str(e)}")
 
-        # Relatório de livros disponíveis
-        cursor.execute("""
-            SELECT titulo, autor, isbn, ano, quantidade
-            FROM livros
-            WHERE quantidade > 0
-            ORDER BY titulo
-        """)
-        livros_disponiveis = cursor.fetchall()
+    return voltar_para_emprestimos()
 
+@bp.route("/renovar_todos", methods=["POST"])
+@login_requerido
+def renovar_todos():
+    """Renova todos os empréstimos de um usuário - admins escolhem o usuário, alunos renovam os seus"""
+    if verificar_admin():
+        usuario_id = request.form.get('usuario_id')
     else:
-        # Relatórios limitados para alunos
-        livros_emprestados = []
-        emprestimos_atrasados = []
+        usuario_id = session.get('usuario_id')
 
-        # Apenas livros disponíveis
-        cursor.execute("""
-            SELECT titulo, autor, isbn, ano, quantidade
-            FROM livros
-            WHERE quantidade > 0
-            ORDER BY titulo
-        """)
-        livros_disponiveis = cursor.fetchall()
+    try:
+        flash(fila_escrita().executar(
+            operacao_renovar_todos, usuario_id,
+            current_app.config['EMPRESTIMO_PRAZO'], current_app.config['RENOVACOES_MAXIMO']
+        ))
+        invalidar_cache('estatisticas', 'relatorios')
+    except ErroOperacao as e:
+        flash(f"Erro: {e}")
+    except Exception as e:
+        flash(f"Erro ao renovar empréstimos: {str(e)}")
+
+    return voltar_para_emprestimos()
+
+# ROTAS PARA RESERVAS
+def operacao_reservar(cursor, usuario_id, livro_id, unidade_id=UNIDADE_PRINCIPAL):
+    """Coloca o usuário no fim da fila de reservas de um livro na unidade (executada pela fila de escrita)
+
+    A reserva é retirada na unidade em que foi feita: só exemplares dela são separados.
+    """
+    livro = consultas.buscar_um(cursor, 'livros.quantidade', (livro_id,))
+    if not livro:
+        raise ErroOperacao("Livro não encontrado!")
+
+    if consultas.buscar_um(cursor, 'exemplares.disponivel_na_unidade', (unidade_id, livro_id)):
+        raise ErroOperacao("Este livro tem exemplares disponíveis! Procure o balcão da biblioteca.")
+
+    if consultas.buscar_um(cursor, 'reservas.ativa_do_usuario', (usuario_id, livro_id)):
+        raise ErroOperacao("Você já possui uma reserva para este livro!")
+
+    criado_em = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    consultas.executar(cursor, 'reservas.inserir', (livro_id, usuario_id, criado_em, unidade_id))
+    return "Reserva realizada! Você será avisado quando um exemplar for separado."
+
+def liberar_exemplar_reservado(cursor, reserva, prazo_retirada):
+    """Passa o exemplar de uma reserva encerrada ao próximo da fila ou de volta ao acervo"""
+    if destinar_exemplar(cursor, reserva['exemplar_id'], reserva['livro_id'], prazo_retirada) is None:
+        eventos.registrar(cursor, 'liberacao', livro_id=reserva['livro_id'],
+                          exemplar_id=reserva['exemplar_id'], quantidade_delta=1)
+
+def operacao_cancelar_reserva(cursor, reserva_id, usuario_id, prazo_retirada):
+    """Cancela uma reserva do usuário; um exemplar já separado passa para o próximo da fila"""
+    reserva = consultas.buscar_um(cursor, 'reservas.por_id', (reserva_id,))
+    if not reserva or reserva['usuario_id'] != usuario_id:
+        raise ErroOperacao("Reserva não encontrada!")
+
+    if reserva['status'] not in ('aguardando', 'separada'):
+        raise ErroOperacao("Esta reserva não está mais ativa!")
+
+    consultas.executar(cursor, 'reservas.cancelar', (reserva_id,))
+    if reserva['status'] == 'separada':
+        liberar_exemplar_reservado(cursor, reserva, prazo_retirada)
+
+    return "Reserva cancelada."
+
+def operacao_expirar_reservas(cursor, agora, prazo_retirada, lote):
+    """Expira um lote de reservas separadas e não retiradas no prazo
+
+    Cada exemplar liberado segue para o próximo da fila (ou volta ao acervo).
+    Retorna quantas reservas foram expiradas.
+    """
+    vencidas = consultas.buscar_todos(cursor, 'reservas.vencidas', (agora, lote))
+    for reserva in vencidas:
+        if consultas.executar(cursor, 'reservas.expirar', (reserva['id'],)).rowcount:
+            liberar_exemplar_reservado(cursor, reserva, prazo_retirada)
+    return len(vencidas)
+
+def expirar_reservas():
+    """Expira todas as reservas vencidas de todas as unidades, um lote por transação"""
+    config = current_app.config
+    agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    total = 0
+    for unidade_id in ids_unidades():
+        while True:
+            expiradas = fila_escrita(unidade_id).executar(
+                operacao_expirar_reservas, agora, config['RESERVA_PRAZO_RETIRADA'], config['RESERVAS_LOTE']
+            )
+            total += expiradas
+            if expiradas < config['RESERVAS_LOTE']:
+                break
+
+    if total:
+        invalidar_cache('estatisticas', 'livros', 'relatorios')
+    return total
+
+def tarefa_reservas():
+    """Retorna a tarefa periódica que expira as reservas vencidas neste processo"""
+    def criar(app):
+        def executar():
+            with app.app_context():
+                expirar_reservas()
+        return TarefaPeriodica(executar, app.config['RESERVAS_EXPIRAR_A_CADA'], nome='expirar-reservas')
+    return recurso('tarefa_reservas', criar)
+
+def tarefa_replica():
+    """Retorna a tarefa periódica que atualiza as cópias de leitura neste processo"""
+    def criar(app):
+        def executar():
+            with app.app_context():
+                for arquivo in arquivos_unidades():
+                    replica(arquivo).atualizar()
+        return TarefaPeriodica(executar, app.config['REPLICA_ATUALIZAR_A_CADA'], nome='atualizar-replica')
+    return recurso('tarefa_replica', criar)
+
+def fazer_backups(forcar=True):
+    """Faz o backup de cada arquivo da rede e apaga os que passaram da retenção
+
+    Sem `forcar`, pula os arquivos com backup mais novo que BACKUP_A_CADA,
+    para que vários workers não façam o mesmo backup.
+    """
+    config = current_app.config
+    resultados = []
+    for arquivo in arquivos_unidades():
+        existentes = backup.listar(config['BACKUP_DIRETORIO'], arquivo)
+        if (not forcar and existentes
+                and (datetime.now() - existentes[-1][0]).total_seconds() < config['BACKUP_A_CADA']):
+            continue
+        resultados.append(backup.fazer_backup(
+            arquivo, config['BACKUP_DIRETORIO'], config['BACKUP_PAGINAS'], config['BACKUP_PAUSA']
+        ))
+        backup.limpar(config['BACKUP_DIRETORIO'], arquivo, config['BACKUP_MANTER'])
+    return resultados
+
+def tarefa_backup():
+    """Retorna a tarefa periódica dos backups automáticos neste processo"""
+    def criar(app):
+        def executar():
+            with app.app_context():
+                fazer_backups(forcar=False)
+        return TarefaPeriodica(executar, app.config['BACKUP_A_CADA'], nome='backup')
+    return recurso('tarefa_backup', criar)
+
+@bp.before_app_request
+def iniciar_tarefas():
+    """Garante que as tarefas em segundo plano estão rodando neste processo"""
+    if current_app.config['RESERVAS_EXPIRAR_A_CADA']:
+        tarefa_reservas().garantir()
+    if current_app.config['REPLICA_LEITURA']:
+        tarefa_replica().garantir()
+    if current_app.config['BACKUP_A_CADA']:
+        tarefa_backup().garantir()
+    if current_app.config['MULTAS_CALCULAR_A_CADA']:
+        tarefa_multas().garantir()
+
+@bp.route("/reservar", methods=["POST"])
+@login_requerido
+def reservar():
+    """Entra na fila de reservas de um livro indisponível - apenas alunos"""
+    if not verificar_aluno():
+        return redirect(url_for('.gerenciar_emprestimos'))
 
-    conn.close()
+    try:
+        flash(fila_escrita().executar(
+            operacao_reservar, session.get('usuario_id'), request.form.get('livro_id'), unidade_atual()
+        ))
+    except ErroOperacao as e:
+        flash(f"Erro: {e}")
+    except Exception as e:
+        flash(f"Erro ao reservar livro: {str(e)}")
 
-    # Gerar tabelas HTML
-    def gerar_tabela_emprestados():
-        if not livros_emprestados:
-            return "<p>Nenhum livro emprestado no momento.</p>"
+    return redirect(url_for('.meus_emprestimos'))
 
-        html = '''
-        <table class="table">
-            <thead>
-                <tr>
-                    <th>Livro</th>
-                    <th>Autor</th>
-                    <th>Usuário</th>
-                    <th>Matrícula</th>
-                    <th>Data Empréstimo</th>
-                    <th>Data Prevista</th>
-                </tr>
-            </thead>
-            <tbody>
-        '''
-        for item in livros_emprestados:
-            html += f'''
-                <tr>
-                    <td>{item['titulo']}</td>
-                    <td>{item['autor']}</td>
-                    <td>{item['usuario_nome']}</td>
-                    <td>{item['matricula']}</td>
-                    <td>{datetime.strptime(item['data_emprestimo'], '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
-                    <td>{datetime.strptime(item['data_prevista'], '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
-                </tr>
-            '''
-        html += "</tbody></table>"
-        return html
+@bp.route("/cancelar_reserva", methods=["POST"])
+@login_requerido
+def cancelar_reserva():
+    """Cancela uma reserva do aluno logado"""
+    if not verificar_aluno():
+        return redirect(url_for('.gerenciar_emprestimos'))
 
-    def gerar_tabela_atrasados():
-        if not emprestimos_atrasados:
-            return "<p>Nenhum empréstimo em atraso! 🎉</p>"
+    try:
+        flash(fila_escrita().executar(
+            operacao_cancelar_reserva, request.form.get('reserva_id'), session.get('usuario_id'),
+            current_app.config['RESERVA_PRAZO_RETIRADA']
+        ))
+        invalidar_cache('estatisticas', 'livros', 'relatorios')
+    except ErroOperacao as e:
+        flash(f"Erro: {e}")
+    except Exception as e:
+        flash(f"Erro ao cancelar reserva: {str(e)}")
 
-        html = '''
-        <table class="table">
-            <thead>
-                <tr>
-                    <th>Usuário</th>
-                    <th>Matrícula</th>
-                    <th>Curso</th>
-                    <th>Livro</th>
-                    <th>Data Prevista</th>
-                    <th>Dias de Atraso</th>
-                </tr>
-            </thead>
-            <tbody>
+    return redirect(url_for('.meus_emprestimos'))
+
+# ROTAS PARA RELATÓRIOS
+def gerar_tabela_emprestados():
+    """Gera a tabela HTML dos livros atualmente emprestados em toda a rede"""
+    html = '''
+    <table class="table">
+        <thead>
+            <tr>
+                <th>Livro</th>
+                <th>Autor</th>
+                <th>Usuário</th>
+                <th>Matrícula</th>
+                <th>Data Empréstimo</th>
+                <th>Data Prevista</th>
+            </tr>
+        </thead>
+        <tbody>
+    '''
+    vazio = True
+    itens = iterar_rede('emprestimos.ativos', registro=Emprestimo,
+                        chave=lambda item: item.data_emprestimo, reverso=True)
+    for item in itens:
+        vazio = False
+        html += f'''
+            <tr>
+                <td>{item.livro_titulo}</td>
+                <td>{item.autor}</td>
+                <td>{item.usuario_nome}</td>
+                <td>{item.matricula}</td>
+                <td>{datetime.strptime(item.data_emprestimo, '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+                <td>{datetime.strptime(item.data_prevista, '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+            </tr>
         '''
-        for item in emprestimos_atrasados:
-            dias_atraso = int(item['dias_atraso'])
-            html += f'''
-                <tr style="background-color: #ffebee;">
-                    <td>{item['nome']}</td>
-                    <td>{item['matricula']}</td>
-                    <td>{item['curso'] or 'N/A'}</td>
-                    <td>{item['titulo']}</td>
-                    <td>{datetime.strptime(item['data_prevista'], '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
-                    <td style="color: red; font-weight: bold;">{dias_atraso} dias</td>
-                </tr>
-            '''
-        html += "</tbody></table>"
-        return html
 
-    def gerar_tabela_disponiveis():
-        if not livros_disponiveis:
-            return "<p>Nenhum livro disponível no momento.</p>"
+    if vazio:
+        return "<p>Nenhum livro emprestado no momento.</p>"
+
+    html += "</tbody></table>"
+    return html
+
+def gerar_tabela_atrasados():
+    """Gera a tabela HTML dos usuários com empréstimos atrasados em toda a rede"""
+    html = '''
+    <table class="table">
+        <thead>
+            <tr>
+                <th>Usuário</th>
+                <th>Matrícula</th>
+                <th>Curso</th>
+                <th>Livro</th>
+                <th>Data Prevista</th>
+                <th>Dias de Atraso</th>
+                <th>Multa</th>
+            </tr>
+        </thead>
+        <tbody>
+    '''
+    vazio = True
+    itens = iterar_rede('emprestimos.atrasados', registro=Emprestimo,
+                        chave=lambda item: item.dias_atraso, reverso=True)
+    for item in itens:
+        vazio = False
+        dias_atraso = int(item.dias_atraso)
+        html += f'''
+            <tr style="background-color: #ffebee;">
+                <td>{item.usuario_nome}</td>
+                <td>{item.matricula}</td>
+                <td>{item.curso or 'N/A'}</td>
+                <td>{item.livro_titulo}</td>
+                <td>{datetime.strptime(item.data_prevista, '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+                <td style="color: red; font-weight: bold;">{dias_atraso} dias</td>
+                <td>{formatar_reais(item.multa) if item.multa else '-'}</td>
+            </tr>
+        '''
 
-        html = '''
-        <table class="table">
-            <thead>
-                <tr>
-                    <th>Título</th>
-                    <th>Autor</th>
-                    <th>ISBN</th>
-                    <th>Ano</th>
-                    <th>Quantidade Disponível</th>
-                </tr>
-            </thead>
-            <tbody>
+    if vazio:
+        return "<p>Nenhum empréstimo em atraso! 🎉</p>"
+
+    html += "</tbody></table>"
+    return html
+
+def gerar_tabela_disponiveis():
+    """Gera a tabela HTML dos livros disponíveis para empréstimo"""
+    conn = conectar_leitura()
+    cursor = conn.cursor()
+    html = '''
+    <table class="table">
+        <thead>
+            <tr>
+                <th>Título</th>
+                <th>Autor</th>
+                <th>ISBN</th>
+                <th>Ano</th>
+                <th>Quantidade Disponível</th>
+            </tr>
+        </thead>
+        <tbody>
+    '''
+    vazio = True
+    for livro in consultas.iterar(cursor, 'livros.disponiveis', registro=Livro):
+        vazio = False
+        html += f'''
+            <tr>
+                <td>{livro.titulo}</td>
+                <td>{livro.autor}</td>
+                <td>{livro.isbn or 'N/A'}</td>
+                <td>{livro.ano or 'N/A'}</td>
+                <td style="color: green; font-weight: bold;">{livro.quantidade}</td>
+            </tr>
         '''
-        for livro in livros_disponiveis:
-            html += f'''
-                <tr>
-                    <td>{livro['titulo']}</td>
-                    <td>{livro['autor']}</td>
-                    <td>{livro['isbn'] or 'N/A'}</td>
-                    <td>{livro['ano'] or 'N/A'}</td>
-                    <td style="color: green; font-weight: bold;">{livro['quantidade']}</td>
-                </tr>
-            '''
-        html += "</tbody></table>"
-        return html
+    conn.close()
+
+    if vazio:
+        return "<p>Nenhum livro disponível no momento.</p>"
+
+    html += "</tbody></table>"
+    return html
+
+def gerar_tabela_circulacao(dias=30):
+    """Gera a tabela HTML dos movimentos por dia nos últimos `dias` (tabela de relatório do log)"""
+    desde = (datetime.now() - timedelta(days=dias - 1)).strftime('%Y-%m-%d')
+    por_dia = {}
+    # Com UNIDADES_SEPARADAS cada arquivo traz as suas linhas do mesmo dia: somar
+    for dia, *movimentos in iterar_rede('relatorio.circulacao', (desde,), chave=lambda linha: linha[0], reverso=True):
+        total = por_dia.setdefault(dia, [0, 0, 0])
+        for i, quantidade in enumerate(movimentos):
+            total[i] += quantidade
+
+    if not por_dia:
+        return f"<p>Nenhum movimento nos últimos {dias} dias.</p>"
+
+    html = '''
+    <table class="table">
+        <thead>
+            <tr>
+                <th>Dia</th>
+                <th>Empréstimos</th>
+                <th>Devoluções</th>
+                <th>Renovações</th>
+            </tr>
+        </thead>
+        <tbody>
+    '''
+    for dia, (emprestimos, devolucoes, renovacoes) in por_dia.items():
+        html += f'''
+            <tr>
+                <td>{datetime.strptime(dia, '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+                <td>{emprestimos}</td>
+                <td>{devolucoes}</td>
+                <td>{renovacoes}</td>
+            </tr>
+        '''
+    html += "</tbody></table>"
+    return html
+
+@bp.route("/relatorios")
+@login_requerido
+def relatorios():
+    """Página de relatórios"""
+    cache = obter_cache()
+    hoje = datetime.now().strftime('%Y-%m-%d')
+
+    # Os fragmentos ficam em cache e são invalidados a cada empréstimo/devolução
+    # (com a cópia de leitura, a chave muda a cada atualização da cópia)
+    tabela_disponiveis = cache.obter_ou_calcular('relatorios', chave_leitura('disponiveis'), gerar_tabela_disponiveis)
 
     # Conteúdo diferente para admin e aluno
     if verificar_admin():
+        # Relatórios completos para admins
+        tabela_emprestados = cache.obter_ou_calcular('relatorios', chave_leitura('emprestados'), gerar_tabela_emprestados)
+        tabela_atrasados = cache.obter_ou_calcular('relatorios', chave_leitura(f'atrasados:{hoje}'), gerar_tabela_atrasados)
+        tabela_circulacao = cache.obter_ou_calcular('relatorios', chave_leitura(f'circulacao:{hoje}'), gerar_tabela_circulacao)
+
         conteudo = f'''
         <h2>📊 Relatórios da Biblioteca</h2>
+        {aviso_leitura()}
 
         <div style="margin-bottom: 40px;">
             <h3>📚 Livros Atualmente Emprestados</h3>
-            {gerar_tabela_emprestados()}
+            {tabela_emprestados}
         </div>
 
         <div style="margin-bottom: 40px;">
             <h3>⚠️ Usuários com Empréstimos Atrasados</h3>
-            {gerar_tabela_atrasados()}
+            {tabela_atrasados}
+        </div>
+
+        <div style="margin-bottom: 40px;">
+            <h3>📈 Circulação nos Últimos 30 Dias</h3>
+            {tabela_circulacao}
         </div>
 
         <div style="margin-bottom: 40px;">
             <h3>✅ Livros Disponíveis para Empréstimo</h3>
-            {gerar_tabela_disponiveis()}
+            {tabela_disponiveis}
         </div>
 
         <div style="text-align: center; margin-top: 30px;">
             <button onclick="window.print()" class="btn">🖨️ Imprimir Relatórios</button>
+            <a href="/relatorios/exportar/emprestados.csv" class="btn btn-secondary" style="text-decoration: none;">⬇️ Emprestados (CSV)</a>
+            <a href="/relatorios/exportar/atrasados.csv" class="btn btn-secondary" style="text-decoration: none;">⬇️ Atrasados (CSV)</a>
+            <a href="/relatorios/exportar/disponiveis.csv" class="btn btn-secondary" style="text-decoration: none;">⬇️ Disponíveis (CSV)</a>
+            <a href="/consultas" class="btn btn-secondary" style="text-decoration: none;">⏱️ Consultas</a>
+            <a href="/perfis" class="btn btn-secondary" style="text-decoration: none;">🔬 Perfis</a>
         </div>
         '''
     else:
+        # Relatórios limitados para alunos
         conteudo = f'''
         <h2>📊 Consulta de Livros</h2>
+        {aviso_leitura()}
 
         <div style="margin-bottom: 40px;">
             <h3>✅ Livros Disponíveis para Empréstimo</h3>
-            {gerar_tabela_disponiveis()}
+            {tabela_disponiveis}
         </div>
 
         <div style="background: #f8f9fa; padding: 20px; border-radius: 10px; margin-top: 30px;">
@@ -1399,32 +3300,308 @@ def relatorios():
 
     return render_template_string(HTML_TEMPLATE, titulo="Relatórios", conteudo=conteudo)
 
+# Relatórios que podem ser exportados (consultas 'exportacao.*' do registro)
+RELATORIOS_EXPORTACAO = ('emprestados', 'atrasados', 'disponiveis')
+
+@bp.route("/relatorios/exportar/<relatorio>.csv")
+@admin_requerido
+def exportar_relatorio(relatorio):
+    """Exporta um relatório em CSV - apenas admins"""
+    if relatorio not in RELATORIOS_EXPORTACAO:
+        flash("Relatório não encontrado!")
+        return redirect(url_for('.relatorios'))
+
+    conteudo = gerar_csv(f'exportacao.{relatorio}')
+
+    return Response(
+        conteudo,
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={relatorio}.csv'}
+    )
+
+def _ler_alteracoes(caminho, desde, limite):
+    conn = conectar(caminho)
+    try:
+        cursor = conn.cursor()
+        return alteracoes.ler(cursor, desde, limite), alteracoes.primeiro(cursor)
+    finally:
+        conn.close()
+
+def acesso_alteracoes():
+    """Admins logados ou sistemas externos com o token do feed (Authorization: Bearer)"""
+    if verificar_admin():
+        return True
+    token = current_app.config['ALTERACOES_TOKEN']
+    enviado = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(enviado.encode(), f"Bearer {token}".encode())
+
+# Com o adaptador de asgi.py a espera do long-poll não ocupa uma thread: sem
+# novidades, a rota responde na hora pedindo para ser chamada de novo depois de
+# CABECALHO_REPETIR segundos, e o adaptador aguarda no loop de eventos. Ele
+# informa em REPETIR_DESDE o instante (time.monotonic) da primeira chamada.
+REPETIR_DESDE = 'biblioteca.repetir_desde'
+CABECALHO_REPETIR = 'X-Repetir-Em'
+
+@bp.route("/alteracoes")
+def feed_alteracoes():
+    """Alterações de livros, usuários e empréstimos depois de um seq, em JSON
+
+    Parâmetros: desde (último seq já processado), limite (tamanho do lote),
+    espera (segundos para aguardar novidades se não houver nenhuma) e
+    unidade (com UNIDADES_SEPARADAS, cada unidade tem a sua sequência).
+    A resposta traz `primeiro`, o menor seq ainda guardado: se desde + 1 é
+    menor que ele, a limpeza já apagou alterações que o consumidor não viu.
+    """
+    if not acesso_alteracoes():
+        return jsonify(erro="Acesso negado"), 401
+
+    config = current_app.config
+    desde = request.args.get('desde', 0, type=int)
+    limite = max(1, min(request.args.get('limite', 100, type=int), config['ALTERACOES_LIMITE']))
+    espera = max(0.0, min(request.args.get('espera', 0, type=float), config['ALTERACOES_ESPERA_MAXIMA']))
+    unidade_id = request.args.get('unidade', UNIDADE_PRINCIPAL, type=int)
+    if not unidade_cadastrada(unidade_id):
+        return jsonify(erro="Unidade não encontrada"), 404
+    caminho = arquivo_banco(unidade_id)
+
+    # Long-poll: consulta de novo a cada intervalo até aparecer algo ou a espera acabar
+    inicio = request.environ.get(REPETIR_DESDE)
+    prazo = (time.monotonic() if inicio is None else inicio) + espera
+    while True:
+        lista, primeiro = _ler_alteracoes(caminho, desde, limite)
+        restante = prazo - time.monotonic()
+        if lista or restante <= 0:
+            break
+        pausa = min(config['ALTERACOES_INTERVALO'], restante)
+        if inicio is not None:
+            return Response(status=204, headers={CABECALHO_REPETIR: f"{pausa:.3f}"})
+        time.sleep(pausa)
+
+    return jsonify(
+        alteracoes=lista,
+        proximo=lista[-1]['seq'] if lista else desde,
+        mais=len(lista) == limite,
+        primeiro=primeiro,
+    )
+
+@bp.route("/consultas")
+@admin_requerido
+def consultas_quentes():
+    """Chamadas e tempo de cada consulta do registro neste processo - apenas admins"""
+    linhas = ""
+    for nome, chamadas, total, maximo in consultas.estatisticas.mais_quentes():
+        linhas += f'''
+            <tr>
+                <td>{nome}</td>
+                <td>{chamadas}</td>
+                <td>{total * 1000:.1f}</td>
+                <td>{total / chamadas * 1000:.2f}</td>
+                <td>{maximo * 1000:.2f}</td>
+            </tr>
+        '''
+
+    if linhas:
+        tabela = f'''
+        <table class="table">
+            <thead>
+                <tr>
+                    <th>Consulta</th>
+                    <th>Chamadas</th>
+                    <th>Tempo Total (ms)</th>
+                    <th>Média (ms)</th>
+                    <th>Máximo (ms)</th>
+                </tr>
+            </thead>
+            <tbody>{linhas}</tbody>
+        </table>
+        '''
+    else:
+        tabela = "<p>Nenhuma consulta executada ainda neste processo.</p>"
+
+    conteudo = f'''
+    <h2>⏱️ Consultas Mais Quentes</h2>
+    <p>Estatísticas do processo atual, ordenadas pelo tempo total gasto em cada consulta do registro.</p>
+    {tabela}
+    '''
+
+    return render_template_string(HTML_TEMPLATE, titulo="Consultas", conteudo=conteudo)
+
+# PERFIS DE REQUISIÇÕES
+@bp.before_app_request
+def iniciar_perfil():
+    """Inicia o perfil da requisição se um admin pediu (sem o pedido, não faz nada)"""
+    modo = request.args.get('perfil') or request.headers.get('X-Perfil')
+    if not modo or not verificar_admin():
+        return
+    g.perfil = perfis.PerfilRequisicao.iniciar(modo, current_app.config['PERFIS_INTERVALO_AMOSTRAS'])
+
+@bp.after_app_request
+def gravar_perfil(resposta):
+    """Grava o perfil da requisição e informa o nome no cabeçalho X-Perfil da resposta"""
+    perfil = g.pop('perfil', None)
+    if perfil is None:
+        return resposta
+    config = current_app.config
+    nome = perfil.gravar(config['PERFIS_DIRETORIO'], request.method, request.full_path.rstrip('?'),
+                         resposta.status_code)
+    perfis.limpar(config['PERFIS_DIRETORIO'], config['PERFIS_MANTER'])
+    resposta.headers['X-Perfil'] = nome
+    return resposta
+
+@bp.teardown_app_request
+def encerrar_perfil(erro=None):
+    """Libera o perfil de uma requisição que terminou com exceção (sem gravar)"""
+    perfil = g.pop('perfil', None)
+    if perfil is not None:
+        perfil.parar()
+
+@bp.route("/perfis")
+@admin_requerido
+def listar_perfis():
+    """Perfis de requisições gravados recentemente - apenas admins"""
+    linhas = ""
+    for perfil in perfis.listar(current_app.config['PERFIS_DIRETORIO']):
+        links = " ".join(f'<a href="/perfis/{arquivo}">{arquivo.rsplit(".", 1)[1]}</a>'
+                         for arquivo in perfil['arquivos'])
+        detalhe = f"{perfil['amostras']} amostras" if perfil['amostras'] is not None else ""
+        linhas += f'''
+            <tr>
+                <td>{datetime.strptime(perfil['criado_em'], '%Y-%m-%d %H:%M:%S').strftime('%d/%m/%Y %H:%M:%S')}</td>
+                <td>{perfil['metodo']} {escape(perfil['rota'])}</td>
+                <td>{perfil['status']}</td>
+                <td>{perfil['modo']}</td>
+                <td>{perfil['duracao'] * 1000:.1f}</td>
+                <td>{detalhe}</td>
+                <td>{links}</td>
+            </tr>
+        '''
+
+    if linhas:
+        tabela = f'''
+        <table class="table">
+            <thead>
+                <tr>
+                    <th>Quando</th>
+                    <th>Requisição</th>
+                    <th>Status</th>
+                    <th>Modo</th>
+                    <th>Duração (ms)</th>
+                    <th>Amostras</th>
+                    <th>Arquivos</th>
+                </tr>
+            </thead>
+            <tbody>{linhas}</tbody>
+        </table>
+        '''
+    else:
+        tabela = "<p>Nenhum perfil gravado ainda.</p>"
+
+    conteudo = f'''
+    <h2>🔬 Perfis de Requisições</h2>
+    <p>Para gravar o perfil de uma página, abra-a como admin com <code>?perfil=cprofile</code>
+    (tempo por função; o .prof abre no snakeviz ou no flameprof) ou <code>?perfil=amostras</code>
+    (amostras da pilha; o .folded abre no speedscope ou no flamegraph.pl). Também vale o cabeçalho
+    <code>X-Perfil</code>. Os {current_app.config['PERFIS_MANTER']} perfis mais recentes ficam guardados.</p>
+    {tabela}
+    '''
+
+    return render_template_string(HTML_TEMPLATE, titulo="Perfis", conteudo=conteudo)
+
+@bp.route("/perfis/<nome>")
+@admin_requerido
+def baixar_perfil(nome):
+    """Baixa um arquivo de perfil - apenas admins"""
+    if not perfis.NOME_VALIDO.match(nome) or nome.endswith('.json'):
+        abort(404)
+    caminho = os.path.join(os.path.abspath(current_app.config['PERFIS_DIRETORIO']), nome)
+    if not os.path.exists(caminho):
+        abort(404)
+    mimetype = 'application/octet-stream' if nome.endswith('.prof') else 'text/plain'
+    return send_file(caminho, mimetype=mimetype, as_attachment=nome.endswith('.prof'))
+
+# TRAÇOS DAS REQUISIÇÕES
+def exportador_tracos():
+    """Retorna o exportador dos traços deste processo"""
+    return recurso('exportador_tracos', lambda app: tracos.ExportadorJSONL(app.config['TRACOS_ARQUIVO']))
+
+def abrir_span_template(remetente, template, context, **extra):
+    traco = tracos.atual()
+    if traco is not None:
+        traco.abrir('render_template', {'template': template.name})
+
+def fechar_span_template(remetente, template, context, **extra):
+    traco = tracos.atual()
+    if traco is not None:
+        traco.fechar()
+
+@bp.before_app_request
+def iniciar_traco():
+    """Começa o traço da requisição (com os traços desligados, não faz nada)"""
+    if not current_app.config['TRACOS_ARQUIVO']:
+        return
+    rota = request.url_rule.rule if request.url_rule else request.path
+    tracos.iniciar(f"{request.method} {rota}", request.headers.get('traceparent'))
+
+@bp.after_app_request
+def exportar_traco(resposta):
+    """Grava o traço da requisição se ele for sorteado ou se a requisição foi lenta"""
+    traco = tracos.encerrar()
+    if traco is None:
+        return resposta
+    config = current_app.config
+    fim = time.time_ns()
+    if tracos.amostrar(traco, (fim - traco.inicio) / 1e6, config['TRACOS_AMOSTRAGEM'], config['TRACOS_LENTO_MS']):
+        exportador_tracos().exportar(traco.otlp(fim, {
+            'http.request.method': request.method,
+            'http.route': request.url_rule.rule if request.url_rule else None,
+            'url.path': request.path,
+            'http.response.status_code': resposta.status_code,
+        }, erro=resposta.status_code >= 500))
+    return resposta
+
+@bp.teardown_app_request
+def descartar_traco(erro=None):
+    """Descarta o traço de uma requisição que não chegou ao fim normalmente"""
+    tracos.encerrar()
+
+def aquecer():
+    """Executa as consultas mais usadas uma vez e preenche o cache das páginas"""
+    cache = obter_cache()
+    hoje = datetime.now().strftime('%Y-%m-%d')
+    cache.obter_ou_calcular('estatisticas', chave_leitura(hoje), calcular_estatisticas)
+    cache.obter_ou_calcular('livros', chave_leitura('tabela'), gerar_tabela_livros)
+    cache.obter_ou_calcular('relatorios', chave_leitura('disponiveis'), gerar_tabela_disponiveis)
+    cache.obter_ou_calcular('relatorios', chave_leitura('emprestados'), gerar_tabela_emprestados)
+    cache.obter_ou_calcular('relatorios', chave_leitura(f'atrasados:{hoje}'), gerar_tabela_atrasados)
+    cache.obter_ou_calcular('relatorios', chave_leitura(f'circulacao:{hoje}'), gerar_tabela_circulacao)
+
 def inserir_dados_exemplo():
     """Insere alguns dados de exemplo para demonstração"""
     conn = conectar()
     cursor = conn.cursor()
 
     # Verificar se já existem dados
-    cursor.execute("SELECT COUNT(*) as total FROM livros")
-    if cursor.fetchone()['total'] > 0:
+    if consultas.buscar_um(cursor, 'livros.contar')['total'] > 0:
         conn.close()
         return
 
     # Inserir livros de exemplo
     livros_exemplo = [
-        ("Dom Casmurro", "Machado de Assis", "978-85-359-0277-5", 1899, 2),
-        ("O Cortiço", "Aluísio Azevedo", "978-85-260-1631-8", 1890, 1),
-        ("Capitães da Areia", "Jorge Amado", "978-85-254-0024-7", 1937, 3),
+        ("Dom Casmurro", "Machado de Assis", "978-85-359-0277-8", 1899, 2),
+        ("O Cortiço", "Aluísio Azevedo", "978-85-260-1631-6", 1890, 1),
+        ("Capitães da Areia", "Jorge Amado", "978-85-254-0024-6", 1937, 3),
         ("Python para Iniciantes", "Eric Matthes", "978-85-7522-718-3", 2019, 2),
-        ("Algoritmos e Estruturas de Dados", "Thomas Cormen", "978-85-352-8913-9", 2012, 1),
-        ("História do Brasil", "Boris Fausto", "978-85-314-0556-2", 2013, 2)
+        ("Algoritmos e Estruturas de Dados", "Thomas Cormen", "978-85-352-8913-8", 2012, 1),
+        ("História do Brasil", "Boris Fausto", "978-85-314-0556-3", 2013, 2)
     ]
 
     for livro in livros_exemplo:
-        cursor.execute("""
-            INSERT INTO livros (titulo, autor, isbn, ano, quantidade)
-            VALUES (?, ?, ?, ?, ?)
-        """, livro)
+        livro_id = consultas.executar(cursor, 'livros.inserir', livro + (
+            isbn.normalizar(livro[2]), chave_texto(livro[0]), chave_texto(livro[1])
+        )).lastrowid
+        criar_exemplares(cursor, livro_id, livro[4])
+        eventos.registrar(cursor, 'importacao', livro_id=livro_id, unidade_id=UNIDADE_PRINCIPAL,
+                          quantidade_delta=livro[4], exemplares=livro[4])
 
     # Inserir usuários de exemplo
     usuarios_exemplo = [
@@ -1436,10 +3613,7 @@ def inserir_dados_exemplo():
     ]
 
     for usuario in usuarios_exemplo:
-        cursor.execute("""
-            INSERT INTO usuarios (nome, matricula, curso)
-            VALUES (?, ?, ?)
-        """, usuario)
+        consultas.executar(cursor, 'usuarios.inserir', usuario + ('aluno', UNIDADE_PRINCIPAL, chave_texto(usuario[0])))
 
     # Inserir alguns empréstimos de exemplo
     emprestimos_exemplo = [
@@ -1448,25 +3622,397 @@ def inserir_dados_exemplo():
         (3, 5, "2024-05-15", "2024-05-22"),  # Pedro emprestou Algoritmos (atrasado)
     ]
 
-    for emp in emprestimos_exemplo:
-        cursor.execute("""
-            INSERT INTO emprestimos (usuario_id, livro_id, data_emprestimo, data_prevista)
-            VALUES (?, ?, ?, ?)
-        """, emp)
+    for usuario_id, livro_id, data_emprestimo, data_prevista in emprestimos_exemplo:
+        # Separar um exemplar e diminuir a quantidade disponível do livro
+        exemplar = consultas.buscar_um(cursor, 'exemplares.disponivel_do_livro', (livro_id,))
+        consultas.executar(cursor, 'exemplares.emprestar', (exemplar['id'],))
+        consultas.executar(cursor, 'livros.retirar_exemplar', (livro_id,))
 
-        # Diminuir quantidade do livro emprestado
-        cursor.execute("""
-            UPDATE livros SET quantidade = quantidade - 1 WHERE id = ?
-        """, (emp[1],))
+        emprestimo_id = consultas.executar(cursor, 'emprestimos.inserir', (
+            usuario_id, livro_id, exemplar['id'], data_emprestimo, data_prevista, UNIDADE_PRINCIPAL
+        )).lastrowid
+
+        # Ocupar a vaga no contador do usuário
+        consultas.executar(cursor, 'usuarios.ocupar_vaga', (usuario_id,))
+
+        eventos.registrar(cursor, 'emprestimo', livro_id=livro_id, usuario_id=usuario_id,
+                          exemplar_id=exemplar['id'], emprestimo_id=emprestimo_id, unidade_id=UNIDADE_PRINCIPAL,
+                          quantidade_delta=-1, ativos_delta=1, data_prevista=data_prevista)
 
     conn.commit()
     conn.close()
     print("Dados de exemplo inseridos com sucesso!")
 
-if __name__ == "__main__":
-    criar_tabelas()
+@bp.cli.command("init-db")
+def comando_init_db():
+    """Cria as tabelas e o administrador padrão"""
+    migrar_esquema()
     criar_admin_padrao()
+    click.echo("Banco de dados inicializado.")
+
+@bp.cli.command("migrar")
+def comando_migrar():
+    """Atualiza o esquema de todos os arquivos do banco para a versão atual"""
+    migrar_esquema()
+    click.echo(f"Esquema na versão {VERSAO_ESQUEMA}.")
+
+@bp.cli.command("seed")
+def comando_seed():
+    """Insere os dados de exemplo (apenas se o acervo estiver vazio)"""
+    criar_tabelas()
     inserir_dados_exemplo()
+    invalidar_cache('estatisticas', 'livros', 'relatorios')
+
+@bp.cli.command("verificar-contadores")
+@click.option("--corrigir", is_flag=True, help="Recalcula os contadores divergentes.")
+def comando_verificar_contadores(corrigir):
+    """Verifica os contadores de empréstimos dos usuários e a quantidade disponível dos livros"""
+    divergencias = verificar_contadores(corrigir=corrigir)
+    for usuario in divergencias:
+        click.echo(f"{usuario['nome']} ({usuario['matricula']}): "
+                   f"contador={usuario['emprestimos_ativos']} real={usuario['total_real']}")
+
+    quantidades = verificar_quantidades(corrigir=corrigir)
+    for livro in quantidades:
+        click.echo(f"{livro['titulo']} (livro {livro['id']}): "
+                   f"quantidade={livro['quantidade']} exemplares disponíveis={livro['total_real']}")
+
+    total = len(divergencias) + len(quantidades)
+    if not total:
+        click.echo("Todos os contadores estão consistentes.")
+    elif corrigir:
+        click.echo(f"{total} contador(es) corrigido(s).")
+    else:
+        click.echo(f"{total} divergência(s). Use --corrigir para recalcular.")
+
+def operacao_criar_unidade(cursor, nome, sigla):
+    """Cadastra uma unidade no banco principal (executada pela fila de escrita)"""
+    try:
+        return consultas.executar(cursor, 'unidades.inserir', (nome, sigla)).lastrowid
+    except sqlite3.IntegrityError:
+        raise ErroOperacao(f"Já existe uma unidade com a sigla {sigla}!")
+
+@bp.cli.command("criar-unidade")
+@click.argument("nome")
+@click.argument("sigla")
+def comando_criar_unidade(nome, sigla):
+    """Cadastra uma nova unidade (e cria o seu arquivo, com UNIDADES_SEPARADAS)"""
+    try:
+        unidade_id = fila_escrita(UNIDADE_PRINCIPAL).executar(operacao_criar_unidade, nome, sigla.upper())
+    except ErroOperacao as e:
+        raise click.ClickException(str(e))
+
+    if current_app.config['UNIDADES_SEPARADAS']:
+        criar_tabelas(arquivo_banco(unidade_id))
+        click.echo(f"Unidade {unidade_id} criada em {arquivo_banco(unidade_id)}.")
+    else:
+        click.echo(f"Unidade {unidade_id} criada.")
+
+@bp.cli.command("criar-snapshot")
+def comando_criar_snapshot():
+    """Tira um snapshot dos contadores para acelerar o replay do log de circulação"""
+    for unidade_id in ids_unidades():
+        snapshot_id = fila_escrita(unidade_id).executar(eventos.criar_snapshot)
+        click.echo(f"Snapshot {snapshot_id} criado em {arquivo_banco(unidade_id)}.")
+
+def operacao_reconstruir_contadores(cursor):
+    """Corrige os contadores e o relatório de circulação pelo replay do log (executada pela fila de escrita)"""
+    return eventos.reconstruir(cursor)
+
+@bp.cli.command("reconstruir-contadores")
+@click.option("--corrigir", is_flag=True, help="Aplica os valores reconstruídos aos contadores.")
+def comando_reconstruir_contadores(corrigir):
+    """Reconstrói a quantidade dos livros, os contadores dos usuários e o relatório de circulação pelo log"""
+    total = 0
+    for unidade_id in ids_unidades():
+        conn = conectar(arquivo_banco(unidade_id))
+        livros, usuarios = eventos.divergencias(conn.cursor())
+        dias = eventos.circulacao_divergente(conn.cursor())
+        conn.close()
+
+        for livro in livros:
+            click.echo(f"{livro['titulo']} (livro {livro['id']}): "
+                       f"quantidade={livro['quantidade']} pelo log={livro['total_real']}")
+        for usuario in usuarios:
+            click.echo(f"{usuario['nome']} ({usuario['matricula']}): "
+                       f"contador={usuario['emprestimos_ativos']} pelo log={usuario['total_real']}")
+        if dias:
+            click.echo(f"Relatório de circulação em {arquivo_banco(unidade_id)}: {dias} linha(s) diferente(s) do log")
+        total += len(livros) + len(usuarios) + dias
+
+        if corrigir and (livros or usuarios or dias):
+            fila_escrita(unidade_id).executar(operacao_reconstruir_contadores)
+
+    if not total:
+        click.echo("Os contadores batem com o log de circulação.")
+    elif corrigir:
+        invalidar_cache('estatisticas', 'livros', 'relatorios')
+        click.echo(f"{total} contador(es) reconstruído(s) pelo log.")
+    else:
+        click.echo(f"{total} divergência(s) com o log. Use --corrigir para reconstruir.")
+
+@bp.cli.command("eventos")
+@click.option("--desde", default=0, help="Último seq já processado.")
+@click.option("--seguir", is_flag=True, help="Continua esperando novos eventos (como tail -f).")
+@click.option("--unidade", default=UNIDADE_PRINCIPAL, help="Unidade (com UNIDADES_SEPARADAS).")
+@click.option("--lote", default=500, help="Eventos lidos por consulta.")
+def comando_eventos(desde, seguir, unidade, lote):
+    """Mostra o log de circulação em JSON, um evento por linha"""
+    if not unidade_cadastrada(unidade):
+        raise click.ClickException(f"Unidade {unidade} não encontrada.")
+    caminho = arquivo_banco(unidade)
+    if seguir:
+        for evento in eventos.acompanhar(lambda: conectar(caminho), desde, lote):
+            click.echo(json.dumps(evento, ensure_ascii=False))
+        return
+
+    conn = conectar(caminho)
+    while True:
+        lidos = eventos.ler(conn.cursor(), desde, lote)
+        for evento in lidos:
+            click.echo(json.dumps(evento, ensure_ascii=False))
+            desde = evento['seq']
+        if len(lidos) < lote:
+            break
+    conn.close()
+
+def operacao_limpar_alteracoes(cursor, manter):
+    """Apaga as alterações anteriores às `manter` últimas (executada pela fila de escrita)"""
+    return consultas.executar(cursor, 'alteracoes.limpar', (manter,)).rowcount
+
+@bp.cli.command("limpar-alteracoes")
+@click.option("--manter", default=100000, type=click.IntRange(min=0), help="Mantém as N alterações mais recentes.")
+def comando_limpar_alteracoes(manter):
+    """Apaga do feed as alterações antigas (consumidores atrasados devem ressincronizar)"""
+    total = 0
+    for unidade_id in ids_unidades():
+        total += fila_escrita(unidade_id).executar(operacao_limpar_alteracoes, manter)
+    click.echo(f"{total} alteração(ões) apagada(s).")
+
+@bp.cli.command("backup")
+def comando_backup():
+    """Faz o backup online de todos os arquivos, sem parar o app (para agendar no cron)"""
+    for resultado in fazer_backups():
+        click.echo(f"{resultado.arquivo}: {resultado.tamanho / 1024:.0f} KiB em {resultado.duracao:.2f} s, "
+                   f"{resultado.passos} passo(s), {resultado.reinicios} reinício(s), "
+                   f"maior leitura contínua {resultado.bloqueio_maximo * 1000:.1f} ms")
+
+@bp.cli.command("restaurar-backup")
+@click.option("--ate", type=click.DateTime(['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d']),
+              help="Restaura o último backup feito até este instante (padrão: o mais recente).")
+@click.option("--unidade", type=int, help="Restaura só o arquivo desta unidade (com UNIDADES_SEPARADAS).")
+@click.option("--arquivo", type=click.Path(exists=True, dir_okay=False), help="Backup a restaurar (exige --unidade se separadas).")
+@click.option("--sim", is_flag=True, help="Não pede confirmação.")
+def comando_restaurar_backup(ate, unidade, arquivo, sim):
+    """Verifica e restaura um backup sobre o banco em uso"""
+    config = current_app.config
+    unidades_alvo = [unidade] if unidade else ids_unidades()
+    if arquivo and len(unidades_alvo) > 1:
+        raise click.ClickException("Use --unidade junto com --arquivo quando as unidades estão separadas.")
+
+    try:
+        planos = [(arquivo_banco(unidade_id), arquivo or backup.escolher(config['BACKUP_DIRETORIO'],
+                                                                            arquivo_banco(unidade_id), ate))
+                  for unidade_id in unidades_alvo]
+    except backup.ErroBackup as e:
+        raise click.ClickException(str(e))
+
+    for destino, origem in planos:
+        click.echo(f"{destino} <- {origem}")
+    if not sim:
+        click.confirm("O conteúdo atual será substituído. Continuar?", abort=True)
+
+    for destino, origem in planos:
+        try:
+            backup.restaurar(origem, destino)
+        except backup.ErroBackup as e:
+            raise click.ClickException(str(e))
+        click.echo(f"{destino} restaurado e verificado.")
+    invalidar_cache('estatisticas', 'livros', 'relatorios')
+
+@bp.cli.command("preencher-chaves")
+@click.option("--lote", default=1000, help="Linhas por transação.")
+def comando_preencher_chaves(lote):
+    """Calcula as chaves de ordenação/busca das linhas que ainda não as têm, em lotes"""
+    total = 0
+    for unidade_id in ids_unidades():
+        for tabela in CONSULTAS_CHAVES:
+            depois_de = 0
+            while depois_de is not None:
+                depois_de, preenchidas = fila_escrita(unidade_id).executar(
+                    operacao_preencher_chaves, tabela, depois_de, lote
+                )
+                total += preenchidas
+    if total:
+        invalidar_cache('livros', 'relatorios')
+    click.echo(f"{total} linha(s) com chaves preenchidas.")
+
+@bp.cli.command("normalizar-isbn")
+@click.option("--lote", default=1000, help="Livros por transação.")
+def comando_normalizar_isbn(lote):
+    """Preenche o ISBN-13 normalizado dos livros que ainda não o têm, em lotes"""
+    preenchidos = duplicados = reparados = 0
+    for unidade_id in ids_unidades():
+        depois_de = 0
+        while depois_de is not None:
+            depois_de, lote_preenchidos, lote_duplicados, lote_reparados = fila_escrita(unidade_id).executar(
+                operacao_normalizar_isbns, depois_de, lote
+            )
+            preenchidos += lote_preenchidos
+            duplicados += lote_duplicados
+            reparados += lote_reparados
+    click.echo(f"{preenchidos} ISBN(s) normalizado(s).")
+    if reparados:
+        click.echo(f"{reparados} deles com o dígito verificador reparado (veja o log).")
+    if duplicados:
+        click.echo(f"{duplicados} livro(s) com ISBN de outro livro. Use `flask mesclar-isbn` para juntá-los.")
+
+def duplicados_isbn(cursor):
+    """Pares (duplicado, mantido) de livros com o mesmo ISBN normalizado"""
+    pares = []
+    for livro in consultas.buscar_todos(cursor, 'livros.sem_isbn13', (0, -1)):
+        normalizado = isbn.reparar(livro['isbn'])
+        mantido = consultas.buscar_um(cursor, 'livros.por_isbn13', (normalizado,)) if normalizado else None
+        if mantido:
+            pares.append((livro, mantido))
+    return pares
+
+def operacao_mesclar_livros(cursor, duplicado_id, mantido_id):
+    """Junta um livro duplicado ao livro mantido e apaga o duplicado (executada pela fila de escrita)
+
+    Exemplares, empréstimos, reservas e anexos passam para o livro mantido,
+    que soma a quantidade disponível do duplicado. Quem estava na fila dos
+    dois livros fica só com a reserva do mantido. Retorna os endereços de
+    anexo que ficaram sem uso.
+    """
+    quantidade = consultas.buscar_um(cursor, 'livros.quantidade', (duplicado_id,))
+    if quantidade is None or consultas.buscar_um(cursor, 'livros.existe', (mantido_id,)) is None:
+        raise ErroOperacao("Livro não encontrado!")
+
+    consultas.executar(cursor, 'mesclagem.exemplares', (mantido_id, duplicado_id))
+    consultas.executar(cursor, 'mesclagem.emprestimos', (mantido_id, duplicado_id))
+    consultas.executar(cursor, 'mesclagem.cancelar_reservas_repetidas', (duplicado_id, mantido_id))
+    consultas.executar(cursor, 'mesclagem.reservas', (mantido_id, duplicado_id))
+
+    repetidos = consultas.buscar_todos(cursor, 'mesclagem.anexos_repetidos', (duplicado_id, mantido_id))
+    for anexo in repetidos:
+        consultas.executar(cursor, 'anexos.apagar', (anexo['id'],))
+    consultas.executar(cursor, 'mesclagem.anexos', (mantido_id, duplicado_id))
+
+    consultas.executar(cursor, 'mesclagem.somar_quantidade', (duplicado_id, mantido_id))
+    consultas.executar(cursor, 'mesclagem.apagar_livro', (duplicado_id,))
+    eventos.registrar(cursor, 'mesclagem', livro_id=mantido_id, quantidade_delta=quantidade['quantidade'],
+                      livro_mesclado=duplicado_id)
+    return sem_uso(cursor, {anexo['sha256'] for anexo in repetidos})
+
+@bp.cli.command("mesclar-isbn")
+@click.option("--aplicar", is_flag=True, help="Junta os duplicados (sem isso, só lista).")
+def comando_mesclar_isbn(aplicar):
+    """Lista e junta os livros cadastrados mais de uma vez com o mesmo ISBN"""
+    total = 0
+    for unidade_id in ids_unidades():
+        conn = conectar(arquivo_banco(unidade_id))
+        pares = duplicados_isbn(conn.cursor())
+        conn.close()
+
+        for duplicado, mantido in pares:
+            click.echo(f"'{duplicado['titulo']}' (livro {duplicado['id']}, ISBN {duplicado['isbn']}) "
+                       f"-> '{mantido['titulo']}' (livro {mantido['id']})")
+            if aplicar:
+                liberados = fila_escrita(unidade_id).executar(
+                    operacao_mesclar_livros, duplicado['id'], mantido['id']
+                )
+                if liberados:
+                    fila_escrita(unidade_id).executar(operacao_apagar_sem_uso, armazem_anexos(unidade_id), liberados)
+        total += len(pares)
+
+    if not total:
+        click.echo("Nenhum livro duplicado pelo ISBN.")
+    elif aplicar:
+        invalidar_cache('estatisticas', 'livros', 'relatorios')
+        click.echo(f"{total} livro(s) mesclado(s).")
+    else:
+        click.echo(f"{total} livro(s) duplicado(s). Use --aplicar para juntá-los.")
+
+@bp.cli.command("expirar-reservas")
+def comando_expirar_reservas():
+    """Expira as reservas separadas e não retiradas no prazo (para agendar no cron)"""
+    click.echo(f"{expirar_reservas()} reserva(s) expirada(s).")
+
+@bp.cli.command("calcular-multas")
+def comando_calcular_multas():
+    """Recalcula as multas dos empréstimos em atraso (para agendar no cron, à noite)"""
+    click.echo(f"{calcular_multas()} multa(s) criada(s) ou atualizada(s).")
+
+@bp.cli.command("analisar-tracos")
+@click.option('--arquivo', default=None, help="Arquivo JSONL dos traços (padrão: TRACOS_ARQUIVO)")
+@click.option('--repeticoes', default=10, show_default=True,
+              help="Vezes que a mesma consulta roda em um traço para ser apontada como N+1")
+@click.option('--limite', default=20, show_default=True, help="Traços e consultas listados")
+def comando_analisar_tracos(arquivo, repeticoes, limite):
+    """Lista os traços mais lentos, as consultas repetidas (N+1) e as consultas mais caras"""
+    arquivo = arquivo or current_app.config['TRACOS_ARQUIVO']
+    if not arquivo or not os.path.exists(arquivo):
+        raise click.ClickException("Arquivo de traços não encontrado (use --arquivo ou BIBLIOTECA_TRACOS_ARQUIVO).")
+
+    lista, por_consulta = tracos.resumir(arquivo, repeticoes)
+    click.echo(f"{len(lista)} traço(s). Mais lentos:")
+    for duracao, nome, total, repetida in lista[:limite]:
+        aviso = f"  N+1? {repetida[0]} x{repetida[1]}" if repetida else ""
+        click.echo(f"  {duracao:9.1f} ms  {total:4} consulta(s)  {nome}{aviso}")
+
+    click.echo("\nConsultas pelo tempo total:")
+    for nome, execucoes, total, maior in por_consulta[:limite]:
+        click.echo(f"  {total:9.1f} ms  {execucoes:6}x  maior {maior:7.2f} ms  {nome}")
+
+@bp.cli.command("hash-senhas")
+def comando_hash_senhas():
+    """Converte para scrypt as senhas de admin ainda em texto puro"""
+    conn = conectar(current_app.config['DATABASE'])
+    cursor = conn.cursor()
+    pendentes = consultas.buscar_todos(cursor, 'admin.senhas_texto_puro')
+    conn.close()
+
+    for admin in pendentes:
+        fila_escrita(UNIDADE_PRINCIPAL).executar(
+            operacao_atualizar_senha, admin['id'], admin['senha'],
+            gerar_hash(admin['senha'], current_app.config['SENHA_CUSTO'])
+        )
+    click.echo(f"{len(pendentes)} senha(s) convertida(s).")
+
+def parametros_nulos(sql):
+    """Parâmetros nulos para `sql`: um dicionário se usa nomes (:hoje), senão uma tupla"""
+    # Fora das strings, para não confundir '$.teto' ou '00:00' com parâmetros
+    nomes = re.findall(r"[:@$]([A-Za-z_]\w*)", re.sub(r"'[^']*'", "''", sql))
+    if nomes:
+        return dict.fromkeys(nomes)
+    return (None,) * sql.count('?')
+
+@bp.cli.command("explicar-consultas")
+@click.argument("nomes", nargs=-1)
+def comando_explicar_consultas(nomes):
+    """Mostra o plano de execução das consultas do registro"""
+    conn = conectar()
+    cursor = conn.cursor()
+    for nome in nomes or sorted(consultas.CONSULTAS):
+        sql = consultas.CONSULTAS[nome]
+        # Parâmetros nulos bastam para o SQLite escolher os índices
+        cursor.execute(f"EXPLAIN QUERY PLAN {sql}", parametros_nulos(sql))
+        click.echo(nome)
+        for linha in cursor.fetchall():
+            click.echo(f"    {linha['detail']}")
+    conn.close()
+
+def __getattr__(nome):
+    """Cria o app padrão sob demanda (`gunicorn app:app`, `flask --app app`)"""
+    if nome == 'app':
+        global app
+        app = criar_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {nome!r}")
+
+if __name__ == "__main__":
+    app = criar_app()
     print("=" * 50)
     print("🚀 SISTEMA DE BIBLIOTECA INICIADO!")
     print("=" * 50)
@@ -1474,5 +4020,6 @@ if __name__ == "__main__":
     print("📚 Sistema pronto para uso!")
     print("👨‍💼 Admin padrão: admin / admin123")
     print("👨‍🎓 Alunos de teste: matrículas 2024001 a 2024005")
+    print("💡 Banco novo? Rode: flask --app app init-db && flask --app app seed")
     print("=" * 50)
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
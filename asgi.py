@@ -0,0 +1,238 @@
+"""Modo de execução ASGI do sistema de biblioteca
+
+Uso: uvicorn asgi:aplicacao --workers 4
+
+As rotas do Flask são síncronas (WSGI): cada requisição roda em uma thread
+do pool deste adaptador, sem travar o loop de eventos. Assim uma página
+lenta (ex: /relatorios) não segura as páginas baratas que chegam ao mesmo
+tempo. O corpo da requisição é lido do cliente aos poucos, conforme a rota
+pede, e a resposta é enviada à medida que é gerada; nenhum dos dois fica
+inteiro na memória (ex: o envio de um anexo de 20 MB).
+
+A espera do long-poll de /alteracoes não ocupa thread: sem novidades a
+rota responde na hora com o cabeçalho CABECALHO_REPETIR, e o adaptador
+aguarda no loop de eventos e chama a rota de novo, até o prazo acabar.
+"""
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app import CABECALHO_REPETIR, REPETIR_DESDE, criar_app, encerrar_recursos
+
+
+class EntradaASGI:
+    """wsgi.input que busca o corpo no cliente (pelo loop de eventos) só quando é lido"""
+
+    def __init__(self, receive, loop):
+        self._receive = receive
+        self._loop = loop
+        self._buffer = bytearray()
+        self._fim = False
+
+    def _receber(self):
+        mensagem = asyncio.run_coroutine_threadsafe(self._receive(), self._loop).result()
+        if mensagem['type'] == 'http.disconnect':
+            self._fim = True
+            return
+        self._buffer += mensagem.get('body', b'')
+        self._fim = not mensagem.get('more_body')
+
+    def _retirar(self, tamanho):
+        dados = bytes(self._buffer[:tamanho])
+        del self._buffer[:tamanho]
+        return dados
+
+    def read(self, tamanho=-1):
+        if tamanho is None or tamanho < 0:
+            while not self._fim:
+                self._receber()
+            return self._retirar(len(self._buffer))
+        while not self._fim and len(self._buffer) < tamanho:
+            self._receber()
+        return self._retirar(tamanho)
+
+    def readline(self, tamanho=-1):
+        limite = None if tamanho is None or tamanho < 0 else tamanho
+        while (not self._fim and b'\n' not in self._buffer
+               and (limite is None or len(self._buffer) < limite)):
+            self._receber()
+        fim = self._buffer.find(b'\n') + 1 or len(self._buffer)
+        return self._retirar(fim if limite is None else min(fim, limite))
+
+    def readlines(self, dica=-1):
+        return list(self)
+
+    def __iter__(self):
+        while True:
+            linha = self.readline()
+            if not linha:
+                return
+            yield linha
+
+
+class RespostaWSGI:
+    """start_response e write de uma requisição, enviando ao cliente pelo loop de eventos
+
+    O cabeçalho só sai com a primeira parte do corpo (ou no fim), como pede
+    a PEP 3333, e cada envio espera o anterior: uma resposta grande anda no
+    ritmo do cliente em vez de se acumular na memória.
+    """
+
+    def __init__(self, send, loop):
+        self._send = send
+        self._loop = loop
+        self.status = None
+        self.headers = None
+        self.enviado = False
+
+    def _enviar(self, mensagem):
+        asyncio.run_coroutine_threadsafe(self._send(mensagem), self._loop).result()
+
+    def start_response(self, status, headers, exc_info=None):
+        if exc_info:
+            try:
+                if self.enviado:
+                    raise exc_info[1].with_traceback(exc_info[2])
+            finally:
+                exc_info = None
+        elif self.status is not None:
+            raise AssertionError("start_response já foi chamado (sem exc_info)")
+        self.status, self.headers = status, headers
+        return self.write
+
+    def repetir_em(self):
+        """Segundos pedidos pela rota para ser chamada de novo (None se ela respondeu)"""
+        for nome, valor in self.headers or ():
+            if nome.lower() == CABECALHO_REPETIR.lower():
+                return float(valor)
+        return None
+
+    def _iniciar(self):
+        if self.status is None:
+            raise AssertionError("A aplicação enviou o corpo antes de chamar start_response")
+        if not self.enviado:
+            self._enviar({
+                'type': 'http.response.start',
+                'status': int(self.status.split(' ', 1)[0]),
+                'headers': [(n.lower().encode('latin1'), v.encode('latin1')) for n, v in self.headers],
+            })
+            self.enviado = True
+
+    def write(self, dados):
+        self._iniciar()
+        if dados:
+            self._enviar({'type': 'http.response.body', 'body': dados, 'more_body': True})
+
+    def terminar(self):
+        self._iniciar()
+        self._enviar({'type': 'http.response.body', 'body': b''})
+
+    def erro(self):
+        """Responde 500 se nada foi enviado ainda"""
+        if not self.enviado:
+            self.status, self.headers = '500 Internal Server Error', [('Content-Type', 'text/plain; charset=utf-8')]
+            self._iniciar()
+            self._enviar({'type': 'http.response.body', 'body': 'Erro interno do servidor'.encode()})
+
+
+class AdaptadorASGI:
+    """Expõe uma aplicação WSGI como ASGI usando um pool de threads"""
+
+    def __init__(self, wsgi_app, threads=32, ao_encerrar=None):
+        self.wsgi_app = wsgi_app
+        self.ao_encerrar = ao_encerrar
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._ciclo_de_vida(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _ciclo_de_vida(self, receive, send):
+        while True:
+            mensagem = await receive()
+            if mensagem['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensagem['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                if self.ao_encerrar:
+                    self.ao_encerrar()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def _montar_environ(self, scope, entrada):
+        servidor = scope.get('server') or ('localhost', 80)
+        cliente = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf8').decode('latin1'),
+            'PATH_INFO': scope['path'].encode('utf8').decode('latin1'),
+            'QUERY_STRING': scope['query_string'].decode('latin1'),
+            'SERVER_NAME': servidor[0],
+            'SERVER_PORT': str(servidor[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': cliente[0],
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': entrada,
+            # O corpo termina quando o cliente diz (vale também sem Content-Length)
+            'wsgi.input_terminated': True,
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            REPETIR_DESDE: time.monotonic(),
+        }
+        for nome, valor in scope.get('headers', []):
+            nome = nome.decode('latin1').upper().replace('-', '_')
+            valor = valor.decode('latin1')
+            if nome == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = valor
+            elif nome == 'CONTENT_LENGTH':
+                environ['CONTENT_LENGTH'] = valor
+            else:
+                chave = f'HTTP_{nome}'
+                environ[chave] = f"{environ[chave]},{valor}" if chave in environ else valor
+        return environ
+
+    def _executar(self, environ, send, loop):
+        """Roda a aplicação WSGI nesta thread; retorna os segundos até repetir, ou None se respondeu"""
+        resposta = RespostaWSGI(send, loop)
+        try:
+            resultado = self.wsgi_app(environ, resposta.start_response)
+            try:
+                for parte in resultado:
+                    # Um pedido para repetir não vai para o cliente
+                    if resposta.repetir_em() is None:
+                        resposta.write(parte)
+            finally:
+                if hasattr(resultado, 'close'):
+                    resultado.close()
+            repetir = resposta.repetir_em()
+            if repetir is not None:
+                return repetir
+            resposta.terminar()
+        except BaseException:
+            resposta.erro()
+            raise
+        return None
+
+    async def _http(self, scope, receive, send):
+        loop = asyncio.get_running_loop()
+        environ = self._montar_environ(scope, EntradaASGI(receive, loop))
+        while True:
+            espera = await loop.run_in_executor(self.executor, self._executar, environ, send, loop)
+            if espera is None:
+                return
+            await asyncio.sleep(espera)
+
+
+app = criar_app()
+aplicacao = AdaptadorASGI(
+    app,
+    threads=int(os.environ.get('BIBLIOTECA_ASGI_THREADS', 32)),
+    ao_encerrar=lambda: encerrar_recursos(app),
+)
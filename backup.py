@@ -0,0 +1,180 @@
+"""Backup online do banco com a API de backup do SQLite
+
+A cópia é feita em passos de `paginas` páginas, com uma pausa entre eles.
+Entre um passo e outro o backup não segura nenhuma transação de leitura
+na origem, então os checkpoints do WAL seguem normalmente e o balcão não
+espera o backup. Se a origem for alterada por outra conexão durante a
+cópia, o SQLite recomeça do início; depois de `reinicios_maximo`
+recomeços a cópia é feita em um passo só, que em WAL também não bloqueia
+as escritas (apenas segura os checkpoints até terminar).
+
+Cada backup é verificado (PRAGMA integrity_check), comprimido com gzip e
+gravado com o horário no nome, o que permite restaurar o estado de um
+instante escolhido (o backup mais recente até aquele instante).
+"""
+import gzip
+import os
+import shutil
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import datetime
+
+FORMATO_MOMENTO = '%Y%m%d-%H%M%S'
+
+Resultado = namedtuple('Resultado', 'arquivo origem momento duracao bloqueio_maximo passos reinicios tamanho')
+
+
+class ErroBackup(Exception):
+    """Backup ou restauração que não pôde ser concluído"""
+
+
+class _MuitosReinicios(Exception):
+    pass
+
+
+def _prefixo(origem):
+    return os.path.splitext(os.path.basename(origem))[0]
+
+
+def nome_backup(origem, momento):
+    """Nome do arquivo de backup de `origem` feito em `momento`"""
+    return f"{_prefixo(origem)}-{momento.strftime(FORMATO_MOMENTO)}.db.gz"
+
+
+def verificar_integridade(caminho):
+    """Roda o PRAGMA integrity_check; levanta ErroBackup se o arquivo estiver corrompido"""
+    conn = sqlite3.connect(caminho)
+    try:
+        resultado = [linha[0] for linha in conn.execute("PRAGMA integrity_check")]
+    except sqlite3.DatabaseError as e:
+        raise ErroBackup(f"{caminho} não é um banco válido: {e}")
+    finally:
+        conn.close()
+    if resultado != ['ok']:
+        raise ErroBackup(f"{caminho} falhou na verificação de integridade: {'; '.join(resultado[:5])}")
+
+
+def copiar(origem, destino, paginas=256, pausa=0.005, reinicios_maximo=3):
+    """Copia `origem` para o arquivo `destino` com a API de backup
+
+    Retorna (passos, reinicios, bloqueio_maximo): `bloqueio_maximo` é o
+    maior tempo (s) de um passo, isto é, o maior tempo em que o backup
+    segurou uma leitura na origem de uma vez.
+    """
+    estado = {'passos': 0, 'reinicios': 0, 'restantes': None, 'maior': 0.0, 'inicio': time.perf_counter()}
+
+    def progresso(status, restantes, total):
+        agora = time.perf_counter()
+        estado['maior'] = max(estado['maior'], agora - estado['inicio'])
+        estado['passos'] += 1
+        if estado['restantes'] is not None and restantes > estado['restantes']:
+            estado['reinicios'] += 1
+            if estado['reinicios'] > reinicios_maximo:
+                raise _MuitosReinicios()
+        estado['restantes'] = restantes
+        if restantes and pausa:
+            time.sleep(pausa)
+        estado['inicio'] = time.perf_counter()
+
+    conn_origem = sqlite3.connect(origem)
+    conn_destino = sqlite3.connect(destino)
+    try:
+        try:
+            conn_origem.backup(conn_destino, pages=paginas, progress=progresso)
+        except _MuitosReinicios:
+            estado['inicio'] = time.perf_counter()
+            conn_origem.backup(conn_destino)
+            estado['maior'] = max(estado['maior'], time.perf_counter() - estado['inicio'])
+            estado['passos'] += 1
+        conn_destino.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        conn_destino.close()
+        conn_origem.close()
+    return estado['passos'], estado['reinicios'], estado['maior']
+
+
+def fazer_backup(origem, diretorio, paginas=256, pausa=0.005, momento=None):
+    """Faz o backup verificado e comprimido de `origem` em `diretorio`"""
+    momento = momento or datetime.now()
+    os.makedirs(diretorio, exist_ok=True)
+    arquivo = os.path.join(diretorio, nome_backup(origem, momento))
+    temporario = f"{arquivo}.{os.getpid()}.tmp"
+
+    inicio = time.perf_counter()
+    try:
+        passos, reinicios, bloqueio = copiar(origem, temporario, paginas, pausa)
+        verificar_integridade(temporario)
+        with open(temporario, 'rb') as entrada, gzip.open(f"{temporario}.gz", 'wb', compresslevel=6) as saida:
+            shutil.copyfileobj(entrada, saida, 1024 * 1024)
+        os.replace(f"{temporario}.gz", arquivo)
+    finally:
+        for resto in (temporario, f"{temporario}.gz"):
+            if os.path.exists(resto):
+                os.remove(resto)
+
+    return Resultado(arquivo, origem, momento, time.perf_counter() - inicio, bloqueio,
+                     passos, reinicios, os.path.getsize(arquivo))
+
+
+def listar(diretorio, origem):
+    """Backups de `origem` em `diretorio` como (momento, caminho), do mais antigo ao mais novo"""
+    prefixo = f"{_prefixo(origem)}-"
+    lista = []
+    if not os.path.isdir(diretorio):
+        return lista
+    for nome in os.listdir(diretorio):
+        if not (nome.startswith(prefixo) and nome.endswith('.db.gz')):
+            continue
+        try:
+            momento = datetime.strptime(nome[len(prefixo):-len('.db.gz')], FORMATO_MOMENTO)
+        except ValueError:
+            continue
+        lista.append((momento, os.path.join(diretorio, nome)))
+    return sorted(lista)
+
+
+def limpar(diretorio, origem, manter):
+    """Apaga os backups de `origem` mais antigos que os `manter` últimos; retorna os apagados"""
+    antigos = [caminho for _, caminho in listar(diretorio, origem)[:-manter or None]] if manter else []
+    for caminho in antigos:
+        os.remove(caminho)
+    return antigos
+
+
+def escolher(diretorio, origem, ate=None):
+    """Backup mais recente de `origem` feito até o instante `ate` (ou o último, sem `ate`)"""
+    candidatos = [caminho for momento, caminho in listar(diretorio, origem) if ate is None or momento <= ate]
+    if not candidatos:
+        raise ErroBackup(f"Nenhum backup de {_prefixo(origem)} em {diretorio}"
+                         + (f" até {ate:%d/%m/%Y %H:%M:%S}" if ate else "") + ".")
+    return candidatos[-1]
+
+
+def restaurar(arquivo, destino, paginas=-1):
+    """Restaura o backup `arquivo` sobre o banco `destino` depois de verificá-lo
+
+    A restauração usa a mesma API de backup no sentido inverso, então as
+    conexões abertas no banco passam a ver o conteúdo restaurado (não é
+    preciso parar o app, mas as escritas esperam a cópia terminar).
+    """
+    temporario = f"{destino}.restaurar.{os.getpid()}.tmp"
+    try:
+        try:
+            with gzip.open(arquivo, 'rb') as entrada, open(temporario, 'wb') as saida:
+                shutil.copyfileobj(entrada, saida, 1024 * 1024)
+        except (OSError, EOFError) as e:
+            raise ErroBackup(f"{arquivo} está corrompido: {e}")
+        verificar_integridade(temporario)
+
+        conn_origem = sqlite3.connect(temporario)
+        conn_destino = sqlite3.connect(destino, timeout=30)
+        try:
+            conn_origem.backup(conn_destino, pages=paginas)
+        finally:
+            conn_destino.close()
+            conn_origem.close()
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    verificar_integridade(destino)
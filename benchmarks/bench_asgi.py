@@ -0,0 +1,150 @@
+"""Compara o modo WSGI com o modo ASGI sob alta concorrência
+
+Sobe o mesmo app nos dois modos (servidor threaded do Werkzeug, como no
+`flask run`, e uvicorn com o adaptador de `asgi.py`). Depois dispara o
+mesmo conjunto de rotas com N clientes simultâneos e mostra vazão e
+latências.
+
+Uso: python benchmarks/bench_asgi.py --concorrencia 64 --duracao 10
+Requer: pip install uvicorn
+"""
+import argparse
+import asyncio
+import http.client
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROTAS = [
+    '/',
+    '/livros',
+    '/emprestimos',
+    '/relatorios',
+    '/relatorios/exportar/disponiveis.csv',
+]
+
+
+def preparar_banco():
+    """Copia o banco do repositório para um diretório temporário"""
+    pasta = tempfile.mkdtemp(prefix='bench_asgi_')
+    shutil.copy(os.path.join(RAIZ, 'biblioteca.db'), pasta)
+    os.chdir(pasta)
+    sys.path.insert(0, RAIZ)
+
+
+def subir_wsgi(app, porta):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    servidor = make_server('127.0.0.1', porta, app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor.shutdown
+
+
+def subir_asgi(aplicacao, porta):
+    import uvicorn
+    config = uvicorn.Config(aplicacao, host='127.0.0.1', port=porta,
+                            log_level='warning', backlog=4096)
+    servidor = uvicorn.Server(config)
+    threading.Thread(target=lambda: asyncio.run(servidor.serve()), daemon=True).start()
+    while not servidor.started:
+        time.sleep(0.05)
+
+    def parar():
+        servidor.should_exit = True
+    return parar
+
+
+def fazer_login(porta):
+    conn = http.client.HTTPConnection('127.0.0.1', porta)
+    conn.request('POST', '/login', body='tipo_usuario=admin&usuario=admin&senha=admin123',
+                 headers={'Content-Type': 'application/x-www-form-urlencoded'})
+    resposta = conn.getresponse()
+    resposta.read()
+    cookie = resposta.getheader('Set-Cookie').split(';', 1)[0]
+    conn.close()
+    return cookie
+
+
+def carga(porta, cookie, concorrencia, duracao):
+    latencias = []
+    erros = [0]
+    lock = threading.Lock()
+    fim = time.perf_counter() + duracao
+
+    def cliente(indice):
+        conn = http.client.HTTPConnection('127.0.0.1', porta, timeout=60)
+        locais = []
+        i = indice
+        while time.perf_counter() < fim:
+            rota = ROTAS[i % len(ROTAS)]
+            i += 1
+            inicio = time.perf_counter()
+            try:
+                conn.request('GET', rota, headers={'Cookie': cookie})
+                resposta = conn.getresponse()
+                resposta.read()
+                if resposta.status != 200:
+                    raise RuntimeError(resposta.status)
+                locais.append(time.perf_counter() - inicio)
+            except Exception:
+                with lock:
+                    erros[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', porta, timeout=60)
+        conn.close()
+        with lock:
+            latencias.extend(locais)
+
+    threads = [threading.Thread(target=cliente, args=(i,)) for i in range(concorrencia)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencias, erros[0]
+
+
+def relatar(nome, latencias, erros, duracao):
+    latencias.sort()
+
+    def pct(p):
+        return latencias[min(len(latencias) - 1, int(len(latencias) * p))] * 1000
+
+    print(f"{nome:6} {len(latencias) / duracao:9.1f} req/s  "
+          f"p50={pct(0.50):7.1f}ms  p95={pct(0.95):7.1f}ms  p99={pct(0.99):7.1f}ms  "
+          f"média={statistics.mean(latencias) * 1000:7.1f}ms  erros={erros}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concorrencia', type=int, default=64)
+    parser.add_argument('--duracao', type=float, default=10)
+    args = parser.parse_args()
+
+    preparar_banco()
+    from app import criar_admin_padrao
+    from asgi import aplicacao, app
+    with app.app_context():
+        criar_admin_padrao()
+
+    modos = [('WSGI', subir_wsgi, app, 8101),
+             ('ASGI', subir_asgi, aplicacao, 8102)]
+
+    print(f"Rotas: {', '.join(ROTAS)}")
+    print(f"Concorrência: {args.concorrencia} clientes, {args.duracao:.0f}s por modo\n")
+    for nome, subir, aplicacao_modo, porta in modos:
+        parar = subir(aplicacao_modo, porta)
+        cookie = fazer_login(porta)
+        latencias, erros = carga(porta, cookie, args.concorrencia, args.duracao)
+        parar()
+        relatar(nome, latencias, erros, args.duracao)
+
+
+if __name__ == '__main__':
+    main()
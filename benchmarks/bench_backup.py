@@ -0,0 +1,113 @@
+"""Duração do backup online e quanto ele atrasa os empréstimos no balcão
+
+Cria um banco temporário grande e, em uma thread, faz empréstimos e
+devoluções sem parar pela fila de escrita do app. Mede a latência dos
+empréstimos sem backup e durante um backup em passos (o padrão do app) e
+em um passo só. Mostra a duração de cada backup, quantas vezes ele
+recomeçou por causa das escritas e a maior leitura contínua na origem.
+
+Uso: python benchmarks/bench_backup.py --livros 300000 --paginas 256
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+import backup  # noqa: E402
+
+
+def popular(livros):
+    """Acervo de `livros` títulos (para o banco ficar grande) e um usuário de balcão"""
+    conn = app.conectar()
+    conn.executemany(
+        "INSERT INTO livros (titulo, autor, isbn, ano, quantidade) VALUES (?, ?, ?, ?, ?)",
+        ((f"Livro de teste número {i} " + 'x' * 200, f"Autor {i % 5000}", f"isbn-{i}", 1950 + i % 70, 0)
+         for i in range(livros))
+    )
+    conn.execute("INSERT INTO usuarios (nome, matricula, curso, tipo) VALUES ('Balcão', 'B0001', 'Curso', 'professor')")
+    usuario_id = conn.execute("SELECT id FROM usuarios WHERE matricula = 'B0001'").fetchone()[0]
+    conn.commit()
+    conn.close()
+    livro_id = app.fila_escrita().executar(app.operacao_cadastrar_livro, 'Livro do balcão', 'Autor', None, None, 1)
+    return usuario_id, livro_id
+
+
+def emprestar_ate(parar, usuario_id, livro_id, latencias):
+    """Empresta e devolve o mesmo livro até `parar`, guardando a latência de cada empréstimo"""
+    fila = app.fila_escrita()
+    limites = app.current_app.config['LIMITES_EMPRESTIMO']
+    conn = app.conectar()
+    while not parar.is_set():
+        inicio = time.perf_counter()
+        fila.executar(app.operacao_realizar_emprestimo, usuario_id, livro_id, limites)
+        latencias.append(time.perf_counter() - inicio)
+        emprestimo_id = conn.execute("SELECT MAX(id) FROM emprestimos").fetchone()[0]
+        fila.executar(app.operacao_devolver_livro, emprestimo_id)
+    conn.close()
+
+
+def medir(aplicacao, usuario_id, livro_id, fazer=None, duracao=2.0):
+    """Latências dos empréstimos enquanto `fazer()` roda (ou por `duracao` s, sem backup)"""
+    latencias = []
+    parar = threading.Event()
+
+    def balcao():
+        with aplicacao.app_context():
+            emprestar_ate(parar, usuario_id, livro_id, latencias)
+
+    thread = threading.Thread(target=balcao)
+    thread.start()
+    time.sleep(0.2)
+    resultado = fazer() if fazer else time.sleep(duracao)
+    parar.set()
+    thread.join()
+    return latencias, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--livros', type=int, default=300000)
+    parser.add_argument('--paginas', type=int, default=256)
+    parser.add_argument('--pausa', type=float, default=0.005)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        aplicacao = app.criar_app({'DATABASE': os.path.join(pasta, 'bench.db'), 'CRIAR_TABELAS': True,
+                                   'RESERVAS_EXPIRAR_A_CADA': 0, 'BACKUP_DIRETORIO': pasta})
+        with aplicacao.app_context():
+            usuario_id, livro_id = popular(args.livros)
+            banco = app.arquivo_banco()
+        # Aquecimento: o primeiro checkpoint do WAL depois da carga não entra na medição
+        medir(aplicacao, usuario_id, livro_id, duracao=1.0)
+        print(f"{args.livros} livros, banco de {os.path.getsize(banco) / 2 ** 20:.1f} MB\n")
+
+        cenarios = [
+            ('sem backup', None),
+            (f'backup em passos ({args.paginas} pág.)',
+             lambda: backup.fazer_backup(banco, pasta, args.paginas, args.pausa)),
+            ('backup em um passo', lambda: backup.fazer_backup(banco, pasta, -1, 0)),
+        ]
+        print(f"{'cenário':28} {'empr.':>6} {'p50 ms':>7} {'p99 ms':>7} {'máx ms':>7} "
+              f"{'backup s':>9} {'reinícios':>9} {'leitura máx ms':>15}")
+        for nome, fazer in cenarios:
+            latencias, resultado = medir(aplicacao, usuario_id, livro_id, fazer)
+            latencias.sort()
+            p99 = latencias[int(len(latencias) * 0.99) - 1] if len(latencias) >= 100 else latencias[-1]
+            colunas = (f"{resultado.duracao:>9.2f} {resultado.reinicios:>9} {resultado.bloqueio_maximo * 1000:>15.1f}"
+                       if resultado else f"{'-':>9} {'-':>9} {'-':>15}")
+            print(f"{nome:28} {len(latencias):>6} {statistics.median(latencias) * 1000:>7.2f} "
+                  f"{p99 * 1000:>7.2f} {latencias[-1] * 1000:>7.2f} {colunas}")
+            if resultado:
+                os.remove(resultado.arquivo)
+
+        app.encerrar_recursos(aplicacao)
+
+
+if __name__ == '__main__':
+    main()
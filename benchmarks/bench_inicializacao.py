@@ -0,0 +1,93 @@
+"""Tempo de inicialização do app
+
+Cada cenário roda N vezes em um processo Python novo, sobre uma cópia do
+banco, e mostra a mediana. Com --registrar o resultado é anexado a um
+CSV (data, commit, cenário, mediana), para acompanhar a evolução do tempo
+de boot entre versões.
+
+Uso: python benchmarks/bench_inicializacao.py --execucoes 10 --registrar benchmarks/inicializacao.csv
+"""
+import argparse
+import csv
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CENARIOS = {
+    'import': "import app",
+    'criar_app': "import app; app.criar_app()",
+    'criar_app+aquecer': "import app; app.criar_app({'AQUECER': True})",
+    'boot_antigo (init-db + seed)': (
+        "import app; a = app.criar_app()\n"
+        "with a.app_context():\n"
+        "    app.criar_tabelas(); app.criar_admin_padrao(); app.inserir_dados_exemplo()"
+    ),
+}
+
+MEDIDOR = """
+import time, sys
+inicio = time.perf_counter()
+sys.path.insert(0, {raiz!r})
+{codigo}
+print(time.perf_counter() - inicio)
+"""
+
+
+def medir(codigo, execucoes):
+    tempos = []
+    for _ in range(execucoes):
+        pasta = tempfile.mkdtemp(prefix='bench_boot_')
+        shutil.copy(os.path.join(RAIZ, 'biblioteca.db'), pasta)
+        # O app só confere a versão do esquema: a cópia é migrada antes, fora da medição
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrar'], cwd=pasta,
+                       capture_output=True, check=True, env=dict(os.environ, PYTHONPATH=RAIZ))
+        saida = subprocess.run(
+            [sys.executable, '-c', MEDIDOR.format(raiz=RAIZ, codigo=codigo)],
+            cwd=pasta, capture_output=True, text=True, check=True,
+            env=dict(os.environ, BIBLIOTECA_SENHA_CUSTO='12'),
+        )
+        tempos.append(float(saida.stdout.strip().splitlines()[-1]) * 1000)
+        shutil.rmtree(pasta, ignore_errors=True)
+    return statistics.median(tempos)
+
+
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--execucoes', type=int, default=10)
+    parser.add_argument('--registrar', help='arquivo CSV onde anexar os resultados')
+    args = parser.parse_args()
+
+    resultados = []
+    for nome, codigo in CENARIOS.items():
+        mediana = medir(codigo, args.execucoes)
+        resultados.append((nome, mediana))
+        print(f"{nome:30} {mediana:8.1f} ms")
+
+    if args.registrar:
+        novo = not os.path.exists(args.registrar)
+        with open(args.registrar, 'a', newline='') as arquivo:
+            escritor = csv.writer(arquivo)
+            if novo:
+                escritor.writerow(['data', 'commit', 'cenario', 'mediana_ms'])
+            data = datetime.now().isoformat(timespec='seconds')
+            commit = commit_atual()
+            for nome, mediana in resultados:
+                escritor.writerow([data, commit, nome, f"{mediana:.1f}"])
+
+
+if __name__ == '__main__':
+    main()
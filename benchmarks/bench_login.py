@@ -0,0 +1,63 @@
+"""Vazão de login por núcleo para cada fator de custo do scrypt
+
+Mede quantas verificações de senha (o custo dominante do login de admin)
+cabem em um segundo de um núcleo. Depois mede a vazão do pool de
+processos usado pelo app, com todos os núcleos.
+
+Uso: python benchmarks/bench_login.py --custos 12 13 14 15 --duracao 3
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from credenciais import ServicoCredenciais, gerar_hash, verificar_senha  # noqa: E402
+
+
+def medir_nucleo(armazenado, custo, duracao):
+    total = 0
+    fim = time.perf_counter() + duracao
+    while time.perf_counter() < fim:
+        verificar_senha('senha-de-teste', armazenado, custo)
+        total += 1
+    return total / duracao
+
+
+def medir_pool(armazenado, custo, duracao, processos):
+    servico = ServicoCredenciais(custo=custo, processos=processos)
+    servico.verificar('aquecimento', armazenado)
+    total = 0
+    inicio = time.perf_counter()
+    # Várias threads de requisição disputando o mesmo pool, como no app
+    with ThreadPoolExecutor(max_workers=processos * 2) as clientes:
+        while time.perf_counter() - inicio < duracao:
+            lote = [clientes.submit(servico.verificar, 'senha-de-teste', armazenado)
+                    for _ in range(processos * 4)]
+            total += sum(1 for futuro in lote if futuro.result()[0])
+    decorrido = time.perf_counter() - inicio
+    servico.encerrar()
+    return total / decorrido
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--custos', type=int, nargs='+', default=[12, 13, 14, 15, 16])
+    parser.add_argument('--duracao', type=float, default=3)
+    parser.add_argument('--processos', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    print(f"{'custo':>5} {'N':>8} {'ms/login':>9} {'logins/s/núcleo':>16} "
+          f"{'logins/s (' + str(args.processos) + ' proc)':>20}")
+    for custo in args.custos:
+        armazenado = gerar_hash('senha-de-teste', custo)
+        por_nucleo = medir_nucleo(armazenado, custo, args.duracao)
+        pool = medir_pool(armazenado, custo, args.duracao, args.processos)
+        print(f"{custo:>5} {2 ** custo:>8} {1000 / por_nucleo:>9.1f} "
+              f"{por_nucleo:>16.1f} {pool:>20.1f}")
+
+
+if __name__ == '__main__':
+    main()
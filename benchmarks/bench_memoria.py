@@ -0,0 +1,142 @@
+"""Pico de memória das listagens grandes: sqlite3.Row + fetchall x registros + fetchmany
+
+Cria um banco temporário com muitos livros e empréstimos ativos e, para
+cada cenário, roda a listagem em um processo novo. Mostra o pico de RSS
+acima do processo já carregado e o pico de memória alocada pelo Python
+(tracemalloc). O cenário 'antes' reproduz a forma antiga: fetchall() de
+sqlite3.Row e depois o HTML; o 'depois' chama as funções atuais do app.
+
+Uso: python benchmarks/bench_memoria.py --livros 200000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+# Forma antiga: todas as linhas como sqlite3.Row em memória antes de montar o HTML.
+# O código vira o corpo de uma função, por isso o HTML tem 4 espaços a menos.
+ANTES_LIVROS = """
+conn = app.conectar()
+livros = conn.execute(app.consultas.CONSULTAS['livros.listar']).fetchall()
+html = '<table class="table">'
+for livro in livros:
+    status = "✅ Disponível" if livro['quantidade'] > 0 else "❌ Indisponível"
+    status_color = "green" if livro['quantidade'] > 0 else "red"
+    html += f'''
+            <tr>
+                <td>{livro['id']}</td>
+                <td>{livro['titulo']}</td>
+                <td>{livro['autor']}</td>
+                <td>{livro['isbn'] or 'N/A'}</td>
+                <td>{livro['ano'] or 'N/A'}</td>
+                <td>{livro['quantidade']}</td>
+                <td style="color: {status_color}; font-weight: bold;">{status}</td>
+            </tr>
+        '''
+html += "</tbody></table>"
+conn.close()
+"""
+
+ANTES_EMPRESTADOS = """
+conn = app.conectar()
+emprestados = conn.execute(app.consultas.CONSULTAS['emprestimos.ativos']).fetchall()
+html = '<table class="table">'
+for item in emprestados:
+    html += f'''
+        <tr>
+            <td>{item['livro_titulo']}</td>
+            <td>{item['autor']}</td>
+            <td>{item['usuario_nome']}</td>
+            <td>{item['matricula']}</td>
+            <td>{datetime.strptime(item['data_emprestimo'], '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+            <td>{datetime.strptime(item['data_prevista'], '%Y-%m-%d').strftime('%d/%m/%Y')}</td>
+        </tr>
+        '''
+html += "</tbody></table>"
+conn.close()
+"""
+
+CENARIOS = {
+    'livros (antes)': ANTES_LIVROS,
+    'livros (depois)': "html = app.gerar_tabela_livros()",
+    'emprestados (antes)': ANTES_EMPRESTADOS,
+    'emprestados (depois)': "html = app.gerar_tabela_emprestados()",
+    'só linhas: Row + fetchall': """
+linhas = app.conectar().execute(app.consultas.CONSULTAS['livros.listar']).fetchall()
+""",
+    'só linhas: iterar(Livro)': """
+total = sum(1 for _ in app.consultas.iterar(app.conectar().cursor(), 'livros.listar', registro=app.Livro))
+""",
+}
+
+MEDIDOR = """
+import json, resource, sys, tracemalloc
+from datetime import datetime
+sys.path.insert(0, {raiz!r})
+import app
+contexto = app.criar_app({{'DATABASE': {banco!r}, 'CRIAR_TABELAS': False}}).app_context()
+contexto.push()
+base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+tracemalloc.start()
+def cenario():
+{codigo}
+cenario()
+_, pico = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+print(json.dumps({{'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base, 'pico': pico}}))
+"""
+
+
+def popular(banco, livros):
+    """Cria o banco com `livros` títulos e um empréstimo ativo para cada dez livros"""
+    import app
+
+    aplicacao = app.criar_app({'DATABASE': banco, 'CRIAR_TABELAS': True})
+    with aplicacao.app_context():
+        conn = app.conectar()
+        conn.executemany(
+            "INSERT INTO livros (titulo, autor, isbn, ano, quantidade) VALUES (?, ?, ?, ?, ?)",
+            ((f"Livro de teste número {i}", f"Autor {i % 5000}", f"isbn-{i}", 1950 + i % 70, 1 + i % 4)
+             for i in range(livros))
+        )
+        usuarios = max(1, livros // 100)
+        conn.executemany(
+            "INSERT INTO usuarios (nome, matricula, curso) VALUES (?, ?, ?)",
+            ((f"Usuário {i}", f"M{i:08d}", "Curso") for i in range(usuarios))
+        )
+        conn.executemany(
+            "INSERT INTO emprestimos (usuario_id, livro_id, data_emprestimo, data_prevista) VALUES (?, ?, ?, ?)",
+            ((1 + i % usuarios, 1 + i * 10, '2024-05-20', '2024-05-27') for i in range(livros // 10))
+        )
+        conn.commit()
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--livros', type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        banco = os.path.join(pasta, 'bench.db')
+        popular(banco, args.livros)
+        print(f"{args.livros} livros, {args.livros // 10} empréstimos ativos\n")
+        print(f"{'cenário':30} {'pico RSS':>12} {'pico Python':>12}")
+
+        for nome, codigo in CENARIOS.items():
+            saida = subprocess.run(
+                [sys.executable, '-c', MEDIDOR.format(raiz=RAIZ, banco=banco, codigo=textwrap.indent(codigo.strip(), '    '))],
+                cwd=pasta, capture_output=True, text=True, check=True,
+            )
+            resultado = json.loads(saida.stdout.strip().splitlines()[-1])
+            print(f"{nome:30} {resultado['rss_kb'] / 1024:9.1f} MB {resultado['pico'] / 2 ** 20:9.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Cálculo das multas em uma passada no SQLite contra o cálculo linha a linha em Python
+
+Cria um banco temporário com `--emprestimos` empréstimos abertos, uma
+parte deles em atraso, e mede o primeiro cálculo (todas as multas são
+inseridas), o recálculo no mesmo dia (nada muda, nada é gravado) e o
+mesmo trabalho feito em Python, uma linha lida e um UPDATE por empréstimo.
+
+Uso: python benchmarks/bench_multas.py --emprestimos 200000
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app  # noqa: E402
+
+
+def popular(emprestimos):
+    """Usuários dos três tipos e `emprestimos` empréstimos abertos, vencendo nos últimos 60 dias"""
+    conn = app.conectar()
+    tipos = ('aluno', 'professor', 'servidor')
+    conn.executemany(
+        "INSERT INTO usuarios (nome, matricula, tipo) VALUES (?, ?, ?)",
+        ((f"Usuário {i}", f"M{i:07d}", tipos[i % 3]) for i in range(emprestimos // 3 + 1))
+    )
+    conn.execute("INSERT INTO livros (titulo, autor, quantidade) VALUES ('Livro', 'Autor', 0)")
+    hoje = date.today()
+    conn.executemany(
+        "INSERT INTO emprestimos (usuario_id, livro_id, data_emprestimo, data_prevista) VALUES (?, 1, ?, ?)",
+        ((i // 3 + 1, (hoje - timedelta(days=90)).isoformat(), (hoje - timedelta(days=i % 90 - 30)).isoformat())
+         for i in range(emprestimos))
+    )
+    conn.commit()
+    conn.close()
+
+
+def em_lote(regras):
+    agora = datetime.now()
+    return app.fila_escrita().executar(
+        app.operacao_calcular_multas, regras, agora.strftime('%Y-%m-%d'), agora.strftime('%Y-%m-%d %H:%M:%S')
+    )
+
+
+def linha_a_linha(banco, config):
+    """O cálculo como seria em Python: lê cada empréstimo atrasado e grava a sua multa"""
+    conn = sqlite3.connect(banco)
+    hoje = date.today()
+    agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    linhas = conn.execute("""
+        SELECT e.id, e.usuario_id, e.data_prevista, u.tipo FROM emprestimos e
+        JOIN usuarios u ON e.usuario_id = u.id
+        WHERE e.status = 'emprestado' AND e.data_prevista < ?
+    """, (hoje.isoformat(),)).fetchall()
+    gravadas = 0
+    for emprestimo_id, usuario_id, data_prevista, tipo in linhas:
+        regra = config[tipo]
+        dias = (hoje - date.fromisoformat(data_prevista)).days - regra['carencia']
+        if dias <= 0:
+            continue
+        conn.execute("""
+            INSERT OR REPLACE INTO multas (emprestimo_id, usuario_id, dias, valor, atualizado_em)
+            VALUES (?, ?, ?, ?, ?)
+        """, (emprestimo_id, usuario_id, dias, min(dias * regra['valor_dia'], regra['teto']), agora))
+        gravadas += 1
+    conn.commit()
+    conn.close()
+    return gravadas
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--emprestimos', type=int, default=200000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pasta:
+        aplicacao = app.criar_app({'DATABASE': os.path.join(pasta, 'bench.db'), 'CRIAR_TABELAS': True,
+                                   'RESERVAS_EXPIRAR_A_CADA': 0, 'MULTAS_CALCULAR_A_CADA': 0})
+        with aplicacao.app_context():
+            popular(args.emprestimos)
+            banco = app.arquivo_banco()
+            config = aplicacao.config['MULTAS']
+            regras = json.dumps(config)
+
+            cenarios = [
+                ('em lote (primeiro cálculo)', lambda: em_lote(regras)),
+                ('em lote (recálculo)', lambda: em_lote(regras)),
+                ('linha a linha em Python', lambda: linha_a_linha(banco, config)),
+            ]
+            print(f"{args.emprestimos} empréstimos abertos\n")
+            print(f"{'cenário':28} {'gravadas':>9} {'tempo s':>8}")
+            for nome, calcular in cenarios:
+                inicio = time.perf_counter()
+                gravadas = calcular()
+                print(f"{nome:28} {gravadas:>9} {time.perf_counter() - inicio:>8.2f}")
+
+        app.encerrar_recursos(aplicacao)
+
+
+if __name__ == '__main__':
+    main()
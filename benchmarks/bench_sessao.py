@@ -0,0 +1,95 @@
+"""Custo por requisição da sessão: cookie assinado x sessão no servidor
+
+Para cada backend, simula uma requisição de um aluno logado que lê a
+sessão várias vezes (como o HTML_TEMPLATE). Mede o tempo de abrir e
+salvar a sessão e o tamanho do cookie enviado pelo navegador. Roda em
+dois cenários: só leitura e com uma mensagem flash gravada.
+
+Uso: python benchmarks/bench_sessao.py --requisicoes 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask.sessions import SecureCookieSessionInterface  # noqa: E402
+
+from sessoes import ArmazemMemoria, ArmazemSQLite, InterfaceSessaoServidor  # noqa: E402
+
+DADOS_ALUNO = {
+    'tipo_usuario': 'aluno',
+    'nome_usuario': 'Maria Oliveira Lima',
+    'matricula_usuario': '2024002',
+    'usuario_id': 2,
+}
+
+
+def criar_cookie(app, interface):
+    """Faz um 'login' e devolve o valor do cookie de sessão gerado"""
+    app.session_interface = interface
+    with app.test_request_context('/login') as contexto:
+        sessao = interface.open_session(app, contexto.request)
+        for chave, valor in DADOS_ALUNO.items():
+            sessao[chave] = valor
+        sessao['_flashes'] = [('message', 'Bem-vindo, Maria Oliveira Lima!')]
+        resposta = app.response_class()
+        interface.save_session(app, sessao, resposta)
+    return resposta.headers['Set-Cookie'].split(';', 1)[0].split('=', 1)[1]
+
+
+def medir(app, interface, cookie, requisicoes, gravar):
+    """Tempo médio (µs) de sessão por requisição, descontado o contexto vazio"""
+    nome_cookie = app.config['SESSION_COOKIE_NAME']
+    environ = {'HTTP_COOKIE': f'{nome_cookie}={cookie}'}
+
+    inicio = time.perf_counter()
+    for _ in range(requisicoes):
+        with app.test_request_context('/', environ_base=environ) as contexto:
+            contexto.request.cookies.get(nome_cookie)
+    base = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    for _ in range(requisicoes):
+        with app.test_request_context('/', environ_base=environ) as contexto:
+            sessao = interface.open_session(app, contexto.request)
+            # Leituras típicas do template e das rotas
+            sessao.get('tipo_usuario')
+            sessao.get('tipo_usuario')
+            sessao.get('nome_usuario')
+            sessao.get('matricula_usuario')
+            sessao.get('usuario_id')
+            if gravar:
+                sessao['_flashes'] = [('message', 'Empréstimo realizado com sucesso!')]
+            interface.save_session(app, sessao, app.response_class())
+    return (time.perf_counter() - inicio - base) / requisicoes * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requisicoes', type=int, default=20000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.secret_key = 'benchmark'
+    arquivo = os.path.join(tempfile.mkdtemp(prefix='bench_sessao_'), 'sessoes.db')
+
+    backends = [
+        ('cookie', SecureCookieSessionInterface()),
+        ('memoria', InterfaceSessaoServidor(ArmazemMemoria())),
+        ('sqlite', InterfaceSessaoServidor(ArmazemSQLite(arquivo))),
+    ]
+
+    print(f"{'backend':8} {'cookie (bytes)':>15} {'leitura (µs/req)':>17} {'com flash (µs/req)':>19}")
+    for nome, interface in backends:
+        cookie = criar_cookie(app, interface)
+        leitura = medir(app, interface, cookie, args.requisicoes, gravar=False)
+        com_flash = medir(app, interface, cookie, args.requisicoes, gravar=True)
+        print(f"{nome:8} {len(cookie):>15} {leitura:>17.1f} {com_flash:>19.1f}")
+
+
+if __name__ == '__main__':
+    main()
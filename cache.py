@@ -0,0 +1,167 @@
+"""Backends de cache usados pelas páginas do sistema de biblioteca"""
+import json
+import sqlite3
+import threading
+import time
+
+
+class BackendCache:
+    """Interface comum dos backends de cache
+
+    Cada valor pertence a um namespace (ex: 'estatisticas', 'livros').
+    Invalidar um namespace incrementa a sua geração, o que torna todas as
+    chaves antigas inacessíveis sem precisar apagá-las uma a uma.
+    """
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+
+    def obter(self, chave):
+        raise NotImplementedError
+
+    def definir(self, chave, valor, ttl=None):
+        raise NotImplementedError
+
+    def geracao(self, namespace):
+        raise NotImplementedError
+
+    def invalidar(self, *namespaces):
+        raise NotImplementedError
+
+    def chave(self, namespace, chave):
+        """Monta a chave real incluindo a geração atual do namespace"""
+        return f"{namespace}:{self.geracao(namespace)}:{chave}"
+
+    def obter_ou_calcular(self, namespace, chave, calcular, ttl=None):
+        """Retorna o valor em cache ou calcula e armazena se não existir"""
+        chave_real = self.chave(namespace, chave)
+        valor = self.obter(chave_real)
+        if valor is None:
+            valor = calcular()
+            self.definir(chave_real, valor, ttl)
+        return valor
+
+
+class CacheMemoria(BackendCache):
+    """Cache em memória do processo (um por worker)"""
+
+    def __init__(self, ttl=300, limpeza_a_cada=500):
+        super().__init__(ttl)
+        self._valores = {}
+        self._geracoes = {}
+        self._lock = threading.Lock()
+        self._escritas = 0
+        self._limpeza_a_cada = limpeza_a_cada
+
+    def obter(self, chave):
+        item = self._valores.get(chave)
+        if item is None:
+            return None
+        valor, expira_em = item
+        if expira_em < time.time():
+            self._valores.pop(chave, None)
+            return None
+        return valor
+
+    def definir(self, chave, valor, ttl=None):
+        expira_em = time.time() + (ttl or self.ttl)
+        with self._lock:
+            self._valores[chave] = (valor, expira_em)
+            self._escritas += 1
+            if self._escritas % self._limpeza_a_cada == 0:
+                self._remover_expirados()
+
+    def geracao(self, namespace):
+        return self._geracoes.get(namespace, 0)
+
+    def invalidar(self, *namespaces):
+        with self._lock:
+            for namespace in namespaces:
+                self._geracoes[namespace] = self._geracoes.get(namespace, 0) + 1
+
+    def _remover_expirados(self):
+        agora = time.time()
+        for chave in [c for c, (_, expira_em) in self._valores.items() if expira_em < agora]:
+            del self._valores[chave]
+
+
+class CacheSQLite(BackendCache):
+    """Cache compartilhado entre workers através de um arquivo SQLite
+
+    Como as gerações ficam no próprio arquivo, uma invalidação feita por
+    um worker vale imediatamente para todos os outros.
+    """
+
+    def __init__(self, arquivo, ttl=300, limpeza_a_cada=500):
+        super().__init__(ttl)
+        self.arquivo = arquivo
+        self._local = threading.local()
+        self._escritas = 0
+        self._limpeza_a_cada = limpeza_a_cada
+        self._criar_tabelas()
+
+    def _conexao(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.arquivo, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _criar_tabelas(self):
+        conn = self._conexao()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_valores (
+                chave TEXT PRIMARY KEY,
+                valor TEXT NOT NULL,
+                expira_em REAL NOT NULL
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_geracoes (
+                namespace TEXT PRIMARY KEY,
+                geracao INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+
+    def obter(self, chave):
+        linha = self._conexao().execute(
+            "SELECT valor FROM cache_valores WHERE chave = ? AND expira_em >= ?",
+            (chave, time.time())
+        ).fetchone()
+        return json.loads(linha[0]) if linha else None
+
+    def definir(self, chave, valor, ttl=None):
+        conn = self._conexao()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_valores (chave, valor, expira_em) VALUES (?, ?, ?)",
+            (chave, json.dumps(valor), time.time() + (ttl or self.ttl))
+        )
+        self._escritas += 1
+        if self._escritas % self._limpeza_a_cada == 0:
+            conn.execute("DELETE FROM cache_valores WHERE expira_em < ?", (time.time(),))
+
+    def geracao(self, namespace):
+        linha = self._conexao().execute(
+            "SELECT geracao FROM cache_geracoes WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        return linha[0] if linha else 0
+
+    def invalidar(self, *namespaces):
+        conn = self._conexao()
+        conn.executemany("""
+            INSERT INTO cache_geracoes (namespace, geracao) VALUES (?, 1)
+            ON CONFLICT(namespace) DO UPDATE SET geracao = geracao + 1
+        """, [(namespace,) for namespace in namespaces])
+
+
+def criar_backend_cache(config):
+    """Cria o backend de cache conforme a configuração da aplicação"""
+    tipo = config.get('CACHE_BACKEND', 'memoria')
+    ttl = config.get('CACHE_TTL', 300)
+    if tipo == 'memoria':
+        return CacheMemoria(ttl=ttl)
+    if tipo == 'sqlite':
+        return CacheSQLite(config.get('CACHE_ARQUIVO', 'cache.db'), ttl=ttl)
+    raise ValueError(f"Backend de cache desconhecido: {tipo}")
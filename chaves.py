@@ -0,0 +1,27 @@
+"""Chaves de ordenação e busca para textos em português
+
+A chave é o texto sem acentos, em minúsculas (casefold) e com os espaços
+normalizados: "Álvaro", "ÁLVARO" e "alvaro" têm a mesma chave. As chaves
+ficam em colunas próprias (titulo_chave, autor_chave, nome_chave) com
+índices, calculadas em Python ao gravar; assim o ORDER BY e a busca por
+prefixo usam o índice em vez de aplicar uma função à coluna em cada linha.
+"""
+import unicodedata
+
+# Para a busca por prefixo: toda chave que começa com o prefixo é menor que prefixo + FIM
+FIM = '\U0010ffff'
+
+
+def chave_texto(texto):
+    """Chave de ordenação/busca de um texto (None continua None)"""
+    if texto is None:
+        return None
+    decomposto = unicodedata.normalize('NFKD', str(texto))
+    sem_acentos = ''.join(c for c in decomposto if not unicodedata.combining(c))
+    return ' '.join(sem_acentos.casefold().split())
+
+
+def faixa_prefixo(texto):
+    """(início, fim) das chaves que começam com a chave de `texto`, para `>= ? AND < ?`"""
+    prefixo = chave_texto(texto) or ''
+    return prefixo, prefixo + FIM
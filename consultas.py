@@ -0,0 +1,667 @@
+"""Registro central das consultas SQL do sistema de biblioteca
+
+Cada consulta tem um nome e um texto fixo. Como o texto enviado ao SQLite é
+sempre o mesmo, o cache de statements de cada conexão (dimensionado pelo
+tamanho deste registro) reaproveita a compilação entre chamadas. Toda
+execução passa pelos observadores, que por padrão contam chamadas e tempo
+por consulta, para mostrar quais são as mais quentes.
+"""
+import threading
+import time
+
+# Multa de cada empréstimo em atraso, calculada no SQLite para todos de uma vez:
+# dias cobrados = atraso - carência do tipo do usuário, valor = dias * valor_dia até o teto.
+# As regras chegam como um objeto JSON {tipo: {valor_dia, carencia, teto}} (centavos);
+# devolvidos usam a data da devolução. Só grava as linhas cuja multa mudou.
+_CALCULO_MULTAS = """
+    INSERT INTO multas (emprestimo_id, usuario_id, dias, valor, atualizado_em)
+    WITH regras AS (
+        SELECT key as tipo, json_extract(value, '$.valor_dia') as valor_dia,
+               json_extract(value, '$.carencia') as carencia, json_extract(value, '$.teto') as teto
+        FROM json_each(:regras)
+    ),
+    atrasos AS (
+        SELECT e.id, e.usuario_id, r.valor_dia, r.teto,
+               CAST(julianday(COALESCE(e.data_devolucao, :hoje)) - julianday(e.data_prevista) AS INTEGER)
+               - r.carencia as dias
+        FROM emprestimos e
+        JOIN usuarios u ON e.usuario_id = u.id
+        JOIN regras r ON r.tipo = u.tipo
+        WHERE {filtro}
+    )
+    SELECT id, usuario_id, dias, MIN(dias * valor_dia, teto), :agora
+    FROM atrasos
+    WHERE dias > 0
+    ON CONFLICT (emprestimo_id) DO UPDATE
+    SET dias = excluded.dias, valor = excluded.valor, atualizado_em = excluded.atualizado_em
+    WHERE multas.dias != excluded.dias OR multas.valor != excluded.valor
+"""
+
+CONSULTAS = {
+    # Administradores
+    'admin.contar': "SELECT COUNT(*) as total FROM administradores",
+    'admin.por_usuario': "SELECT * FROM administradores WHERE usuario = ?",
+    'admin.inserir': """
+        INSERT INTO administradores (nome, usuario, senha)
+        VALUES (?, ?, ?)
+    """,
+    'admin.atualizar_senha': """
+        UPDATE administradores SET senha = ? WHERE id = ? AND senha = ?
+    """,
+    'admin.senhas_texto_puro': "SELECT id, senha FROM administradores WHERE senha NOT LIKE 'scrypt$%'",
+
+    # Unidades da rede (cadastro sempre no banco principal)
+    'unidades.listar': "SELECT id, nome, sigla FROM unidades ORDER BY id",
+    'unidades.por_id': "SELECT id, nome, sigla FROM unidades WHERE id = ?",
+    'unidades.inserir': "INSERT INTO unidades (nome, sigla) VALUES (?, ?)",
+
+    # Livros
+    'livros.contar': "SELECT COUNT(*) as total FROM livros",
+    'livros.listar': "SELECT id, titulo, autor, isbn, ano, quantidade FROM livros ORDER BY titulo_chave",
+    # Busca por prefixo do título ou do autor: duas faixas nos índices das chaves (chaves.py)
+    'livros.buscar': """
+        SELECT id, titulo, autor, isbn, ano, quantidade
+        FROM livros
+        WHERE (titulo_chave >= ? AND titulo_chave < ?) OR (autor_chave >= ? AND autor_chave < ?)
+        ORDER BY titulo_chave
+    """,
+    'livros.disponiveis': """
+        SELECT id, titulo, autor, isbn, ano, quantidade
+        FROM livros
+        WHERE quantidade > 0
+        ORDER BY titulo_chave
+    """,
+    'livros.disponiveis_na_unidade': """
+        SELECT l.id, l.titulo, l.autor, l.isbn, l.ano, COUNT(*) as quantidade
+        FROM exemplares x
+        JOIN livros l ON x.livro_id = l.id
+        WHERE x.unidade_id = ? AND x.status = 'disponivel'
+        GROUP BY l.id
+        ORDER BY l.titulo_chave
+    """,
+    'livros.inserir': """
+        INSERT INTO livros (titulo, autor, isbn, ano, quantidade, isbn13, titulo_chave, autor_chave)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    'livros.por_isbn13': "SELECT id, titulo FROM livros WHERE isbn13 = ?",
+    'livros.sem_isbn13': """
+        SELECT id, titulo, isbn FROM livros
+        WHERE id > ? AND isbn13 IS NULL AND isbn IS NOT NULL
+        ORDER BY id
+        LIMIT ?
+    """,
+    'livros.definir_isbn13': "UPDATE livros SET isbn13 = ? WHERE id = ?",
+    'livros.retirar_exemplar': """
+        UPDATE livros SET quantidade = quantidade - 1 WHERE id = ? AND quantidade > 0
+    """,
+    'livros.devolver_exemplar': """
+        UPDATE livros SET quantidade = quantidade + 1 WHERE id = ?
+    """,
+    'livros.quantidade': "SELECT quantidade FROM livros WHERE id = ?",
+    'livros.indisponiveis': """
+        SELECT id, titulo, autor, isbn, ano, quantidade
+        FROM livros
+        WHERE quantidade = 0
+        ORDER BY titulo_chave
+    """,
+    'livros.recalcular_quantidades': """
+        UPDATE livros SET quantidade = (
+            SELECT COUNT(*) FROM exemplares x
+            WHERE x.livro_id = livros.id AND x.status = 'disponivel'
+        )
+    """,
+    'livros.quantidades_divergentes': """
+        SELECT l.id, l.titulo, l.quantidade, COUNT(x.id) as total_real
+        FROM livros l
+        LEFT JOIN exemplares x ON x.livro_id = l.id AND x.status = 'disponivel'
+        GROUP BY l.id
+        HAVING l.quantidade != COUNT(x.id)
+    """,
+
+    # Exemplares (cópias físicas, identificadas pelo código de barras)
+    'exemplares.inserir': """
+        INSERT INTO exemplares (livro_id, codigo_barras, status, unidade_id)
+        VALUES (?, ?, ?, ?)
+    """,
+    'exemplares.contar_do_livro': "SELECT COUNT(*) as total FROM exemplares WHERE livro_id = ?",
+    'exemplares.por_codigo': "SELECT id, livro_id, status, unidade_id FROM exemplares WHERE codigo_barras = ?",
+    'exemplares.prefixar_unidade': """
+        UPDATE exemplares SET codigo_barras = unidade_id || '-' || codigo_barras
+        WHERE unidade_id != 1 AND instr(codigo_barras, '-') = 0
+    """,
+    'exemplares.disponivel_do_livro': """
+        SELECT id FROM exemplares WHERE livro_id = ? AND status = 'disponivel' LIMIT 1
+    """,
+    'exemplares.disponivel_na_unidade': """
+        SELECT id FROM exemplares
+        WHERE unidade_id = ? AND livro_id = ? AND status = 'disponivel'
+        LIMIT 1
+    """,
+    'exemplares.emprestar': """
+        UPDATE exemplares SET status = 'emprestado' WHERE id = ? AND status = 'disponivel'
+    """,
+    'exemplares.devolver': "UPDATE exemplares SET status = 'disponivel' WHERE id = ?",
+    'exemplares.reservar': "UPDATE exemplares SET status = 'reservado' WHERE id = ?",
+    'exemplares.emprestar_reservado': """
+        UPDATE exemplares SET status = 'emprestado' WHERE id = ? AND status = 'reservado'
+    """,
+
+    # Reservas (fila por livro, atendida por ordem de chegada)
+    'reservas.inserir': """
+        INSERT INTO reservas (livro_id, usuario_id, criado_em, unidade_id)
+        VALUES (?, ?, ?, ?)
+    """,
+    'reservas.por_id': "SELECT * FROM reservas WHERE id = ?",
+    'reservas.ativa_do_usuario': """
+        SELECT id FROM reservas
+        WHERE usuario_id = ? AND livro_id = ? AND status IN ('aguardando', 'separada')
+    """,
+    'reservas.proxima_do_livro': """
+        SELECT r.id, r.usuario_id, u.nome
+        FROM reservas r
+        JOIN usuarios u ON r.usuario_id = u.id
+        WHERE r.livro_id = ? AND r.status = 'aguardando'
+          AND r.unidade_id = (SELECT unidade_id FROM exemplares WHERE id = ?)
+        ORDER BY r.criado_em, r.id
+        LIMIT 1
+    """,
+    'reservas.separar': """
+        UPDATE reservas SET status = 'separada', exemplar_id = ?, expira_em = ?
+        WHERE id = ?
+    """,
+    'reservas.separada_do_usuario': """
+        SELECT id, exemplar_id FROM reservas
+        WHERE usuario_id = ? AND livro_id = ? AND status = 'separada' AND unidade_id = ?
+    """,
+    'reservas.atender': "UPDATE reservas SET status = 'atendida' WHERE id = ?",
+    'reservas.atender_aguardando': """
+        UPDATE reservas SET status = 'atendida'
+        WHERE usuario_id = ? AND livro_id = ? AND status = 'aguardando'
+    """,
+    'reservas.tem_fila': """
+        SELECT 1 FROM reservas WHERE livro_id = ? AND status = 'aguardando' LIMIT 1
+    """,
+    'reservas.cancelar': "UPDATE reservas SET status = 'cancelada' WHERE id = ?",
+    'reservas.vencidas': """
+        SELECT id, livro_id, exemplar_id FROM reservas
+        WHERE status = 'separada' AND expira_em < ?
+        ORDER BY expira_em
+        LIMIT ?
+    """,
+    'reservas.expirar': "UPDATE reservas SET status = 'expirada' WHERE id = ? AND status = 'separada'",
+    'reservas.do_usuario': """
+        SELECT r.id, r.livro_id, r.status, r.criado_em, r.expira_em, l.titulo, l.autor,
+               (SELECT COUNT(*) FROM reservas f
+                WHERE f.livro_id = r.livro_id AND f.unidade_id = r.unidade_id AND f.status = 'aguardando'
+                  AND (f.criado_em < r.criado_em OR (f.criado_em = r.criado_em AND f.id <= r.id))
+               ) as posicao
+        FROM reservas r
+        JOIN livros l ON r.livro_id = l.id
+        WHERE r.usuario_id = ? AND r.status IN ('aguardando', 'separada')
+        ORDER BY r.criado_em
+    """,
+    'reservas.separadas': """
+        SELECT r.id, r.expira_em, u.nome as usuario_nome, u.matricula, l.titulo, x.codigo_barras
+        FROM reservas r
+        JOIN usuarios u ON r.usuario_id = u.id
+        JOIN livros l ON r.livro_id = l.id
+        JOIN exemplares x ON r.exemplar_id = x.id
+        WHERE r.status = 'separada' AND x.unidade_id = ?
+        ORDER BY r.expira_em
+    """,
+
+    # Usuários
+    'usuarios.contar': "SELECT COUNT(*) as total FROM usuarios",
+    'usuarios.listar': """
+        SELECT id, nome, matricula, curso, tipo, emprestimos_ativos
+        FROM usuarios ORDER BY nome_chave
+    """,
+    'usuarios.da_unidade': """
+        SELECT id, nome, matricula, curso, tipo, emprestimos_ativos
+        FROM usuarios WHERE unidade_id = ? ORDER BY nome_chave
+    """,
+    'usuarios.por_id': """
+        SELECT id, nome, matricula, tipo, emprestimos_ativos
+        FROM usuarios WHERE id = ?
+    """,
+    'usuarios.por_matricula': "SELECT * FROM usuarios WHERE matricula = ?",
+    'usuarios.tipo': "SELECT tipo FROM usuarios WHERE id = ?",
+    'usuarios.inserir': """
+        INSERT INTO usuarios (nome, matricula, curso, tipo, unidade_id, nome_chave)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    'usuarios.reservar_vaga': """
+        UPDATE usuarios SET emprestimos_ativos = emprestimos_ativos + 1
+        WHERE id = ? AND emprestimos_ativos < ?
+    """,
+    'usuarios.ocupar_vaga': "UPDATE usuarios SET emprestimos_ativos = emprestimos_ativos + 1 WHERE id = ?",
+    'usuarios.liberar_vaga': """
+        UPDATE usuarios SET emprestimos_ativos = emprestimos_ativos - 1
+        WHERE id = ? AND emprestimos_ativos > 0
+    """,
+    'usuarios.recalcular_contadores': """
+        UPDATE usuarios SET emprestimos_ativos = (
+            SELECT COUNT(*) FROM emprestimos e
+            WHERE e.usuario_id = usuarios.id AND e.status = 'emprestado'
+        )
+    """,
+    'usuarios.contadores_divergentes': """
+        SELECT u.id, u.nome, u.matricula, u.emprestimos_ativos,
+               COUNT(e.id) as total_real
+        FROM usuarios u
+        LEFT JOIN emprestimos e ON e.usuario_id = u.id AND e.status = 'emprestado'
+        GROUP BY u.id
+        HAVING u.emprestimos_ativos != COUNT(e.id)
+    """,
+
+    # Empréstimos
+    'emprestimos.contar_ativos': "SELECT COUNT(*) as total FROM emprestimos WHERE status = 'emprestado'",
+    'emprestimos.contar_atrasados': """
+        SELECT COUNT(*) as total FROM emprestimos
+        WHERE status = 'emprestado' AND data_prevista < DATE('now')
+    """,
+    'emprestimos.por_id': """
+        SELECT e.*, l.titulo FROM emprestimos e
+        JOIN livros l ON e.livro_id = l.id
+        WHERE e.id = ?
+    """,
+    'emprestimos.do_usuario': """
+        SELECT e.id, e.usuario_id, e.livro_id, e.exemplar_id, e.data_emprestimo, e.data_prevista,
+               e.data_devolucao, e.status, e.renovacoes, l.titulo as livro_titulo, l.autor
+        FROM emprestimos e
+        JOIN livros l ON e.livro_id = l.id
+        WHERE e.usuario_id = ? AND e.status = 'emprestado'
+        UNION ALL
+        SELECT * FROM (
+            SELECT e.id, e.usuario_id, e.livro_id, e.exemplar_id, e.data_emprestimo, e.data_prevista,
+                   e.data_devolucao, e.status, e.renovacoes, l.titulo as livro_titulo, l.autor
+            FROM emprestimos e
+            JOIN livros l ON e.livro_id = l.id
+            WHERE e.usuario_id = ? AND e.status = 'devolvido'
+            ORDER BY e.data_devolucao DESC
+            LIMIT ?
+        )
+    """,
+    'emprestimos.ativos': """
+        SELECT e.id, e.usuario_id, e.livro_id, e.exemplar_id, e.data_emprestimo, e.data_prevista,
+               e.data_devolucao, e.status, e.renovacoes, l.titulo as livro_titulo, l.autor,
+               u.nome as usuario_nome, u.matricula, x.codigo_barras
+        FROM emprestimos e
+        JOIN usuarios u ON e.usuario_id = u.id
+        JOIN livros l ON e.livro_id = l.id
+        LEFT JOIN exemplares x ON e.exemplar_id = x.id
+        WHERE e.status = 'emprestado'
+        ORDER BY e.data_emprestimo DESC
+    """,
+    'emprestimos.ativos_da_unidade': """
+        SELECT e.id, e.usuario_id, e.livro_id, e.exemplar_id, e.data_emprestimo, e.data_prevista,
+               e.data_devolucao, e.status, e.renovacoes, l.titulo as livro_titulo, l.autor,
+               u.nome as usuario_nome, u.matricula, x.codigo_barras
+        FROM emprestimos e
+        JOIN usuarios u ON e.usuario_id = u.id
+        JOIN livros l ON e.livro_id = l.id
+        LEFT JOIN exemplares x ON e.exemplar_id = x.id
+        WHERE e.unidade_id = ? AND e.status = 'emprestado'
+        ORDER BY e.data_emprestimo DESC
+    """,
+    'emprestimos.atrasados': """
+        SELECT e.id, e.usuario_id, e.livro_id, e.exemplar_id, e.data_emprestimo, e.data_prevista,
+               e.data_devolucao, e.status, e.renovacoes, l.titulo as livro_titulo, l.autor,
+               u.nome as usuario_nome, u.matricula, x.codigo_barras, u.curso,
+               julianday('now') - julianday(e.data_prevista) as dias_atraso, m.valor as multa
+        FROM emprestimos e
+        JOIN usuarios u ON e.usuario_id = u.id
+        JOIN livros l ON e.livro_id = l.id
+        LEFT JOIN exemplares x ON e.exemplar_id = x.id
+        LEFT JOIN multas m ON m.emprestimo_id = e.id
+        WHERE e.status = 'emprestado' AND e.data_prevista < DATE('now')
+        ORDER BY dias_atraso DESC
+    """,
+    'emprestimos.inserir': """
+        INSERT INTO emprestimos (usuario_id, livro_id, exemplar_id, data_emprestimo, data_prevista, unidade_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """,
+    'emprestimos.ativos_do_livro': """
+        SELECT id FROM emprestimos WHERE livro_id = ? AND status = 'emprestado' ORDER BY id
+    """,
+    'emprestimos.ativos_para_renovar': """
+        SELECT e.id, e.usuario_id, e.livro_id, e.data_prevista, e.renovacoes, l.titulo
+        FROM emprestimos e
+        JOIN livros l ON e.livro_id = l.id
+        WHERE e.usuario_id = ? AND e.status = 'emprestado'
+    """,
+    'emprestimos.renovar': """
+        UPDATE emprestimos
+        SET data_prevista = ?, renovacoes = renovacoes + 1
+        WHERE id = ? AND status = 'emprestado' AND renovacoes < ?
+    """,
+    'emprestimos.vincular_exemplar': "UPDATE emprestimos SET exemplar_id = ? WHERE id = ?",
+    'emprestimos.marcar_devolvido': """
+        UPDATE emprestimos
+        SET data_devolucao = ?, status = 'devolvido'
+        WHERE id = ?
+    """,
+
+    # Log de circulação (só recebe INSERTs) e snapshots dos contadores
+    'eventos.inserir': """
+        INSERT INTO eventos_circulacao (criado_em, tipo, livro_id, usuario_id, exemplar_id, emprestimo_id,
+                                        unidade_id, quantidade_delta, ativos_delta, dados)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """,
+    'eventos.desde': """
+        SELECT seq, criado_em, tipo, livro_id, usuario_id, exemplar_id, emprestimo_id,
+               unidade_id, quantidade_delta, ativos_delta, dados
+        FROM eventos_circulacao
+        WHERE seq > ?
+        ORDER BY seq
+        LIMIT ?
+    """,
+    'eventos.ultimo_seq': "SELECT COALESCE(MAX(seq), 0) as seq FROM eventos_circulacao",
+    'snapshots.ultimo': "SELECT id, seq, criado_em FROM snapshots_circulacao ORDER BY id DESC LIMIT 1",
+    'snapshots.inserir': "INSERT INTO snapshots_circulacao (seq, criado_em) VALUES (?, ?)",
+    'snapshots.copiar_livros': """
+        INSERT INTO snapshot_livros (snapshot_id, livro_id, quantidade)
+        SELECT ?, id, quantidade FROM livros
+    """,
+    'snapshots.copiar_usuarios': """
+        INSERT INTO snapshot_usuarios (snapshot_id, usuario_id, emprestimos_ativos)
+        SELECT ?, id, emprestimos_ativos FROM usuarios
+    """,
+    'snapshots.antigos': "SELECT id FROM snapshots_circulacao WHERE id <= ?",
+    'snapshots.apagar_livros': "DELETE FROM snapshot_livros WHERE snapshot_id = ?",
+    'snapshots.apagar_usuarios': "DELETE FROM snapshot_usuarios WHERE snapshot_id = ?",
+    'snapshots.apagar': "DELETE FROM snapshots_circulacao WHERE id = ?",
+    # Replay: valor do snapshot + soma das variações registradas depois dele
+    'replay.quantidades_divergentes': """
+        WITH variacoes AS (
+            SELECT livro_id, SUM(quantidade_delta) as total
+            FROM eventos_circulacao
+            WHERE seq > ? AND quantidade_delta != 0
+            GROUP BY livro_id
+        )
+        SELECT l.id, l.titulo, l.quantidade,
+               COALESCE(s.quantidade, 0) + COALESCE(v.total, 0) as total_real
+        FROM livros l
+        LEFT JOIN snapshot_livros s ON s.snapshot_id = ? AND s.livro_id = l.id
+        LEFT JOIN variacoes v ON v.livro_id = l.id
+        WHERE l.quantidade != COALESCE(s.quantidade, 0) + COALESCE(v.total, 0)
+    """,
+    'replay.contadores_divergentes': """
+        WITH variacoes AS (
+            SELECT usuario_id, SUM(ativos_delta) as total
+            FROM eventos_circulacao
+            WHERE seq > ? AND ativos_delta != 0
+            GROUP BY usuario_id
+        )
+        SELECT u.id, u.nome, u.matricula, u.emprestimos_ativos,
+               COALESCE(s.emprestimos_ativos, 0) + COALESCE(v.total, 0) as total_real
+        FROM usuarios u
+        LEFT JOIN snapshot_usuarios s ON s.snapshot_id = ? AND s.usuario_id = u.id
+        LEFT JOIN variacoes v ON v.usuario_id = u.id
+        WHERE u.emprestimos_ativos != COALESCE(s.emprestimos_ativos, 0) + COALESCE(v.total, 0)
+    """,
+    'replay.aplicar_quantidade': "UPDATE livros SET quantidade = ? WHERE id = ?",
+    'replay.aplicar_contador': "UPDATE usuarios SET emprestimos_ativos = ? WHERE id = ?",
+    # A tabela de relatório é uma contagem dos eventos: o replay a refaz pelo log inteiro
+    'replay.circulacao_divergente': """
+        WITH pelo_log AS (
+            SELECT substr(criado_em, 1, 10) as dia, tipo, COUNT(*) as total
+            FROM eventos_circulacao
+            GROUP BY 1, 2
+        )
+        SELECT COUNT(*) as total FROM (
+            SELECT dia, tipo FROM (SELECT dia, tipo, total FROM pelo_log
+                                   EXCEPT SELECT dia, tipo, total FROM relatorio_circulacao)
+            UNION
+            SELECT dia, tipo FROM (SELECT dia, tipo, total FROM relatorio_circulacao
+                                   EXCEPT SELECT dia, tipo, total FROM pelo_log)
+        )
+    """,
+    'replay.limpar_circulacao': "DELETE FROM relatorio_circulacao",
+    'replay.aplicar_circulacao': """
+        INSERT INTO relatorio_circulacao (dia, tipo, total)
+        SELECT substr(criado_em, 1, 10), tipo, COUNT(*)
+        FROM eventos_circulacao
+        GROUP BY 1, 2
+    """,
+
+    # Relatório de circulação (mantido por eventos.registrar)
+    'relatorio.somar_circulacao': """
+        INSERT INTO relatorio_circulacao (dia, tipo, total) VALUES (?, ?, 1)
+        ON CONFLICT (dia, tipo) DO UPDATE SET total = total + 1
+    """,
+    'relatorio.circulacao': """
+        SELECT dia,
+               SUM(CASE WHEN tipo = 'emprestimo' THEN total ELSE 0 END) as emprestimos,
+               SUM(CASE WHEN tipo = 'devolucao' THEN total ELSE 0 END) as devolucoes,
+               SUM(CASE WHEN tipo = 'renovacao' THEN total ELSE 0 END) as renovacoes
+        FROM relatorio_circulacao
+        WHERE dia >= ?
+        GROUP BY dia
+        ORDER BY dia DESC
+    """,
+
+    # Feed de alterações (preenchido pelos gatilhos de alteracoes.py)
+    'alteracoes.desde': """
+        SELECT seq, tabela, registro_id, operacao, criado_em
+        FROM alteracoes
+        WHERE seq > ?
+        ORDER BY seq
+        LIMIT ?
+    """,
+    'alteracoes.limpar': "DELETE FROM alteracoes WHERE seq <= (SELECT MAX(seq) FROM alteracoes) - ?",
+    'alteracoes.primeiro': "SELECT MIN(seq) as primeiro FROM alteracoes",
+    'alteracoes.livro': "SELECT id, titulo, autor, isbn, ano, quantidade FROM livros WHERE id = ?",
+    'alteracoes.usuario': """
+        SELECT id, nome, matricula, curso, tipo, emprestimos_ativos, unidade_id
+        FROM usuarios WHERE id = ?
+    """,
+    'alteracoes.emprestimo': """
+        SELECT id, usuario_id, livro_id, exemplar_id, data_emprestimo, data_prevista,
+               data_devolucao, status, renovacoes, unidade_id
+        FROM emprestimos WHERE id = ?
+    """,
+
+    # Anexos dos livros: só metadados (o conteúdo fica no disco, em anexos.py)
+    'anexos.inserir': """
+        INSERT INTO anexos (livro_id, tipo, sha256, mime, nome, tamanho, criado_em)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """,
+    'anexos.do_livro': "SELECT id, sha256 FROM anexos WHERE livro_id = ? AND tipo = ?",
+    'anexos.apagar': "DELETE FROM anexos WHERE id = ?",
+    'anexos.usos': "SELECT COUNT(*) as total FROM anexos WHERE sha256 = ?",
+    'anexos.por_sha': "SELECT mime, nome FROM anexos WHERE sha256 = ? LIMIT 1",
+    'anexos.listar': "SELECT livro_id, tipo, sha256 FROM anexos ORDER BY livro_id",
+    'livros.existe': "SELECT id FROM livros WHERE id = ?",
+
+    # Preenchimento em lotes das chaves de ordenação/busca (chaves.py)
+    'chaves.livros_pendentes': """
+        SELECT id, titulo, autor FROM livros
+        WHERE id > ? AND (titulo_chave IS NULL OR autor_chave IS NULL)
+        ORDER BY id
+        LIMIT ?
+    """,
+    'chaves.definir_livro': "UPDATE livros SET titulo_chave = ?, autor_chave = ? WHERE id = ?",
+    'chaves.usuarios_pendentes': """
+        SELECT id, nome FROM usuarios
+        WHERE id > ? AND nome_chave IS NULL
+        ORDER BY id
+        LIMIT ?
+    """,
+    'chaves.definir_usuario': "UPDATE usuarios SET nome_chave = ? WHERE id = ?",
+
+    # Multas por atraso: cálculo em uma passada (regras por tipo em JSON) e saldos pelo livro-razão
+    'multas.calcular_abertas': _CALCULO_MULTAS.format(
+        filtro="e.status = 'emprestado' AND e.data_prevista < :hoje"
+    ),
+    'multas.calcular_emprestimo': _CALCULO_MULTAS.format(filtro="e.id = :emprestimo_id"),
+    'multas.do_emprestimo': "SELECT dias, valor FROM multas WHERE emprestimo_id = ?",
+    'multas.do_usuario': """
+        SELECT m.emprestimo_id, m.dias, m.valor, m.atualizado_em, l.titulo, e.data_prevista, e.data_devolucao
+        FROM multas m
+        JOIN emprestimos e ON m.emprestimo_id = e.id
+        JOIN livros l ON e.livro_id = l.id
+        WHERE m.usuario_id = ?
+        ORDER BY m.emprestimo_id DESC
+    """,
+    'multas.saldo_do_usuario': """
+        SELECT (SELECT COALESCE(SUM(valor), 0) FROM multas WHERE usuario_id = :usuario_id)
+             - (SELECT COALESCE(SUM(valor), 0) FROM pagamentos_multa WHERE usuario_id = :usuario_id) as saldo
+    """,
+    'multas.saldos': """
+        SELECT usuario_id, SUM(valor) as saldo FROM (
+            SELECT usuario_id, valor FROM multas
+            UNION ALL
+            SELECT usuario_id, -valor FROM pagamentos_multa
+        )
+        GROUP BY usuario_id
+        HAVING SUM(valor) != 0
+    """,
+    'multas.pagar': "INSERT INTO pagamentos_multa (usuario_id, valor, criado_em) VALUES (?, ?, ?)",
+
+    # Mesclagem de livros duplicados (mesmo ISBN-13): tudo passa para o livro mantido
+    'mesclagem.exemplares': "UPDATE exemplares SET livro_id = ? WHERE livro_id = ?",
+    'mesclagem.emprestimos': "UPDATE emprestimos SET livro_id = ? WHERE livro_id = ?",
+    'mesclagem.cancelar_reservas_repetidas': """
+        UPDATE reservas SET status = 'cancelada'
+        WHERE livro_id = ? AND status = 'aguardando'
+          AND usuario_id IN (
+              SELECT usuario_id FROM reservas
+              WHERE livro_id = ? AND status IN ('aguardando', 'separada')
+          )
+    """,
+    'mesclagem.reservas': "UPDATE reservas SET livro_id = ? WHERE livro_id = ?",
+    'mesclagem.anexos_repetidos': """
+        SELECT id, sha256 FROM anexos
+        WHERE livro_id = ? AND tipo IN (SELECT tipo FROM anexos WHERE livro_id = ?)
+    """,
+    'mesclagem.anexos': "UPDATE anexos SET livro_id = ? WHERE livro_id = ?",
+    'mesclagem.somar_quantidade': """
+        UPDATE livros SET quantidade = quantidade + (SELECT quantidade FROM livros WHERE id = ?)
+        WHERE id = ?
+    """,
+    'mesclagem.apagar_livro': "DELETE FROM livros WHERE id = ?",
+
+    # Exportação dos relatórios em CSV (nomes de coluna viram o cabeçalho)
+    'exportacao.emprestados': """
+        SELECT l.titulo, l.autor, u.nome as usuario, u.matricula,
+               e.data_emprestimo, e.data_prevista
+        FROM emprestimos e
+        JOIN livros l ON e.livro_id = l.id
+        JOIN usuarios u ON e.usuario_id = u.id
+        WHERE e.status = 'emprestado'
+        ORDER BY e.data_emprestimo DESC
+    """,
+    'exportacao.atrasados': """
+        SELECT u.nome as usuario, u.matricula, u.curso, l.titulo, e.data_prevista,
+               CAST(julianday('now') - julianday(e.data_prevista) AS INTEGER) as dias_atraso,
+               printf('%.2f', COALESCE(m.valor, 0) / 100.0) as multa
+        FROM emprestimos e
+        JOIN usuarios u ON e.usuario_id = u.id
+        JOIN livros l ON e.livro_id = l.id
+        LEFT JOIN multas m ON m.emprestimo_id = e.id
+        WHERE e.status = 'emprestado' AND e.data_prevista < DATE('now')
+        ORDER BY dias_atraso DESC
+    """,
+    'exportacao.disponiveis': """
+        SELECT titulo, autor, isbn, ano, quantidade
+        FROM livros
+        WHERE quantidade > 0
+        ORDER BY titulo_chave
+    """,
+}
+
+# Cabe o registro inteiro, com folga para o SQL avulso (migrações, PRAGMA)
+TAMANHO_CACHE = len(CONSULTAS) + 16
+
+# Linhas trazidas do SQLite por vez em iterar()
+TAMANHO_LOTE = 500
+
+
+class Estatisticas:
+    """Chamadas e tempo acumulado de cada consulta no processo"""
+
+    def __init__(self):
+        self._dados = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, nome, duracao):
+        with self._lock:
+            chamadas, total, maximo = self._dados.get(nome, (0, 0.0, 0.0))
+            self._dados[nome] = (chamadas + 1, total + duracao, max(maximo, duracao))
+
+    def mais_quentes(self, limite=None):
+        """Retorna [(nome, chamadas, total, maximo)] do maior tempo total para o menor"""
+        with self._lock:
+            itens = [(nome,) + valores for nome, valores in self._dados.items()]
+        itens.sort(key=lambda item: item[2], reverse=True)
+        return itens[:limite] if limite else itens
+
+    def zerar(self):
+        with self._lock:
+            self._dados.clear()
+
+
+estatisticas = Estatisticas()
+
+# Funções chamadas como observador(nome, duracao) após cada consulta
+observadores = [estatisticas.registrar]
+
+
+def _notificar(nome, duracao):
+    for observador in observadores:
+        observador(nome, duracao)
+
+
+def executar(cursor, nome, parametros=()):
+    """Executa uma consulta do registro e retorna o cursor"""
+    inicio = time.perf_counter()
+    cursor.execute(CONSULTAS[nome], parametros)
+    _notificar(nome, time.perf_counter() - inicio)
+    return cursor
+
+
+def buscar_um(cursor, nome, parametros=()):
+    """Executa uma consulta do registro e retorna a primeira linha"""
+    inicio = time.perf_counter()
+    linha = cursor.execute(CONSULTAS[nome], parametros).fetchone()
+    _notificar(nome, time.perf_counter() - inicio)
+    return linha
+
+
+def buscar_todos(cursor, nome, parametros=()):
+    """Executa uma consulta do registro e retorna todas as linhas"""
+    inicio = time.perf_counter()
+    linhas = cursor.execute(CONSULTAS[nome], parametros).fetchall()
+    _notificar(nome, time.perf_counter() - inicio)
+    return linhas
+
+
+def iterar(cursor, nome, parametros=(), registro=None, lote=TAMANHO_LOTE):
+    """Percorre o resultado de uma consulta em lotes de `lote` linhas
+
+    Com `registro` (uma namedtuple de registros.py) cada linha vira um
+    registro; sem ele, uma tupla simples. Só um lote fica em memória por vez.
+    O tempo registrado nas estatísticas é só o gasto dentro do SQLite.
+    """
+    inicio = time.perf_counter()
+    cursor.execute(CONSULTAS[nome], parametros)
+    colunas = tuple(coluna[0] for coluna in cursor.description)
+    if registro is not None and colunas != registro._fields[:len(colunas)]:
+        raise ValueError(f"Colunas de '{nome}' não batem com os campos de {registro.__name__}: {colunas}")
+
+    fabrica_anterior = cursor.row_factory
+    cursor.row_factory = None if registro is None else lambda _, linha: registro(*linha)
+    duracao = time.perf_counter() - inicio
+    try:
+        while True:
+            inicio = time.perf_counter()
+            linhas = cursor.fetchmany(lote)
+            duracao += time.perf_counter() - inicio
+            if not linhas:
+                break
+            yield from linhas
+    finally:
+        cursor.row_factory = fabrica_anterior
+
+    _notificar(nome, duracao)
@@ -0,0 +1,119 @@
+"""Hash e verificação de senhas dos administradores
+
+As senhas são derivadas com scrypt, com fator de custo configurável
+(N = 2 ** custo). O hash guarda os próprios parâmetros, então mudar o
+custo não invalida as senhas antigas: elas são refeitas no próximo login.
+"""
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import secrets
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+PREFIXO = 'scrypt'
+BLOCO = 8
+PARALELISMO = 1
+TAMANHO_CHAVE = 32
+
+
+def _b64(dados):
+    return base64.b64encode(dados).decode('ascii')
+
+
+def _derivar(senha, sal, custo, bloco, paralelismo, tamanho):
+    n = 2 ** custo
+    return hashlib.scrypt(
+        senha.encode('utf-8'), salt=sal, n=n, r=bloco, p=paralelismo,
+        maxmem=128 * bloco * (n + paralelismo + 2) + 1024 * 1024, dklen=tamanho
+    )
+
+
+def gerar_hash(senha, custo=14):
+    """Gera o hash de uma senha no formato scrypt$custo$r$p$sal$chave"""
+    sal = secrets.token_bytes(16)
+    chave = _derivar(senha, sal, custo, BLOCO, PARALELISMO, TAMANHO_CHAVE)
+    return f"{PREFIXO}${custo}${BLOCO}${PARALELISMO}${_b64(sal)}${_b64(chave)}"
+
+
+def verificar_senha(senha, armazenado, custo=14):
+    """Confere uma senha com o valor armazenado
+
+    Retorna (valida, precisa_rehash). Senhas ainda em texto puro, de
+    versões antigas, são aceitas e marcadas para rehash.
+    """
+    if not armazenado.startswith(PREFIXO + '$'):
+        valida = hmac.compare_digest(senha.encode('utf-8'), armazenado.encode('utf-8'))
+        return valida, valida
+
+    try:
+        _, custo_hash, bloco, paralelismo, sal, chave = armazenado.split('$')
+        custo_hash, bloco, paralelismo = int(custo_hash), int(bloco), int(paralelismo)
+        sal, chave = base64.b64decode(sal), base64.b64decode(chave)
+    except ValueError:
+        return False, False
+
+    calculada = _derivar(senha, sal, custo_hash, bloco, paralelismo, len(chave))
+    valida = hmac.compare_digest(calculada, chave)
+    return valida, valida and custo_hash != custo
+
+
+class ServicoCredenciais:
+    """Executa o hash das senhas fora da thread da requisição
+
+    O scrypt ocupa a CPU de propósito. Rodar em um pool de processos evita
+    que o GIL segure as outras requisições do worker durante o login.
+    Com `processos=0` tudo roda na própria thread (útil em testes).
+    """
+
+    def __init__(self, custo=14, processos=None):
+        self.custo = custo
+        self.processos = processos
+        self._executor = None
+        self._lock = threading.Lock()
+        self._hash_falso = None
+        self._lock_hash_falso = threading.Lock()
+
+    def _executar(self, funcao, *args):
+        if self.processos == 0:
+            return funcao(*args)
+        executor = self._executor
+        if executor is None:
+            # Dois logins simultâneos no primeiro uso não podem criar dois pools
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.processos, mp_context=multiprocessing.get_context('spawn')
+                    )
+                executor = self._executor
+        return executor.submit(funcao, *args).result()
+
+    def gerar(self, senha):
+        """Gera o hash de uma senha com o custo configurado"""
+        return self._executar(gerar_hash, senha, self.custo)
+
+    def verificar(self, senha, armazenado):
+        """Confere a senha; use armazenado=None para usuário inexistente
+
+        Mesmo sem usuário a verificação roda contra um hash falso, para que o
+        tempo de resposta não revele quais usuários existem.
+        """
+        if armazenado is None:
+            self._executar(verificar_senha, senha, self._obter_hash_falso(), self.custo)
+            return False, False
+        return self._executar(verificar_senha, senha, armazenado, self.custo)
+
+    def _obter_hash_falso(self):
+        # Gerado uma vez, também no pool: o scrypt não roda na thread da requisição
+        if self._hash_falso is None:
+            with self._lock_hash_falso:
+                if self._hash_falso is None:
+                    self._hash_falso = self._executar(gerar_hash, secrets.token_hex(8), self.custo)
+        return self._hash_falso
+
+    def encerrar(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
@@ -0,0 +1,156 @@
+"""Fila única de escrita no banco de dados
+
+O SQLite só aceita um escritor por vez. Em vez de cada rota abrir sua
+própria conexão e disputar o lock, as alterações são enviadas para uma
+thread escritora. Ela é dona de uma única conexão e grava em lote todas
+as operações que chegaram juntas, em uma só transação.
+"""
+import os
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
+
+
+class ErroOperacao(Exception):
+    """Erro de regra de negócio, com mensagem para exibir ao usuário"""
+
+
+class EsperaEsgotada(ErroOperacao):
+    """A operação não terminou dentro do timeout da fila"""
+
+
+class FilaEscrita:
+    """Serializa as escritas em uma thread com conexão própria
+
+    Cada operação é uma função `operacao(cursor, *args)` executada dentro
+    de um SAVEPOINT. Se uma operação falhar, só ela é desfeita e as demais
+    do mesmo lote seguem para o COMMIT.
+    """
+
+    def __init__(self, conectar, lote_maximo=64, timeout=30):
+        self._conectar = conectar
+        self.lote_maximo = lote_maximo
+        self.timeout = timeout
+        self._fila = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def executar(self, operacao, *args):
+        """Enfileira uma operação e espera o seu resultado (ou exceção)
+
+        Se o timeout passar antes de a escritora começar a operação, ela é
+        cancelada e não será gravada; se já começou, termina sozinha.
+        """
+        self._garantir_thread()
+        futuro = Future()
+        self._fila.put((operacao, args, futuro))
+        try:
+            return futuro.result(self.timeout)
+        except TimeoutError:
+            if futuro.cancel():
+                raise EsperaEsgotada("O banco está ocupado e a operação não foi feita. Tente novamente.")
+            raise EsperaEsgotada("A operação está demorando e ainda pode ser gravada. "
+                                 "Confira o resultado antes de repetir.")
+
+    def encerrar(self):
+        """Pede para a thread escritora terminar depois das operações pendentes"""
+        if self._thread is not None and self._thread.is_alive():
+            self._fila.put(None)
+            self._thread.join(self.timeout)
+
+    def _garantir_thread(self):
+        # Depois de um fork (gunicorn --preload) a thread do processo pai não existe no filho
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                # Só o fork troca a fila; se a thread morreu, a nova atende as operações que esperavam
+                if self._pid != os.getpid():
+                    self._fila = queue.Queue()
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name='escritor-bd', daemon=True)
+                self._thread.start()
+
+    def _abrir(self):
+        conn = self._conectar()
+        try:
+            conn.isolation_level = None
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        except Exception:
+            conn.close()
+            raise
+        return conn
+
+    def _loop(self):
+        # A conexão é aberta no primeiro lote e reaberta depois de uma falha: sem ela,
+        # cada lote falha na hora com o erro real, em vez de esperar o timeout
+        conn = None
+        while True:
+            item = self._fila.get()
+            if item is None:
+                break
+
+            lote = [item]
+            while len(lote) < self.lote_maximo:
+                try:
+                    proximo = self._fila.get_nowait()
+                except queue.Empty:
+                    break
+                if proximo is None:
+                    self._fila.put(None)
+                    break
+                lote.append(proximo)
+
+            # As operações canceladas por timeout são descartadas sem executar
+            lote = [item for item in lote if item[2].set_running_or_notify_cancel()]
+            if not lote:
+                continue
+            try:
+                if conn is None:
+                    conn = self._abrir()
+                self._processar_lote(conn, lote)
+            except Exception as erro:
+                for _, _, futuro in lote:
+                    if not futuro.done():
+                        futuro.set_exception(erro)
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+                    conn = None
+
+        if conn is not None:
+            conn.close()
+
+    def _processar_lote(self, conn, lote):
+        cursor = conn.cursor()
+        resultados = []
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            for operacao, args, futuro in lote:
+                cursor.execute("SAVEPOINT operacao")
+                try:
+                    resultado = operacao(cursor, *args)
+                except Exception as erro:
+                    cursor.execute("ROLLBACK TO SAVEPOINT operacao")
+                    cursor.execute("RELEASE SAVEPOINT operacao")
+                    resultados.append((futuro, None, erro))
+                else:
+                    cursor.execute("RELEASE SAVEPOINT operacao")
+                    resultados.append((futuro, resultado, None))
+            cursor.execute("COMMIT")
+        except Exception as erro:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            for _, _, futuro in lote:
+                futuro.set_exception(erro)
+            return
+
+        for futuro, resultado, erro in resultados:
+            if erro is not None:
+                futuro.set_exception(erro)
+            else:
+                futuro.set_result(resultado)
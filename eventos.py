@@ -0,0 +1,114 @@
+"""Log de circulação: eventos só acrescentados, snapshots e replay
+
+Cada empréstimo, devolução, renovação, importação de exemplares e
+liberação de exemplar reservado grava um evento na mesma transação da
+alteração. O evento guarda quanto a operação mudou a quantidade
+disponível do livro e o contador de empréstimos do usuário, e soma um na
+tabela de relatório `relatorio_circulacao` (movimentos por dia e tipo).
+Um snapshot copia esses contadores e marca o último `seq` do log; o
+replay soma ao snapshot apenas os eventos posteriores, sem varrer
+empréstimos nem exemplares, e refaz a tabela de relatório pelo log.
+Consumidores externos acompanham o log pelo `seq` crescente.
+"""
+import json
+import time
+from datetime import datetime
+
+import consultas
+
+
+def registrar(cursor, tipo, livro_id=None, usuario_id=None, exemplar_id=None, emprestimo_id=None,
+              unidade_id=None, quantidade_delta=0, ativos_delta=0, **dados):
+    """Acrescenta um evento ao log (use dentro da transação da operação)"""
+    agora = datetime.now()
+    consultas.executar(cursor, 'eventos.inserir', (
+        agora.strftime('%Y-%m-%d %H:%M:%S'), tipo, livro_id, usuario_id, exemplar_id,
+        emprestimo_id, unidade_id, quantidade_delta, ativos_delta,
+        json.dumps(dados, ensure_ascii=False) if dados else None
+    ))
+    consultas.executar(cursor, 'relatorio.somar_circulacao', (agora.strftime('%Y-%m-%d'), tipo))
+
+
+def criar_snapshot(cursor, manter=2):
+    """Copia os contadores atuais e apaga os snapshots mais antigos que os `manter` últimos"""
+    seq = consultas.buscar_um(cursor, 'eventos.ultimo_seq')['seq']
+    criado_em = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    snapshot_id = consultas.executar(cursor, 'snapshots.inserir', (seq, criado_em)).lastrowid
+    consultas.executar(cursor, 'snapshots.copiar_livros', (snapshot_id,))
+    consultas.executar(cursor, 'snapshots.copiar_usuarios', (snapshot_id,))
+
+    for antigo in consultas.buscar_todos(cursor, 'snapshots.antigos', (snapshot_id - manter,)):
+        consultas.executar(cursor, 'snapshots.apagar_livros', (antigo['id'],))
+        consultas.executar(cursor, 'snapshots.apagar_usuarios', (antigo['id'],))
+        consultas.executar(cursor, 'snapshots.apagar', (antigo['id'],))
+    return snapshot_id
+
+
+def divergencias(cursor):
+    """Compara os contadores com o replay do log
+
+    Retorna (livros, usuarios) no mesmo formato das verificações por
+    varredura: a coluna `total_real` traz o valor reconstruído.
+    """
+    snapshot = consultas.buscar_um(cursor, 'snapshots.ultimo')
+    if snapshot is None:
+        return [], []
+    parametros = (snapshot['seq'], snapshot['id'])
+    return (consultas.buscar_todos(cursor, 'replay.quantidades_divergentes', parametros),
+            consultas.buscar_todos(cursor, 'replay.contadores_divergentes', parametros))
+
+
+def circulacao_divergente(cursor):
+    """Quantas linhas de `relatorio_circulacao` diferem da contagem feita pelo log"""
+    return consultas.buscar_um(cursor, 'replay.circulacao_divergente')['total']
+
+
+def reconstruir_circulacao(cursor):
+    """Refaz a tabela de relatório `relatorio_circulacao` a partir do log inteiro"""
+    consultas.executar(cursor, 'replay.limpar_circulacao')
+    consultas.executar(cursor, 'replay.aplicar_circulacao')
+
+
+def reconstruir(cursor):
+    """Aplica o replay aos contadores e à tabela de relatório, na mesma transação
+
+    Retorna quantos valores foram corrigidos.
+    """
+    livros, usuarios = divergencias(cursor)
+    for livro in livros:
+        consultas.executar(cursor, 'replay.aplicar_quantidade', (livro['total_real'], livro['id']))
+    for usuario in usuarios:
+        consultas.executar(cursor, 'replay.aplicar_contador', (usuario['total_real'], usuario['id']))
+    dias = circulacao_divergente(cursor)
+    if dias:
+        reconstruir_circulacao(cursor)
+    return len(livros) + len(usuarios) + dias
+
+
+def ler(cursor, desde=0, limite=500):
+    """Retorna os eventos com `seq` maior que `desde`, em ordem, como dicionários"""
+    eventos = []
+    for linha in consultas.buscar_todos(cursor, 'eventos.desde', (desde, limite)):
+        evento = dict(linha)
+        evento['dados'] = json.loads(evento['dados']) if evento['dados'] else {}
+        eventos.append(evento)
+    return eventos
+
+
+def acompanhar(conectar, desde=0, lote=500, intervalo=1.0, parar=None):
+    """Gera os eventos do log indefinidamente, como um `tail -f`
+
+    `conectar()` abre uma conexão nova a cada consulta; quando não há
+    eventos novos, espera `intervalo` segundos. `parar()` encerra o laço.
+    """
+    while parar is None or not parar():
+        conn = conectar()
+        try:
+            novos = ler(conn.cursor(), desde, lote)
+        finally:
+            conn.close()
+        for evento in novos:
+            desde = evento['seq']
+            yield evento
+        if len(novos) < lote:
+            time.sleep(intervalo)
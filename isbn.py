@@ -0,0 +1,70 @@
+"""Normalização de ISBN para a forma ISBN-13 só com dígitos
+
+O ISBN é digitado de muitas formas (com ou sem hífens, ISBN-10 ou
+ISBN-13) e o leitor de código de barras lê o EAN-13 do livro. Guardando
+todos na mesma forma, "85-359-0277-5", "978-85-359-0277-8" e
+"9788535902778" caem na mesma chave do índice único.
+
+O dígito verificador é conferido: um ISBN com erro de digitação é
+recusado, em vez de virar a chave de outro livro. Só a migração dos
+cadastros antigos usa `reparar`, que recalcula o dígito.
+"""
+import re
+
+SEPARADORES = re.compile(r'[\s\-.]')
+
+
+def digito_isbn13(doze_digitos):
+    """Dígito verificador de um ISBN-13 a partir dos 12 primeiros dígitos"""
+    soma = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(doze_digitos))
+    return str((10 - soma % 10) % 10)
+
+
+def digito_isbn10(nove_digitos):
+    """Dígito verificador de um ISBN-10 a partir dos 9 primeiros dígitos ('X' vale 10)"""
+    soma = sum(int(d) * (10 - i) for i, d in enumerate(nove_digitos))
+    digito = (11 - soma % 11) % 11
+    return 'X' if digito == 10 else str(digito)
+
+
+def _limpar(texto):
+    if not texto:
+        return None
+    limpo = SEPARADORES.sub('', str(texto)).upper()
+    if limpo.startswith('ISBN'):
+        limpo = limpo[4:].lstrip(':')
+    return limpo
+
+
+def reparar(texto):
+    """ISBN-13 com o dígito verificador recalculado, ou None se o texto não tiver a forma de um ISBN
+
+    Só para a migração de cadastros antigos, que têm ISBNs com o dígito errado.
+    """
+    limpo = _limpar(texto)
+    if not limpo:
+        return None
+    if re.fullmatch(r'\d{9}[\dX]', limpo):
+        doze = '978' + limpo[:9]
+        return doze + digito_isbn13(doze)
+    if re.fullmatch(r'97[89]\d{10}', limpo):
+        return limpo[:12] + digito_isbn13(limpo[:12])
+    return None
+
+
+def normalizar(texto):
+    """ISBN-13 só com dígitos, ou None se o texto não for um ISBN válido
+
+    O ISBN-10 ganha o prefixo 978 (e o dígito do ISBN-13). Um dígito
+    verificador que não confere torna o ISBN inválido.
+    """
+    limpo = _limpar(texto)
+    if not limpo:
+        return None
+    if re.fullmatch(r'\d{9}[\dX]', limpo):
+        valido = limpo[9] == digito_isbn10(limpo[:9])
+    elif re.fullmatch(r'97[89]\d{10}', limpo):
+        valido = limpo[12] == digito_isbn13(limpo[:12])
+    else:
+        return None
+    return reparar(limpo) if valido else None
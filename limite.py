@@ -0,0 +1,146 @@
+"""Limitação de tentativas (token bucket) para o login
+
+Cada chave (IP ou conta) tem um balde com `capacidade` fichas. O balde se
+reabastece na razão de capacidade/periodo fichas por segundo e cada
+tentativa consome uma ficha; uma tentativa que deu certo pode devolvê-la,
+para que só as falhas contem. Um balde que ficou cheio de novo não carrega
+mais nenhuma informação e pode ser descartado.
+"""
+import sqlite3
+import threading
+import time
+
+
+class LimitadorMemoria:
+    """Baldes guardados em um dicionário do processo
+
+    Cada chave ocupa só uma tupla (fichas, instante, cheio_em). Os baldes
+    que já se reabasteceram são removidos em varreduras periódicas.
+    """
+
+    def __init__(self, varredura_a_cada=1000):
+        self._baldes = {}
+        self._lock = threading.Lock()
+        self._operacoes = 0
+        self._varredura_a_cada = varredura_a_cada
+
+    def consumir(self, chave, capacidade, periodo):
+        """Consome uma ficha; retorna (permitido, segundos_para_tentar_de_novo)"""
+        taxa = capacidade / periodo
+        agora = time.monotonic()
+        with self._lock:
+            fichas, instante, _ = self._baldes.get(chave, (capacidade, agora, agora))
+            fichas = min(capacidade, fichas + (agora - instante) * taxa)
+            permitido = fichas >= 1
+            if permitido:
+                fichas -= 1
+            self._baldes[chave] = (fichas, agora, agora + (capacidade - fichas) / taxa)
+
+            self._operacoes += 1
+            if self._operacoes % self._varredura_a_cada == 0:
+                self._varrer(agora)
+
+        return permitido, 0 if permitido else (1 - fichas) / taxa
+
+    def devolver(self, chave, capacidade, periodo):
+        """Devolve a ficha consumida por uma tentativa que deu certo"""
+        taxa = capacidade / periodo
+        agora = time.monotonic()
+        with self._lock:
+            if chave not in self._baldes:
+                return
+            fichas, instante, _ = self._baldes[chave]
+            fichas = min(capacidade, fichas + (agora - instante) * taxa + 1)
+            self._baldes[chave] = (fichas, agora, agora + (capacidade - fichas) / taxa)
+
+    def _varrer(self, agora):
+        for chave in [c for c, (_, _, cheio_em) in self._baldes.items() if cheio_em <= agora]:
+            del self._baldes[chave]
+
+
+class LimitadorSQLite:
+    """Baldes em um arquivo SQLite compartilhado por todos os workers"""
+
+    def __init__(self, arquivo, varredura_a_cada=1000):
+        self.arquivo = arquivo
+        self._local = threading.local()
+        self._operacoes = 0
+        self._varredura_a_cada = varredura_a_cada
+        self._conexao().execute("""
+            CREATE TABLE IF NOT EXISTS limites_login (
+                chave TEXT PRIMARY KEY,
+                fichas REAL NOT NULL,
+                instante REAL NOT NULL,
+                cheio_em REAL NOT NULL
+            )
+        """)
+
+    def _conexao(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.arquivo, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def consumir(self, chave, capacidade, periodo):
+        """Consome uma ficha; retorna (permitido, segundos_para_tentar_de_novo)"""
+        taxa = capacidade / periodo
+        agora = time.time()
+        conn = self._conexao()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            linha = conn.execute(
+                "SELECT fichas, instante FROM limites_login WHERE chave = ?", (chave,)
+            ).fetchone()
+            fichas, instante = linha if linha else (capacidade, agora)
+            fichas = min(capacidade, fichas + max(0, agora - instante) * taxa)
+            permitido = fichas >= 1
+            if permitido:
+                fichas -= 1
+            conn.execute("""
+                INSERT OR REPLACE INTO limites_login (chave, fichas, instante, cheio_em)
+                VALUES (?, ?, ?, ?)
+            """, (chave, fichas, agora, agora + (capacidade - fichas) / taxa))
+
+            self._operacoes += 1
+            if self._operacoes % self._varredura_a_cada == 0:
+                conn.execute("DELETE FROM limites_login WHERE cheio_em <= ?", (agora,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        return permitido, 0 if permitido else (1 - fichas) / taxa
+
+    def devolver(self, chave, capacidade, periodo):
+        """Devolve a ficha consumida por uma tentativa que deu certo"""
+        taxa = capacidade / periodo
+        agora = time.time()
+        conn = self._conexao()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            linha = conn.execute(
+                "SELECT fichas, instante FROM limites_login WHERE chave = ?", (chave,)
+            ).fetchone()
+            if linha:
+                fichas = min(capacidade, linha[0] + max(0, agora - linha[1]) * taxa + 1)
+                conn.execute(
+                    "UPDATE limites_login SET fichas = ?, instante = ?, cheio_em = ? WHERE chave = ?",
+                    (fichas, agora, agora + (capacidade - fichas) / taxa, chave)
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def criar_limitador(config):
+    """Cria o armazenamento dos baldes conforme a configuração da aplicação"""
+    tipo = config.get('LIMITE_BACKEND', 'memoria')
+    if tipo == 'memoria':
+        return LimitadorMemoria()
+    if tipo == 'sqlite':
+        return LimitadorSQLite(config.get('LIMITE_ARQUIVO', 'cache.db'))
+    raise ValueError(f"Backend de limitação desconhecido: {tipo}")
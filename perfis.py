@@ -0,0 +1,162 @@
+"""Perfil de uma requisição, gravado em disco para análise posterior
+
+Dois modos:
+
+- 'cprofile': o cProfile da thread da requisição, gravado no formato do
+  pstats (.prof, abre no snakeviz ou vira flame graph com o flameprof) e
+  um resumo em texto (.txt) com as funções de maior tempo acumulado;
+- 'amostras': uma thread lê a pilha da requisição a cada `intervalo`
+  segundos e conta as pilhas no formato "collapsed" (.folded), o que o
+  flamegraph.pl e o speedscope leem diretamente. Custa bem menos que o
+  cProfile e mostra onde o tempo de parede foi gasto (inclusive esperas).
+
+Cada perfil tem um .json com a rota, o modo e a duração, usado na
+listagem. Só um perfil roda por vez no processo: o cProfile não admite
+dois perfis ativos ao mesmo tempo nas versões novas do Python.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+MODOS = ('cprofile', 'amostras')
+
+NOME_VALIDO = re.compile(r'^[0-9]{8}-[0-9]{6}-[0-9]{6}-(cprofile|amostras)\.(prof|txt|folded|json)$')
+
+_em_uso = threading.Lock()
+
+
+class Amostrador:
+    """Conta as pilhas de uma thread, lidas a cada `intervalo` segundos"""
+
+    def __init__(self, thread_id, intervalo=0.002):
+        self.thread_id = thread_id
+        self.intervalo = intervalo
+        self.pilhas = Counter()
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='perfil-amostras', daemon=True)
+
+    def iniciar(self):
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+        self._thread.join()
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo):
+            quadro = sys._current_frames().get(self.thread_id)
+            pilha = []
+            while quadro is not None:
+                codigo = quadro.f_code
+                pilha.append(f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:{codigo.co_firstlineno})")
+                quadro = quadro.f_back
+            if pilha:
+                self.pilhas[';'.join(reversed(pilha))] += 1
+
+    def collapsed(self):
+        """Pilhas no formato do flamegraph.pl: 'a;b;c contagem', uma por linha"""
+        return ''.join(f"{pilha} {contagem}\n" for pilha, contagem in self.pilhas.most_common())
+
+
+class PerfilRequisicao:
+    """Perfil de uma requisição, no modo 'cprofile' ou 'amostras'"""
+
+    def __init__(self, modo, intervalo=0.002):
+        self.modo = modo
+        self.intervalo = intervalo
+        self._perfil = None
+        self._inicio = None
+        self.duracao = None
+
+    @classmethod
+    def iniciar(cls, modo, intervalo=0.002):
+        """Inicia o perfil da thread atual; None se o modo não existe ou outro perfil está rodando"""
+        if modo not in MODOS or not _em_uso.acquire(blocking=False):
+            return None
+        perfil = cls(modo, intervalo)
+        try:
+            if modo == 'cprofile':
+                perfil._perfil = cProfile.Profile()
+                perfil._perfil.enable()
+            else:
+                perfil._perfil = Amostrador(threading.get_ident(), intervalo)
+                perfil._perfil.iniciar()
+        except BaseException:
+            _em_uso.release()
+            raise
+        perfil._inicio = time.perf_counter()
+        return perfil
+
+    def parar(self):
+        """Encerra a coleta (pode ser chamado mais de uma vez)"""
+        if self.duracao is not None:
+            return
+        self.duracao = time.perf_counter() - self._inicio
+        try:
+            if self.modo == 'cprofile':
+                self._perfil.disable()
+            else:
+                self._perfil.parar()
+        finally:
+            _em_uso.release()
+
+    def gravar(self, diretorio, metodo, rota, status=None):
+        """Grava o perfil e os metadados em `diretorio`; retorna o nome base dos arquivos"""
+        self.parar()
+        os.makedirs(diretorio, exist_ok=True)
+        base = f"{datetime.now():%Y%m%d-%H%M%S-%f}-{self.modo}"
+        if self.modo == 'cprofile':
+            self._perfil.dump_stats(os.path.join(diretorio, f"{base}.prof"))
+            resumo = io.StringIO()
+            pstats.Stats(self._perfil, stream=resumo).sort_stats('cumulative').print_stats(40)
+            with open(os.path.join(diretorio, f"{base}.txt"), 'w', encoding='utf-8') as saida:
+                saida.write(resumo.getvalue())
+            arquivos = [f"{base}.prof", f"{base}.txt"]
+            amostras = None
+        else:
+            with open(os.path.join(diretorio, f"{base}.folded"), 'w', encoding='utf-8') as saida:
+                saida.write(self._perfil.collapsed())
+            arquivos = [f"{base}.folded"]
+            amostras = sum(self._perfil.pilhas.values())
+
+        metadados = {'modo': self.modo, 'metodo': metodo, 'rota': rota, 'status': status,
+                     'duracao': self.duracao, 'amostras': amostras, 'arquivos': arquivos,
+                     'criado_em': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+        with open(os.path.join(diretorio, f"{base}.json"), 'w', encoding='utf-8') as saida:
+            json.dump(metadados, saida)
+        return base
+
+
+def listar(diretorio, limite=None):
+    """Metadados dos perfis gravados, do mais recente ao mais antigo (com a chave 'nome')"""
+    if not os.path.isdir(diretorio):
+        return []
+    nomes = sorted((nome for nome in os.listdir(diretorio) if nome.endswith('.json') and NOME_VALIDO.match(nome)),
+                   reverse=True)
+    perfis = []
+    for nome in nomes[:limite]:
+        try:
+            with open(os.path.join(diretorio, nome), encoding='utf-8') as entrada:
+                metadados = json.load(entrada)
+        except (OSError, ValueError):
+            continue
+        metadados['nome'] = nome[:-len('.json')]
+        perfis.append(metadados)
+    return perfis
+
+
+def limpar(diretorio, manter):
+    """Apaga os arquivos dos perfis mais antigos que os `manter` últimos"""
+    for perfil in listar(diretorio)[manter:]:
+        for arquivo in perfil.get('arquivos', []) + [f"{perfil['nome']}.json"]:
+            caminho = os.path.join(diretorio, arquivo)
+            if NOME_VALIDO.match(arquivo) and os.path.exists(caminho):
+                os.remove(caminho)
@@ -0,0 +1,19 @@
+"""Registros compactos para as listagens grandes
+
+Cada registro é uma namedtuple: ocupa só uma tupla por linha, sem o
+objeto sqlite3.Row nem o dicionário de um objeto comum. As consultas que
+os preenchem selecionam as colunas na mesma ordem dos campos; as colunas
+finais que a consulta não traz ficam como None.
+"""
+from collections import namedtuple
+
+Livro = namedtuple('Livro', 'id titulo autor isbn ano quantidade')
+
+Usuario = namedtuple('Usuario', 'id nome matricula curso tipo emprestimos_ativos')
+
+Emprestimo = namedtuple(
+    'Emprestimo',
+    'id usuario_id livro_id exemplar_id data_emprestimo data_prevista data_devolucao status renovacoes '
+    'livro_titulo autor usuario_nome matricula codigo_barras curso dias_atraso multa',
+    defaults=(None,) * 8,
+)
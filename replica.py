@@ -0,0 +1,65 @@
+"""Cópia de leitura do banco para relatórios e listagens
+
+A cópia é feita com a API de backup online do SQLite para um arquivo
+temporário e depois trocada de uma vez (os.replace). Quem já estava lendo
+a cópia anterior continua com ela até fechar a conexão. A cópia fica em
+journal_mode=DELETE e é aberta só para leitura, então os leitores não
+criam arquivos -wal/-shm ao lado dela. Os empréstimos, devoluções e demais
+escritas continuam no banco principal.
+
+A idade da cópia vem do horário de modificação do arquivo, então vários
+workers compartilham a mesma cópia e só um deles precisa atualizá-la a
+cada intervalo.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+
+def caminho_replica(primario, diretorio=None):
+    """Arquivo da cópia de leitura de um banco (no mesmo diretório, se não indicado)"""
+    raiz, extensao = os.path.splitext(os.path.basename(primario))
+    return os.path.join(diretorio or os.path.dirname(os.path.abspath(primario)),
+                        f"{raiz}_leitura{extensao or '.db'}")
+
+
+class CopiaLeitura:
+    """Cópia de um banco SQLite atualizada a cada `intervalo` segundos"""
+
+    def __init__(self, primario, destino, intervalo=60):
+        self.primario = primario
+        self.destino = destino
+        self.intervalo = intervalo
+
+    def atualizado_em(self):
+        """Instante (time.time) da cópia atual, ou None se ela ainda não existe"""
+        try:
+            return os.path.getmtime(self.destino)
+        except OSError:
+            return None
+
+    def atualizar(self, forcar=False):
+        """Refaz a cópia se ela estiver mais velha que o intervalo; retorna se refez"""
+        atualizado_em = self.atualizado_em()
+        if not forcar and atualizado_em is not None and time.time() - atualizado_em < self.intervalo:
+            return False
+
+        temporario = f"{self.destino}.{os.getpid()}.{threading.get_ident()}.tmp"
+        origem = sqlite3.connect(self.primario)
+        copia = sqlite3.connect(temporario)
+        try:
+            origem.backup(copia)
+            copia.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            copia.close()
+            origem.close()
+        os.replace(temporario, self.destino)
+        return True
+
+    def garantir(self):
+        """Garante que a cópia existe e não ficou para trás (ex: tarefa periódica parada)"""
+        atualizado_em = self.atualizado_em()
+        if atualizado_em is None or time.time() - atualizado_em >= 2 * self.intervalo:
+            self.atualizar(forcar=True)
+        return self.destino
@@ -0,0 +1,212 @@
+"""Sessões guardadas no servidor
+
+O cookie leva só um identificador aleatório e curto. Os dados da sessão
+(tipo de usuário, nome, matrícula, mensagens flash) ficam em um
+armazenamento em memória ou em SQLite. Eles só são carregados quando a
+requisição realmente lê a sessão, e só são gravados de volta quando
+mudam.
+"""
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+
+serializador = TaggedJSONSerializer()
+
+
+class SessaoServidor(SessionMixin):
+    """Sessão que busca os dados no armazenamento no primeiro acesso"""
+
+    def __init__(self, sid=None, carregar=None):
+        self.sid = sid
+        self.new = sid is None
+        self.modified = False
+        self.accessed = False
+        self._carregar = carregar
+        self._dados = None if carregar else {}
+
+    @property
+    def dados(self):
+        self.accessed = True
+        if self._dados is None:
+            self._dados = self._carregar() or {}
+            self._carregar = None
+        return self._dados
+
+    def __getitem__(self, chave):
+        return self.dados[chave]
+
+    def __setitem__(self, chave, valor):
+        self.dados[chave] = valor
+        self.modified = True
+
+    def __delitem__(self, chave):
+        del self.dados[chave]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self.dados)
+
+    def __len__(self):
+        return len(self.dados)
+
+    def clear(self):
+        if self._dados is None and self._carregar is not None:
+            self._carregar = None
+        self._dados = {}
+        self.accessed = True
+        self.modified = True
+
+    def regenerar(self):
+        """Troca o identificador mantendo os dados (evita fixação de sessão no login)"""
+        dados = self.dados
+        self.sid_anterior = self.sid
+        self.sid = None
+        self.new = True
+        self._dados = dados
+        self.modified = True
+
+
+class ArmazemMemoria:
+    """Sessões em um dicionário do processo, com expiração por TTL"""
+
+    def __init__(self, limpeza_a_cada=500):
+        self._sessoes = {}
+        self._lock = threading.Lock()
+        self._gravacoes = 0
+        self._limpeza_a_cada = limpeza_a_cada
+
+    def carregar(self, sid):
+        item = self._sessoes.get(sid)
+        if item is None or item[1] < time.time():
+            return None
+        return serializador.loads(item[0])
+
+    def salvar(self, sid, dados, ttl):
+        with self._lock:
+            self._sessoes[sid] = (serializador.dumps(dados), time.time() + ttl)
+            self._gravacoes += 1
+            if self._gravacoes % self._limpeza_a_cada == 0:
+                agora = time.time()
+                for chave in [s for s, (_, expira_em) in self._sessoes.items() if expira_em < agora]:
+                    del self._sessoes[chave]
+
+    def remover(self, sid):
+        self._sessoes.pop(sid, None)
+
+
+class ArmazemSQLite:
+    """Sessões em uma tabela SQLite, compartilhada entre os workers
+
+    As sessões expiradas são apagadas em lote, com um único DELETE a cada
+    `limpeza_a_cada` gravações, e não uma a uma.
+    """
+
+    def __init__(self, arquivo, limpeza_a_cada=500):
+        self.arquivo = arquivo
+        self._local = threading.local()
+        self._gravacoes = 0
+        self._limpeza_a_cada = limpeza_a_cada
+        conn = self._conexao()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessoes (
+                sid TEXT PRIMARY KEY,
+                dados TEXT NOT NULL,
+                expira_em REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessoes_expira_em ON sessoes (expira_em)")
+
+    def _conexao(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.arquivo, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def carregar(self, sid):
+        linha = self._conexao().execute(
+            "SELECT dados FROM sessoes WHERE sid = ? AND expira_em >= ?", (sid, time.time())
+        ).fetchone()
+        return serializador.loads(linha[0]) if linha else None
+
+    def salvar(self, sid, dados, ttl):
+        conn = self._conexao()
+        conn.execute(
+            "INSERT OR REPLACE INTO sessoes (sid, dados, expira_em) VALUES (?, ?, ?)",
+            (sid, serializador.dumps(dados), time.time() + ttl)
+        )
+        self._gravacoes += 1
+        if self._gravacoes % self._limpeza_a_cada == 0:
+            conn.execute("DELETE FROM sessoes WHERE expira_em < ?", (time.time(),))
+
+    def remover(self, sid):
+        self._conexao().execute("DELETE FROM sessoes WHERE sid = ?", (sid,))
+
+
+class InterfaceSessaoServidor(SessionInterface):
+    """Liga o armazenamento de sessões ao Flask"""
+
+    def __init__(self, armazem, ttl=8 * 3600):
+        self.armazem = armazem
+        self.ttl = ttl
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return SessaoServidor()
+        return SessaoServidor(sid, carregar=lambda: self.armazem.carregar(sid))
+
+    def save_session(self, app, session, response):
+        nome = self.get_cookie_name(app)
+        dominio = self.get_cookie_domain(app)
+        caminho = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        sid_anterior = getattr(session, 'sid_anterior', None)
+        if sid_anterior:
+            self.armazem.remover(sid_anterior)
+
+        if not session.modified:
+            return
+
+        if not session:
+            if session.sid:
+                self.armazem.remover(session.sid)
+            if not session.new or sid_anterior:
+                response.delete_cookie(nome, domain=dominio, path=caminho)
+            return
+
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(16)
+        self.armazem.salvar(session.sid, dict(session), self.ttl)
+
+        if session.new:
+            response.set_cookie(
+                nome, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=dominio, path=caminho,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def criar_interface_sessao(config):
+    """Cria a interface de sessão conforme a configuração (None = cookie assinado)"""
+    tipo = config.get('SESSAO_BACKEND', 'cookie')
+    if tipo == 'cookie':
+        return None
+    ttl = config.get('SESSAO_TTL', 8 * 3600)
+    if tipo == 'memoria':
+        return InterfaceSessaoServidor(ArmazemMemoria(), ttl)
+    if tipo == 'sqlite':
+        return InterfaceSessaoServidor(ArmazemSQLite(config.get('SESSAO_ARQUIVO', 'cache.db')), ttl)
+    raise ValueError(f"Backend de sessão desconhecido: {tipo}")
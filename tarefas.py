@@ -0,0 +1,47 @@
+"""Tarefas periódicas do processo (ex: expirar reservas não retiradas)
+
+Cada tarefa roda em uma thread daemon própria, criada no primeiro uso.
+Assim como a fila de escrita, a thread é recriada no processo filho
+depois de um fork. As tarefas devem ser idempotentes: com vários workers,
+cada processo executa a sua cópia.
+"""
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class TarefaPeriodica:
+    """Executa `funcao()` a cada `intervalo` segundos em segundo plano"""
+
+    def __init__(self, funcao, intervalo, nome='tarefa'):
+        self.funcao = funcao
+        self.intervalo = intervalo
+        self.nome = nome
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def garantir(self):
+        """Inicia a thread se ela ainda não estiver rodando neste processo"""
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._loop, name=self.nome, daemon=True)
+                self._thread.start()
+
+    def encerrar(self, timeout=5):
+        self._parar.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._parar.wait(self.intervalo):
+            try:
+                self.funcao()
+            except Exception:
+                logger.exception("Falha na tarefa periódica %s", self.nome)
@@ -0,0 +1,92 @@
+"""Fixtures dos testes: app com banco temporário e dados de exemplo"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import criar_admin_padrao, criar_app, encerrar_recursos, inserir_dados_exemplo  # noqa: E402
+
+
+def configuracao_teste(diretorio, **extra):
+    """Configuração de um app isolado em `diretorio`, sem tarefas em segundo plano"""
+    config = {
+        'TESTING': True,
+        'CRIAR_TABELAS': True,
+        'DATABASE': str(diretorio / 'biblioteca.db'),
+        'CACHE_BACKEND': 'memoria',
+        'CACHE_ARQUIVO': str(diretorio / 'cache.db'),
+        'LIMITE_BACKEND': 'memoria',
+        'LIMITE_ARQUIVO': str(diretorio / 'cache.db'),
+        'SESSAO_BACKEND': 'cookie',
+        'SESSAO_ARQUIVO': str(diretorio / 'cache.db'),
+        'SENHA_CUSTO': 4,
+        'SENHA_PROCESSOS': 0,
+        'RESERVAS_EXPIRAR_A_CADA': 0,
+        'MULTAS_CALCULAR_A_CADA': 0,
+        'BACKUP_A_CADA': 0,
+        'BACKUP_DIRETORIO': str(diretorio / 'backups'),
+        'REPLICA_LEITURA': False,
+        'ANEXOS_DIRETORIO': str(diretorio / 'anexos'),
+        'PERFIS_DIRETORIO': str(diretorio / 'perfis'),
+        'TRACOS_ARQUIVO': None,
+        'ALTERACOES_INTERVALO': 0.01,
+    }
+    config.update(extra)
+    return config
+
+
+@pytest.fixture
+def criar(tmp_path):
+    """Fábrica de apps com dados de exemplo; `criar(**config)` sobrepõe a configuração"""
+    apps = []
+
+    def fabrica(**extra):
+        app = criar_app(configuracao_teste(tmp_path, **extra))
+        with app.app_context():
+            criar_admin_padrao()
+            inserir_dados_exemplo()
+        apps.append(app)
+        return app
+
+    yield fabrica
+    for app in apps:
+        encerrar_recursos(app)
+
+
+@pytest.fixture
+def app(criar):
+    return criar()
+
+
+@pytest.fixture
+def banco(app):
+    """Conexão direta com o banco do app, para conferir o que foi gravado"""
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.row_factory = sqlite3.Row
+    yield conn
+    conn.close()
+
+
+def entrar_admin(cliente):
+    return cliente.post('/login', data={'tipo_usuario': 'admin', 'usuario': 'admin', 'senha': 'admin123'})
+
+
+def entrar_aluno(cliente, matricula='2024001'):
+    return cliente.post('/login', data={'tipo_usuario': 'aluno', 'matricula': matricula})
+
+
+@pytest.fixture
+def admin(app):
+    cliente = app.test_client()
+    entrar_admin(cliente)
+    return cliente
+
+
+@pytest.fixture
+def aluno(app):
+    cliente = app.test_client()
+    entrar_aluno(cliente)
+    return cliente
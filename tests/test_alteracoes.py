@@ -0,0 +1,35 @@
+from test_emprestimos import emprestar
+
+
+def ultimo_seq(cliente):
+    return cliente.get('/alteracoes?limite=1000').get_json()['proximo']
+
+
+def test_feed_exige_admin_ou_token(criar):
+    app = criar(ALTERACOES_TOKEN='segredo')
+    cliente = app.test_client()
+    assert cliente.get('/alteracoes').status_code == 401
+    assert cliente.get('/alteracoes', headers={'Authorization': 'Bearer outro'}).status_code == 401
+    assert cliente.get('/alteracoes', headers={'Authorization': 'Bearer segredo'}).status_code == 200
+
+
+def test_feed_traz_as_alteracoes_depois_do_seq_com_o_estado_atual(app, admin):
+    desde = ultimo_seq(admin)
+    emprestar(app, 4, 3)
+
+    feed = admin.get(f'/alteracoes?desde={desde}').get_json()
+    alteracoes = [(a['tabela'], a['id'], a['operacao']) for a in feed['alteracoes']]
+    assert ('emprestimos', 'insert') in [(t, o) for t, _, o in alteracoes]
+    assert ('livros', 3, 'update') in alteracoes
+    assert ('usuarios', 4, 'update') in alteracoes
+    livro = next(a['registro'] for a in feed['alteracoes'] if a['tabela'] == 'livros')
+    assert livro['quantidade'] == 2
+    assert feed['proximo'] == feed['alteracoes'][-1]['seq'] and feed['primeiro'] <= desde + 1
+
+
+def test_limpeza_avanca_o_primeiro_seq(app, admin):
+    antes = admin.get('/alteracoes').get_json()['primeiro']
+    resultado = app.test_cli_runner().invoke(args=['limpar-alteracoes', '--manter', '1'])
+    assert resultado.exit_code == 0, resultado.output
+    feed = admin.get('/alteracoes').get_json()
+    assert feed['primeiro'] > antes and len(feed['alteracoes']) == 1
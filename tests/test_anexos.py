@@ -0,0 +1,55 @@
+import hashlib
+import io
+
+import pytest
+
+from anexos import ArmazemAnexos, ErroAnexo, detectar_tipo
+
+PDF = b'%PDF-1.4\n' + b'x' * 5000
+
+
+def test_tipo_detectado_pelos_primeiros_bytes():
+    assert detectar_tipo(b'\x89PNG\r\n\x1a\n....') == 'image/png'
+    assert detectar_tipo(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'image/webp'
+    assert detectar_tipo(b'<html>') is None
+
+
+def test_mesmo_conteudo_ocupa_um_endereco(tmp_path):
+    armazem = ArmazemAnexos(str(tmp_path))
+    sha256, mime, tamanho = armazem.guardar(io.BytesIO(PDF), bloco=1024)
+    assert (mime, tamanho) == ('application/pdf', len(PDF))
+    assert armazem.guardar(io.BytesIO(PDF))[0] == sha256
+    assert open(armazem.caminho(sha256), 'rb').read() == PDF
+    assert not list(tmp_path.glob('*.tmp'))
+
+
+@pytest.mark.parametrize('conteudo, erro', [
+    (b'MZ\x90\x00executavel', "não aceito"),
+    (b'', "vazio"),
+    (PDF + b'x' * 2048, "maior que"),
+])
+def test_arquivo_recusado_nao_deixa_resto(tmp_path, conteudo, erro):
+    armazem = ArmazemAnexos(str(tmp_path), tamanho_maximo=len(PDF))
+    with pytest.raises(ErroAnexo, match=erro):
+        armazem.guardar(io.BytesIO(conteudo), bloco=1024)
+    assert not list(tmp_path.rglob('*'))
+
+
+def test_endereco_invalido():
+    with pytest.raises(ErroAnexo):
+        ArmazemAnexos('/tmp').caminho('../../etc/passwd')
+
+
+def test_anexar_servir_e_remover_pelo_app(app, admin):
+    resposta = admin.post('/livros/anexar', data={
+        'livro_id': '1', 'tipo': 'sumario', 'arquivo': (io.BytesIO(PDF), 'sumario.pdf'),
+    }, content_type='multipart/form-data', follow_redirects=True)
+    assert 'anexo enviado com sucesso' in resposta.get_data(as_text=True)
+
+    sha256 = hashlib.sha256(PDF).hexdigest()
+    servido = admin.get(f'/anexos/{sha256}')
+    assert servido.status_code == 200 and servido.data == PDF
+    assert servido.headers['Cache-Control'].startswith('public, max-age=31536000')
+
+    admin.post('/livros/remover_anexo', data={'livro_id': '1', 'tipo': 'sumario'})
+    assert admin.get(f'/anexos/{sha256}').status_code == 404
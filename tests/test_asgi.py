@@ -0,0 +1,90 @@
+import asyncio
+import importlib
+import json
+import sys
+import time
+
+import pytest
+
+from app import criar_app, encerrar_recursos
+
+from conftest import configuracao_teste
+
+
+@pytest.fixture(scope='module')
+def asgi(tmp_path_factory):
+    """O módulo asgi.py, que cria o app padrão ao ser importado (aqui sobre um banco temporário)"""
+    diretorio = tmp_path_factory.mktemp('asgi')
+    criar_app(configuracao_teste(diretorio))
+    with pytest.MonkeyPatch.context() as ambiente:
+        ambiente.setenv('BIBLIOTECA_DB', str(diretorio / 'biblioteca.db'))
+        ambiente.setenv('BIBLIOTECA_RESERVAS_INTERVALO', '0')
+        ambiente.setenv('BIBLIOTECA_MULTAS_INTERVALO', '0')
+        sys.modules.pop('asgi', None)
+        modulo = importlib.import_module('asgi')
+    yield modulo
+    encerrar_recursos(modulo.app)
+
+
+async def chamar(adaptador, metodo, caminho, query=b'', cabecalhos=(), partes=(b'',)):
+    """Faz uma requisição ao adaptador; retorna (status, cabeçalhos, corpo)"""
+    pendentes = [{'type': 'http.request', 'body': parte, 'more_body': i < len(partes) - 1}
+                 for i, parte in enumerate(partes)]
+    enviados = []
+
+    async def receive():
+        return pendentes.pop(0) if pendentes else {'type': 'http.disconnect'}
+
+    async def send(mensagem):
+        enviados.append(mensagem)
+
+    escopo = {'type': 'http', 'method': metodo, 'path': caminho, 'query_string': query,
+              'headers': [(nome.encode(), valor.encode()) for nome, valor in cabecalhos],
+              'client': ('127.0.0.1', 5000), 'server': ('testserver', 80)}
+    await adaptador(escopo, receive, send)
+    inicio, corpo = enviados[0], enviados[1:]
+    assert not corpo[-1].get('more_body')
+    return inicio['status'], dict(inicio['headers']), b''.join(m['body'] for m in corpo)
+
+
+def test_resposta_do_flask_pelo_adaptador(asgi, app):
+    adaptador = asgi.AdaptadorASGI(app, threads=2)
+    status, _, corpo = asyncio.run(chamar(adaptador, 'GET', '/login'))
+    assert status == 200
+    assert 'Login' in corpo.decode()
+
+
+def test_corpo_da_requisicao_chega_em_partes(asgi, app):
+    adaptador = asgi.AdaptadorASGI(app, threads=2)
+    formulario = b'tipo_usuario=admin&usuario=admin&senha=admin123'
+    status, cabecalhos, _ = asyncio.run(chamar(
+        adaptador, 'POST', '/login', partes=(formulario[:10], formulario[10:30], formulario[30:]),
+        cabecalhos=[('content-type', 'application/x-www-form-urlencoded')],
+    ))
+    assert status == 302
+    assert b'session' in cabecalhos[b'set-cookie']
+
+
+def test_long_poll_nao_segura_thread_do_pool(asgi, criar):
+    app = criar(ALTERACOES_TOKEN='segredo')
+    adaptador = asgi.AdaptadorASGI(app, threads=1)
+    autorizacao = [('authorization', 'Bearer segredo')]
+
+    async def cenario():
+        _, _, corpo = await chamar(adaptador, 'GET', '/alteracoes', b'limite=1000', autorizacao)
+        ultimo = json.loads(corpo)['proximo']
+
+        inicio = time.monotonic()
+        espera = asyncio.ensure_future(chamar(
+            adaptador, 'GET', '/alteracoes', f'desde={ultimo}&espera=0.5'.encode(), autorizacao
+        ))
+        await asyncio.sleep(0.05)
+        # Com uma thread só, a página barata é atendida enquanto o long-poll espera
+        status, _, _ = await chamar(adaptador, 'GET', '/login')
+        atendida_em = time.monotonic() - inicio
+        status_feed, _, corpo_feed = await espera
+        return status, atendida_em, status_feed, json.loads(corpo_feed), time.monotonic() - inicio
+
+    status, atendida_em, status_feed, feed, total = asyncio.run(cenario())
+    assert status == 200 and atendida_em < 0.4
+    assert status_feed == 200 and feed['alteracoes'] == [] and total >= 0.5
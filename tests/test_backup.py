@@ -0,0 +1,75 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+import backup
+
+
+@pytest.fixture
+def origem(tmp_path):
+    caminho = str(tmp_path / 'biblioteca.db')
+    conn = sqlite3.connect(caminho)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE livros (titulo TEXT)")
+    conn.executemany("INSERT INTO livros VALUES (?)", [(f"Livro {i}",) for i in range(2000)])
+    conn.commit()
+    conn.close()
+    return caminho
+
+
+def titulos(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        return conn.execute("SELECT count(*) FROM livros").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_backup_em_passos_e_restauracao_do_instante_escolhido(origem, tmp_path):
+    diretorio = str(tmp_path / 'backups')
+    ontem = datetime(2024, 5, 1, 12, 0, 0)
+    resultado = backup.fazer_backup(origem, diretorio, paginas=4, pausa=0, momento=ontem)
+    assert resultado.passos > 1 and resultado.arquivo.endswith('biblioteca-20240501-120000.db.gz')
+
+    conn = sqlite3.connect(origem)
+    conn.execute("DELETE FROM livros")
+    conn.commit()
+    conn.close()
+    backup.fazer_backup(origem, diretorio, pausa=0, momento=ontem + timedelta(days=1))
+
+    assert [momento for momento, _ in backup.listar(diretorio, origem)] == [ontem, ontem + timedelta(days=1)]
+    backup.restaurar(backup.escolher(diretorio, origem, ate=ontem + timedelta(hours=1)), origem)
+    assert titulos(origem) == 2000
+    backup.restaurar(backup.escolher(diretorio, origem), origem)
+    assert titulos(origem) == 0
+
+
+def test_escolher_sem_backup_ate_o_instante(origem, tmp_path):
+    diretorio = str(tmp_path / 'backups')
+    backup.fazer_backup(origem, diretorio, pausa=0, momento=datetime(2024, 5, 1))
+    with pytest.raises(backup.ErroBackup, match="Nenhum backup"):
+        backup.escolher(diretorio, origem, ate=datetime(2024, 4, 30))
+
+
+def test_limpar_mantem_os_ultimos(origem, tmp_path):
+    diretorio = str(tmp_path / 'backups')
+    for dia in range(1, 5):
+        backup.fazer_backup(origem, diretorio, pausa=0, momento=datetime(2024, 5, dia))
+    apagados = backup.limpar(diretorio, origem, manter=2)
+    assert len(apagados) == 2
+    assert [m.day for m, _ in backup.listar(diretorio, origem)] == [3, 4]
+
+
+def test_restaurar_recusa_backup_corrompido(origem, tmp_path):
+    corrompido = tmp_path / 'biblioteca-20240501-000000.db.gz'
+    corrompido.write_bytes(b'nao e gzip')
+    with pytest.raises(backup.ErroBackup, match="corrompido"):
+        backup.restaurar(str(corrompido), origem)
+    assert titulos(origem) == 2000
+
+
+def test_comando_backup_do_app(app):
+    resultado = app.test_cli_runner().invoke(args=['backup'])
+    assert resultado.exit_code == 0, resultado.output
+    assert len(backup.listar(app.config['BACKUP_DIRETORIO'], app.config['DATABASE'])) == 1
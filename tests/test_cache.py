@@ -0,0 +1,44 @@
+from cache import CacheMemoria, CacheSQLite
+
+
+def test_obter_ou_calcular_so_calcula_uma_vez():
+    cache = CacheMemoria()
+    chamadas = []
+
+    def calcular():
+        chamadas.append(1)
+        return {'total': 3}
+
+    assert cache.obter_ou_calcular('estatisticas', 'hoje', calcular) == {'total': 3}
+    assert cache.obter_ou_calcular('estatisticas', 'hoje', calcular) == {'total': 3}
+    assert len(chamadas) == 1
+
+
+def test_invalidar_descarta_so_o_namespace():
+    cache = CacheMemoria()
+    cache.obter_ou_calcular('livros', 'tabela', lambda: 'antiga')
+    cache.obter_ou_calcular('relatorios', 'disponiveis', lambda: 'mantida')
+
+    cache.invalidar('livros')
+
+    assert cache.obter_ou_calcular('livros', 'tabela', lambda: 'nova') == 'nova'
+    assert cache.obter_ou_calcular('relatorios', 'disponiveis', lambda: 'outra') == 'mantida'
+
+
+def test_cache_sqlite_e_compartilhado_entre_workers(tmp_path):
+    arquivo = str(tmp_path / 'cache.db')
+    worker_1, worker_2 = CacheSQLite(arquivo), CacheSQLite(arquivo)
+
+    worker_1.obter_ou_calcular('estatisticas', 'hoje', lambda: {'total': 1})
+    assert worker_2.obter_ou_calcular('estatisticas', 'hoje', lambda: {'total': 2}) == {'total': 1}
+
+    # A invalidação feita em um worker vale para o outro
+    worker_2.invalidar('estatisticas')
+    assert worker_1.obter_ou_calcular('estatisticas', 'hoje', lambda: {'total': 3}) == {'total': 3}
+
+
+def test_emprestimo_invalida_as_estatisticas_da_pagina_inicial(admin):
+    # 6 livros, 5 usuários e 3 empréstimos nos dados de exemplo
+    assert '<div class="stat-number">4</div>' not in admin.get('/').get_data(as_text=True)
+    admin.post('/realizar_emprestimo', data={'usuario_id': 4, 'livro_id': 3})
+    assert '<div class="stat-number">4</div>' in admin.get('/').get_data(as_text=True)
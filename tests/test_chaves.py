@@ -0,0 +1,33 @@
+from chaves import FIM, chave_texto, faixa_prefixo
+
+
+def test_chave_ignora_acentos_caixa_e_espacos():
+    assert chave_texto("ÁLVARO  Souza ") == chave_texto("alvaro souza") == "alvaro souza"
+    assert chave_texto("Capitães da Areia") == "capitaes da areia"
+    assert chave_texto(None) is None
+
+
+def test_faixa_do_prefixo():
+    inicio, fim = faixa_prefixo("Capi")
+    assert (inicio, fim) == ("capi", "capi" + FIM)
+    assert inicio <= chave_texto("Capitães da Areia") < fim
+    assert not inicio <= chave_texto("Cortiço") < fim
+
+
+def test_listagem_ordenada_e_busca_por_prefixo_sem_acento(app, admin):
+    pagina = admin.get('/livros').get_data(as_text=True)
+    assert pagina.index('Capitães da Areia') < pagina.index('Dom Casmurro') < pagina.index('O Cortiço')
+
+    busca = admin.get('/livros?busca=CAPITAES').get_data(as_text=True)
+    assert 'Capitães da Areia' in busca and 'Dom Casmurro' not in busca
+    assert 'Dom Casmurro' in admin.get('/livros?busca=machado').get_data(as_text=True)
+
+
+def test_preencher_chaves_dos_cadastros_antigos(app, banco):
+    banco.execute("UPDATE livros SET titulo_chave = NULL, autor_chave = NULL")
+    banco.execute("UPDATE usuarios SET nome_chave = NULL")
+    banco.commit()
+    resultado = app.test_cli_runner().invoke(args=['preencher-chaves', '--lote', '2'])
+    assert resultado.exit_code == 0, resultado.output
+    assert banco.execute("SELECT titulo_chave FROM livros WHERE titulo = 'O Cortiço'").fetchone()[0] == 'o cortico'
+    assert banco.execute("SELECT count(*) FROM usuarios WHERE nome_chave IS NULL").fetchone()[0] == 0
@@ -0,0 +1,38 @@
+import pytest
+
+import consultas
+from app import parametros_nulos
+from registros import Emprestimo, Livro, Usuario
+
+
+@pytest.mark.parametrize('nome', sorted(consultas.CONSULTAS))
+def test_consulta_do_registro_compila_no_esquema_atual(banco, nome):
+    sql = consultas.CONSULTAS[nome]
+    banco.execute(f"EXPLAIN QUERY PLAN {sql}", parametros_nulos(sql)).fetchall()
+
+
+def chamadas(nome):
+    return {item[0]: item[1] for item in consultas.estatisticas.mais_quentes()}.get(nome, 0)
+
+
+def test_execucoes_sao_contadas_por_nome(banco):
+    antes = chamadas('livros.contar')
+    consultas.buscar_um(banco.cursor(), 'livros.contar')
+    assert chamadas('livros.contar') == antes + 1
+
+
+def test_iterar_preenche_os_registros_compactos(banco):
+    livros = list(consultas.iterar(banco.cursor(), 'livros.disponiveis', registro=Livro, lote=2))
+    assert all(isinstance(livro, Livro) for livro in livros)
+    assert {livro.titulo for livro in livros} >= {'O Cortiço', 'Capitães da Areia'}
+
+
+def test_iterar_recusa_registro_com_outras_colunas(banco):
+    with pytest.raises(ValueError, match="não batem"):
+        list(consultas.iterar(banco.cursor(), 'livros.disponiveis', registro=Usuario))
+
+
+def test_registro_de_emprestimo_completa_as_colunas_que_faltam():
+    emprestimo = Emprestimo(1, 2, 3, 4, '2024-05-20', '2024-05-27', None, 'emprestado', 0)
+    assert emprestimo.livro_titulo is None and emprestimo.multa is None
+    assert isinstance(emprestimo, tuple) and not hasattr(emprestimo, '__dict__')
@@ -0,0 +1,147 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import (fila_escrita, operacao_criar_unidade, operacao_devolver_livro, operacao_realizar_emprestimo,
+                 operacao_renovar_emprestimo, operacao_reservar)
+from escrita import ErroOperacao
+
+LIMITES = {'aluno': 3, 'professor': 10, 'servidor': 5}
+
+
+def executar(app, operacao, *args):
+    with app.app_context():
+        return fila_escrita().executar(operacao, *args)
+
+
+def emprestar(app, usuario_id, livro_id=None, codigo=None, unidade_id=1):
+    return executar(app, operacao_realizar_emprestimo, usuario_id, livro_id, LIMITES, codigo, 7, unidade_id)
+
+
+def ultimo_emprestimo(banco, usuario_id):
+    return banco.execute("SELECT * FROM emprestimos WHERE usuario_id = ? ORDER BY id DESC LIMIT 1",
+                         (usuario_id,)).fetchone()
+
+
+def test_contador_de_emprestimos_ativos_acompanha_emprestimo_e_devolucao(app, banco):
+    emprestar(app, 4, 3)
+    assert banco.execute("SELECT emprestimos_ativos FROM usuarios WHERE id = 4").fetchone()[0] == 1
+
+    executar(app, operacao_devolver_livro, ultimo_emprestimo(banco, 4)['id'])
+    assert banco.execute("SELECT emprestimos_ativos FROM usuarios WHERE id = 4").fetchone()[0] == 0
+
+
+def test_limite_de_emprestimos_pelo_tipo_do_usuario(app, banco):
+    for livro_id in (1, 2, 3):
+        emprestar(app, 4, livro_id)
+    with pytest.raises(ErroOperacao, match="limite máximo"):
+        emprestar(app, 4, 6)
+    assert banco.execute("SELECT emprestimos_ativos FROM usuarios WHERE id = 4").fetchone()[0] == 3
+
+
+def test_emprestimo_pelo_codigo_de_barras_empresta_aquela_copia(app, banco):
+    emprestar(app, 4, codigo='0000030002')
+    exemplar = banco.execute("SELECT * FROM exemplares WHERE codigo_barras = '0000030002'").fetchone()
+    assert exemplar['status'] == 'emprestado'
+    assert ultimo_emprestimo(banco, 4)['exemplar_id'] == exemplar['id']
+
+    with pytest.raises(ErroOperacao, match="já está emprestado"):
+        emprestar(app, 5, codigo='0000030002')
+
+
+def test_emprestimo_pelo_isbn_lido_da_contracapa(app, banco):
+    emprestar(app, 4, codigo='978-85-254-0024-6')
+    assert ultimo_emprestimo(banco, 4)['livro_id'] == 3
+
+
+def test_devolucao_separa_o_exemplar_para_o_primeiro_da_fila(app, banco):
+    # O único exemplar de O Cortiço (livro 2) sai; Leticia e depois Carlos entram na fila
+    emprestar(app, 1, 2)
+    executar(app, operacao_reservar, 4, 2, 1)
+    executar(app, operacao_reservar, 5, 2, 1)
+
+    mensagem = executar(app, operacao_devolver_livro, ultimo_emprestimo(banco, 1)['id'])
+
+    assert 'Leticia Rodrigues' in mensagem
+    reservas = banco.execute("SELECT usuario_id, status FROM reservas ORDER BY id").fetchall()
+    assert [tuple(r) for r in reservas] == [(4, 'separada'), (5, 'aguardando')]
+    with pytest.raises(ErroOperacao, match="reserva de outro usuário"):
+        emprestar(app, 5, codigo='0000020001')
+    emprestar(app, 4, 2)
+    assert banco.execute("SELECT status FROM reservas WHERE usuario_id = 4").fetchone()[0] == 'atendida'
+
+
+def test_reserva_recusada_com_exemplar_na_estante(app):
+    with pytest.raises(ErroOperacao, match="exemplares disponíveis"):
+        executar(app, operacao_reservar, 4, 3, 1)
+
+
+def vencer_hoje(banco, emprestimo_id):
+    # Renovar só adia o prazo se a nova data passar da atual
+    banco.execute("UPDATE emprestimos SET data_prevista = ? WHERE id = ?",
+                  (datetime.now().strftime('%Y-%m-%d'), emprestimo_id))
+    banco.commit()
+
+
+def test_renovacao_adia_o_prazo_ate_o_limite(app, banco):
+    emprestar(app, 4, 3)
+    emprestimo_id = ultimo_emprestimo(banco, 4)['id']
+    vencer_hoje(banco, emprestimo_id)
+
+    executar(app, operacao_renovar_emprestimo, emprestimo_id, None, 7, 1)
+    esperado = (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d')
+    assert ultimo_emprestimo(banco, 4)['data_prevista'] == esperado
+    assert ultimo_emprestimo(banco, 4)['renovacoes'] == 1
+
+    vencer_hoje(banco, emprestimo_id)
+    with pytest.raises(ErroOperacao, match="limite máximo"):
+        executar(app, operacao_renovar_emprestimo, emprestimo_id, None, 7, 1)
+
+
+def test_renovacao_recusada_com_fila_de_reservas(app, banco):
+    emprestar(app, 1, 2)
+    executar(app, operacao_reservar, 4, 2, 1)
+    vencer_hoje(banco, ultimo_emprestimo(banco, 1)['id'])
+    with pytest.raises(ErroOperacao, match="reservas na fila"):
+        executar(app, operacao_renovar_emprestimo, ultimo_emprestimo(banco, 1)['id'], 1, 7, 2)
+
+
+def test_renovacao_recusada_em_atraso(app):
+    # Os empréstimos de exemplo venceram em 2024
+    with pytest.raises(ErroOperacao, match="em atraso"):
+        executar(app, operacao_renovar_emprestimo, 1, None, 7, 2)
+
+
+@pytest.fixture
+def duas_unidades(app, banco):
+    """O Cortiço (livro 2) com um exemplar emprestado em cada unidade"""
+    executar(app, operacao_criar_unidade, 'Campus Norte', 'CN')
+    banco.execute("INSERT INTO exemplares (livro_id, codigo_barras, status, unidade_id) "
+                  "VALUES (2, '2-0000020002', 'disponivel', 2)")
+    banco.execute("UPDATE livros SET quantidade = 2 WHERE id = 2")
+    banco.commit()
+    emprestar(app, 1, 2, unidade_id=1)
+    emprestar(app, 2, 2, unidade_id=2)
+    return banco
+
+
+def test_emprestimo_usa_so_exemplares_da_unidade(app, duas_unidades):
+    with pytest.raises(ErroOperacao, match="outra unidade"):
+        emprestar(app, 4, codigo='2-0000020002', unidade_id=1)
+
+
+def test_reserva_so_recebe_exemplar_da_unidade_de_retirada(app, duas_unidades):
+    banco = duas_unidades
+    executar(app, operacao_reservar, 4, 2, 1)
+
+    # O exemplar da unidade 2 volta para a estante de lá, não para a reserva da unidade 1
+    executar(app, operacao_devolver_livro, ultimo_emprestimo(banco, 2)['id'])
+    assert banco.execute("SELECT status FROM reservas WHERE usuario_id = 4").fetchone()[0] == 'aguardando'
+
+    executar(app, operacao_devolver_livro, ultimo_emprestimo(banco, 1)['id'])
+    assert banco.execute("SELECT status FROM reservas WHERE usuario_id = 4").fetchone()[0] == 'separada'
+
+    # Na unidade 2 a reserva não vale: o empréstimo leva o exemplar de lá
+    emprestar(app, 4, 2, unidade_id=2)
+    assert ultimo_emprestimo(banco, 4)['unidade_id'] == 2
+    assert banco.execute("SELECT status FROM reservas WHERE usuario_id = 4").fetchone()[0] == 'separada'
@@ -0,0 +1,68 @@
+import sqlite3
+import threading
+
+import pytest
+
+from escrita import ErroOperacao, FilaEscrita
+
+
+@pytest.fixture
+def caminho(tmp_path):
+    caminho = str(tmp_path / 'fila.db')
+    conn = sqlite3.connect(caminho)
+    conn.execute("CREATE TABLE itens (valor INTEGER)")
+    conn.close()
+    return caminho
+
+
+def inserir(cursor, valor):
+    cursor.execute("INSERT INTO itens VALUES (?)", (valor,))
+    if valor < 0:
+        raise ErroOperacao("valor negativo")
+    return valor
+
+
+def valores(caminho):
+    conn = sqlite3.connect(caminho)
+    try:
+        return sorted(linha[0] for linha in conn.execute("SELECT valor FROM itens"))
+    finally:
+        conn.close()
+
+
+def test_operacao_que_falha_e_desfeita_sem_afetar_o_lote(caminho):
+    fila = FilaEscrita(lambda: sqlite3.connect(caminho, check_same_thread=False), timeout=5)
+    erros = []
+
+    def enviar(valor):
+        try:
+            fila.executar(inserir, valor)
+        except ErroOperacao as e:
+            erros.append(str(e))
+
+    threads = [threading.Thread(target=enviar, args=(valor,)) for valor in (1, -1, 2, 3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    fila.encerrar()
+
+    assert valores(caminho) == [1, 2, 3]
+    assert erros == ["valor negativo"]
+
+
+def test_falha_ao_conectar_chega_a_quem_esperava_e_a_fila_reconecta(caminho):
+    tentativas = []
+
+    def conectar():
+        tentativas.append(1)
+        if len(tentativas) == 1:
+            raise sqlite3.OperationalError("unable to open database file")
+        return sqlite3.connect(caminho, check_same_thread=False)
+
+    fila = FilaEscrita(conectar, timeout=5)
+    with pytest.raises(sqlite3.OperationalError, match="unable to open"):
+        fila.executar(inserir, 1)
+    assert fila.executar(inserir, 2) == 2
+    fila.encerrar()
+    assert valores(caminho) == [2]
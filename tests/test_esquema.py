@@ -0,0 +1,38 @@
+import sqlite3
+
+import pytest
+
+from app import VERSAO_ESQUEMA, EsquemaDesatualizado, criar_app, versao_esquema
+
+from conftest import configuracao_teste
+
+
+def test_app_nao_sobe_sem_esquema_e_nao_cria_o_arquivo(tmp_path):
+    config = configuracao_teste(tmp_path, CRIAR_TABELAS=False)
+    with pytest.raises(EsquemaDesatualizado, match="inexistente"):
+        criar_app(config)
+    assert not (tmp_path / 'biblioteca.db').exists()
+
+
+def test_criar_tabelas_grava_a_versao_e_o_app_sobe_depois(tmp_path):
+    criar_app(configuracao_teste(tmp_path))
+    assert versao_esquema(str(tmp_path / 'biblioteca.db')) == VERSAO_ESQUEMA
+    criar_app(configuracao_teste(tmp_path, CRIAR_TABELAS=False))
+
+
+def test_app_nao_sobe_sobre_esquema_antigo(tmp_path):
+    criar_app(configuracao_teste(tmp_path))
+    conn = sqlite3.connect(str(tmp_path / 'biblioteca.db'))
+    conn.execute(f"PRAGMA user_version = {VERSAO_ESQUEMA - 1}")
+    conn.close()
+    with pytest.raises(EsquemaDesatualizado, match=f"na versão {VERSAO_ESQUEMA - 1}"):
+        criar_app(configuracao_teste(tmp_path, CRIAR_TABELAS=False))
+
+
+def test_comando_migrar_atualiza_o_esquema(app, tmp_path):
+    conn = sqlite3.connect(app.config['DATABASE'])
+    conn.execute("PRAGMA user_version = 0")
+    conn.close()
+    resultado = app.test_cli_runner().invoke(args=['migrar'])
+    assert f"versão {VERSAO_ESQUEMA}" in resultado.output
+    assert versao_esquema(app.config['DATABASE']) == VERSAO_ESQUEMA
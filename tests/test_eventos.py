@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import eventos
+from app import fila_escrita, operacao_reconstruir_contadores
+
+from test_emprestimos import emprestar
+
+
+def emprestimos_de_hoje(banco):
+    hoje = datetime.now().strftime('%Y-%m-%d')
+    linha = banco.execute("SELECT total FROM relatorio_circulacao WHERE dia = ? AND tipo = 'emprestimo'",
+                          (hoje,)).fetchone()
+    return linha[0] if linha else 0
+
+
+def test_emprestimo_grava_evento_e_relatorio_na_mesma_transacao(app, banco):
+    antes = emprestimos_de_hoje(banco)
+    emprestar(app, 4, 3)
+    evento = eventos.ler(banco.cursor(), desde=0)[-1]
+    assert (evento['tipo'], evento['livro_id'], evento['usuario_id']) == ('emprestimo', 3, 4)
+    assert (evento['quantidade_delta'], evento['ativos_delta']) == (-1, 1)
+    assert emprestimos_de_hoje(banco) == antes + 1
+
+
+def test_replay_reconstroi_contadores_e_relatorio_pelo_log(app, banco):
+    eventos.criar_snapshot(banco.cursor())
+    banco.commit()
+    emprestar(app, 4, 3)
+    relatorio = banco.execute("SELECT * FROM relatorio_circulacao ORDER BY dia, tipo").fetchall()
+
+    # Contadores e relatório corrompidos por fora do log
+    banco.execute("UPDATE livros SET quantidade = 99 WHERE id = 3")
+    banco.execute("UPDATE usuarios SET emprestimos_ativos = 0 WHERE id = 4")
+    banco.execute("DELETE FROM relatorio_circulacao")
+    banco.commit()
+    livros, usuarios = eventos.divergencias(banco.cursor())
+    assert [livro['total_real'] for livro in livros] == [2]
+    assert [usuario['total_real'] for usuario in usuarios] == [1]
+    assert eventos.circulacao_divergente(banco.cursor()) == len(relatorio)
+
+    with app.app_context():
+        corrigidos = fila_escrita().executar(operacao_reconstruir_contadores)
+
+    assert corrigidos == 2 + len(relatorio)
+    assert banco.execute("SELECT quantidade FROM livros WHERE id = 3").fetchone()[0] == 2
+    assert banco.execute("SELECT emprestimos_ativos FROM usuarios WHERE id = 4").fetchone()[0] == 1
+    assert banco.execute("SELECT * FROM relatorio_circulacao ORDER BY dia, tipo").fetchall() == relatorio
+
+
+def test_relatorio_de_circulacao_na_pagina_de_relatorios(app, admin):
+    emprestar(app, 4, 3)
+    pagina = admin.get('/relatorios').get_data(as_text=True)
+    assert 'Circulação nos Últimos 30 Dias' in pagina
+    assert datetime.now().strftime('%d/%m/%Y') in pagina
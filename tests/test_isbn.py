@@ -0,0 +1,60 @@
+import logging
+
+import pytest
+
+import isbn
+
+
+@pytest.mark.parametrize('digitado', [
+    '8535902775', '85-359-0277-5', '978-85-359-0277-8', '9788535902778', 'ISBN: 978 85 359 0277 8',
+])
+def test_formas_do_mesmo_isbn_tem_a_mesma_chave(digitado):
+    assert isbn.normalizar(digitado) == '9788535902778'
+
+
+@pytest.mark.parametrize('digitado', [
+    '9788535902776', '8535902770', '978-85-359-0277-5', '12345', '', None,
+])
+def test_digito_verificador_errado_e_recusado(digitado):
+    assert isbn.normalizar(digitado) is None
+
+
+def test_isbn10_com_x():
+    assert isbn.digito_isbn10('080442957') == 'X'
+    assert isbn.normalizar('0-8044-2957-X') == '9780804429573'
+
+
+def test_reparar_recalcula_o_digito():
+    assert isbn.reparar('9788535902776') == '9788535902778'
+    assert isbn.reparar('8535902770') == '9788535902778'
+    assert isbn.reparar('abc') is None
+
+
+def test_cadastro_recusa_isbn_com_digito_errado(app, admin):
+    resposta = admin.post('/cadastrar_livro', data={
+        'titulo': 'Dom Casmurro', 'autor': 'Machado de Assis', 'isbn': '978-85-359-0277-5', 'quantidade': '1',
+    }, follow_redirects=True)
+    assert 'ISBN inválido' in resposta.get_data(as_text=True)
+
+    admin.post('/cadastrar_livro', data={
+        'titulo': 'Dom Casmurro', 'autor': 'Machado de Assis', 'isbn': '85-359-0277-5', 'quantidade': '1',
+    })
+    resposta = admin.post('/cadastrar_livro', data={
+        'titulo': 'Dom Casmurro (2ª ed.)', 'autor': 'Machado de Assis', 'isbn': '9788535902778', 'quantidade': '1',
+    }, follow_redirects=True)
+    assert 'ISBN já cadastrado' in resposta.get_data(as_text=True)
+
+
+def test_migracao_repara_e_registra_os_cadastros_antigos(app, banco, caplog):
+    banco.execute("UPDATE livros SET isbn13 = NULL")
+    banco.execute("INSERT INTO livros (titulo, autor, isbn, quantidade) VALUES ('Antigo', 'Autor', '9780306406150', 1)")
+    banco.commit()
+    antigo = banco.execute("SELECT id FROM livros WHERE titulo = 'Antigo'").fetchone()[0]
+
+    with caplog.at_level(logging.WARNING, logger='app'):
+        resultado = app.test_cli_runner().invoke(args=['normalizar-isbn'])
+    assert resultado.exit_code == 0, resultado.output
+    assert "dígito verificador reparado" in resultado.output
+    assert any(f"Livro {antigo} (Antigo): ISBN 9780306406150" in registro.getMessage()
+               for registro in caplog.records)
+    assert banco.execute("SELECT isbn13 FROM livros WHERE id = ?", (antigo,)).fetchone()[0] == '9780306406157'
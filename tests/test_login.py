@@ -0,0 +1,71 @@
+from credenciais import ServicoCredenciais, gerar_hash, verificar_senha
+from limite import LimitadorMemoria, LimitadorSQLite
+
+from conftest import entrar_admin
+
+
+def test_hash_de_senha_confere_e_pede_rehash_com_outro_custo():
+    armazenado = gerar_hash('segredo', custo=4)
+    assert armazenado.startswith('scrypt$4$')
+    assert verificar_senha('segredo', armazenado, custo=4) == (True, False)
+    assert verificar_senha('errada', armazenado, custo=4) == (False, False)
+    assert verificar_senha('segredo', armazenado, custo=5) == (True, True)
+
+
+def test_senha_antiga_em_texto_puro_e_aceita_e_marcada_para_rehash():
+    assert verificar_senha('admin123', 'admin123') == (True, True)
+    assert verificar_senha('outra', 'admin123') == (False, False)
+
+
+def test_usuario_inexistente_passa_pelo_hash_falso():
+    servico = ServicoCredenciais(custo=4, processos=0)
+    assert servico.verificar('qualquer', None) == (False, False)
+    assert servico._hash_falso.startswith('scrypt$4$')
+
+
+def test_login_regrava_senha_em_texto_puro(app, banco):
+    banco.execute("UPDATE administradores SET senha = 'admin123' WHERE usuario = 'admin'")
+    banco.commit()
+    entrar_admin(app.test_client())
+    senha = banco.execute("SELECT senha FROM administradores WHERE usuario = 'admin'").fetchone()[0]
+    assert senha.startswith('scrypt$4$')
+
+
+def test_balde_recusa_quando_as_fichas_acabam():
+    limitador = LimitadorMemoria()
+    assert limitador.consumir('conta:admin:x', 2, 60)[0]
+    assert limitador.consumir('conta:admin:x', 2, 60)[0]
+    permitido, espera = limitador.consumir('conta:admin:x', 2, 60)
+    assert not permitido and 0 < espera <= 30
+
+    # A tentativa que deu certo devolve a ficha
+    limitador.devolver('conta:admin:x', 2, 60)
+    assert limitador.consumir('conta:admin:x', 2, 60)[0]
+
+
+def test_balde_sqlite_e_compartilhado_entre_workers(tmp_path):
+    arquivo = str(tmp_path / 'cache.db')
+    worker_1, worker_2 = LimitadorSQLite(arquivo), LimitadorSQLite(arquivo)
+    assert worker_1.consumir('ip:1.2.3.4', 1, 60)[0]
+    assert not worker_2.consumir('ip:1.2.3.4', 1, 60)[0]
+
+
+def tentar(cliente, senha, ip):
+    return cliente.post('/login', environ_base={'REMOTE_ADDR': ip},
+                        data={'tipo_usuario': 'admin', 'usuario': 'admin', 'senha': senha})
+
+
+def test_conta_bloqueada_por_falhas_vindas_de_varios_ips(criar):
+    app = criar(LIMITE_LOGIN_CONTA=(2, 300))
+    cliente = app.test_client()
+    tentar(cliente, 'errada', '10.0.0.1')
+    tentar(cliente, 'errada', '10.0.0.2')
+    assert 'Muitas tentativas' in tentar(cliente, 'admin123', '10.0.0.3').get_data(as_text=True)
+
+
+def test_logins_certos_nao_gastam_o_balde_da_conta(criar):
+    app = criar(LIMITE_LOGIN_CONTA=(2, 300))
+    for _ in range(4):
+        assert tentar(app.test_client(), 'admin123', '10.0.0.1').status_code == 302
+    resposta = tentar(app.test_client(), 'errada', '10.0.0.1').get_data(as_text=True)
+    assert 'Muitas tentativas' not in resposta and 'incorretos' in resposta
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import (calcular_multas, formatar_reais, ler_reais, operacao_devolver_livro, operacao_pagar_multa,
+                 regras_multas)
+from escrita import ErroOperacao
+
+from conftest import entrar_aluno
+from test_emprestimos import emprestar, executar, ultimo_emprestimo
+
+
+def multa(banco, usuario_id):
+    return banco.execute("SELECT dias, valor FROM multas WHERE usuario_id = ?", (usuario_id,)).fetchone()
+
+
+def atrasar(banco, usuario_id, dias):
+    prevista = (datetime.now() - timedelta(days=dias)).strftime('%Y-%m-%d')
+    banco.execute("UPDATE emprestimos SET data_prevista = ? WHERE usuario_id = ? AND status = 'emprestado'",
+                  (prevista, usuario_id))
+    banco.commit()
+
+
+def test_reais_e_centavos():
+    assert formatar_reais(123450) == 'R$ 1.234,50'
+    assert formatar_reais(-50) == '-R$ 0,50'
+    assert ler_reais('1.234,50') == ler_reais('R$ 1234.50') == 123450
+
+
+def test_calculo_em_lote_respeita_carencia_e_teto(app, banco):
+    emprestar(app, 4, 3)
+    atrasar(banco, 4, 2)
+    with app.app_context():
+        assert calcular_multas() == 3
+        assert calcular_multas() == 0
+    # Os atrasos de 2024 batem no teto do aluno; 2 dias ficam dentro da carência
+    assert tuple(multa(banco, 1))[1] == 3000
+    assert multa(banco, 4) is None
+
+    atrasar(banco, 4, 5)
+    with app.app_context():
+        assert calcular_multas() == 1
+    assert tuple(multa(banco, 4)) == (3, 300)
+
+
+def test_devolucao_calcula_a_multa_na_mesma_transacao(app, banco):
+    emprestar(app, 4, 3)
+    atrasar(banco, 4, 4)
+    with app.app_context():
+        regras = regras_multas()
+    mensagem = executar(app, operacao_devolver_livro, ultimo_emprestimo(banco, 4)['id'], 3, regras)
+    assert "Multa por 2 dia(s) de atraso: R$ 2,00" in mensagem
+
+
+def test_pagamento_ate_o_saldo(app, banco):
+    with app.app_context():
+        calcular_multas()
+    agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    with pytest.raises(ErroOperacao, match="maior que o saldo"):
+        executar(app, operacao_pagar_multa, 1, 3001, agora)
+    assert "Saldo restante: R$ 10,00" in executar(app, operacao_pagar_multa, 1, 2000, agora)
+
+
+def test_aluno_ve_o_saldo(app, aluno):
+    with app.app_context():
+        calcular_multas()
+    assert 'R$ 30,00' in aluno.get('/meus_emprestimos').get_data(as_text=True)
@@ -0,0 +1,52 @@
+import perfis
+
+from conftest import entrar_aluno
+
+
+def trabalho():
+    return sum(i * i for i in range(20000))
+
+
+def test_perfil_cprofile_gravado_e_listado(tmp_path):
+    perfil = perfis.PerfilRequisicao.iniciar('cprofile')
+    trabalho()
+    base = perfil.gravar(str(tmp_path), 'GET', '/livros', 200)
+
+    assert (tmp_path / f"{base}.prof").exists()
+    assert 'trabalho' in (tmp_path / f"{base}.txt").read_text()
+    [listado] = perfis.listar(str(tmp_path))
+    assert (listado['nome'], listado['rota'], listado['modo']) == (base, '/livros', 'cprofile')
+
+
+def test_um_perfil_por_vez_e_modo_invalido():
+    assert perfis.PerfilRequisicao.iniciar('strace') is None
+    perfil = perfis.PerfilRequisicao.iniciar('amostras')
+    assert perfis.PerfilRequisicao.iniciar('cprofile') is None
+    perfil.parar()
+    perfil.parar()
+    outro = perfis.PerfilRequisicao.iniciar('cprofile')
+    assert outro is not None
+    outro.parar()
+
+
+def test_limpar_mantem_os_mais_recentes(tmp_path):
+    for _ in range(3):
+        perfis.PerfilRequisicao.iniciar('amostras', intervalo=0.001).gravar(str(tmp_path), 'GET', '/', 200)
+    perfis.limpar(str(tmp_path), 1)
+    assert len(perfis.listar(str(tmp_path))) == 1
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_admin_pede_o_perfil_pela_url(app, admin):
+    resposta = admin.get('/livros?perfil=amostras')
+    nome = resposta.headers['X-Perfil']
+    assert nome.endswith('-amostras')
+    assert admin.get(f'/perfis/{nome}.folded').status_code == 200
+    assert nome in admin.get('/perfis').get_data(as_text=True)
+
+
+def test_aluno_nao_liga_o_perfil(app):
+    cliente = app.test_client()
+    entrar_aluno(cliente)
+    assert 'X-Perfil' not in cliente.get('/meus_emprestimos?perfil=cprofile').headers
+    assert perfis.listar(app.config['PERFIS_DIRETORIO']) == []
@@ -0,0 +1,39 @@
+import sqlite3
+
+from replica import CopiaLeitura, caminho_replica
+
+from conftest import entrar_admin
+
+
+def test_caminho_da_copia(tmp_path):
+    assert caminho_replica('/dados/biblioteca.db') == '/dados/biblioteca_leitura.db'
+    assert caminho_replica('/dados/biblioteca.db', str(tmp_path)) == str(tmp_path / 'biblioteca_leitura.db')
+
+
+def test_copia_so_e_refeita_depois_do_intervalo(tmp_path):
+    primario = str(tmp_path / 'primario.db')
+    conn = sqlite3.connect(primario)
+    conn.execute("CREATE TABLE t (x)")
+    conn.execute("INSERT INTO t VALUES (1)")
+    conn.commit()
+
+    copia = CopiaLeitura(primario, str(tmp_path / 'copia.db'), intervalo=60)
+    assert copia.atualizado_em() is None
+    assert copia.atualizar() and not copia.atualizar()
+
+    conn.execute("INSERT INTO t VALUES (2)")
+    conn.commit()
+    conn.close()
+    leitura = sqlite3.connect(copia.garantir())
+    assert leitura.execute("SELECT count(*) FROM t").fetchone()[0] == 1
+    assert copia.atualizar(forcar=True)
+    assert sqlite3.connect(copia.destino).execute("SELECT count(*) FROM t").fetchone()[0] == 2
+    leitura.close()
+
+
+def test_relatorios_leem_da_copia_e_avisam_a_idade(criar, tmp_path):
+    app = criar(REPLICA_LEITURA=True, REPLICA_DIRETORIO=str(tmp_path), REPLICA_ATUALIZAR_A_CADA=3600)
+    admin = app.test_client()
+    entrar_admin(admin)
+    assert 'Dados de' in admin.get('/relatorios').get_data(as_text=True)
+    assert (tmp_path / 'biblioteca_leitura.db').exists()
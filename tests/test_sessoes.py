@@ -0,0 +1,37 @@
+import pytest
+
+from conftest import entrar_admin, entrar_aluno
+
+
+def test_paginas_do_aluno_usam_o_id_guardado_na_sessao(app, aluno, banco):
+    # Trocar a matrícula depois do login não muda de quem são os empréstimos
+    banco.execute("UPDATE usuarios SET matricula = '9999999' WHERE id = 1")
+    banco.commit()
+    pagina = aluno.get('/meus_emprestimos').get_data(as_text=True)
+    assert 'Dom Casmurro' in pagina
+    assert 'Python para Iniciantes' not in pagina
+
+
+@pytest.mark.parametrize('backend', ['memoria', 'sqlite'])
+def test_sessao_no_servidor_deixa_so_o_identificador_no_cookie(criar, backend):
+    app = criar(SESSAO_BACKEND=backend)
+    cliente = app.test_client()
+    entrar_admin(cliente)
+
+    sid = cliente.get_cookie('session').value
+    assert len(sid) < 32
+    assert 'Administrador' in cliente.get('/').get_data(as_text=True)
+
+    # Sem o registro no servidor o cookie não vale nada
+    cliente.get('/logout')
+    assert cliente.get('/').status_code == 302
+
+
+def test_sessao_no_servidor_troca_o_identificador_no_login(criar):
+    app = criar(SESSAO_BACKEND='memoria')
+    cliente = app.test_client()
+    # Um identificador plantado antes do login não passa a valer a sessão logada
+    cliente.set_cookie('session', 'fixado')
+    entrar_aluno(cliente)
+    assert cliente.get_cookie('session').value != 'fixado'
+    assert cliente.get('/meus_emprestimos').status_code == 200
@@ -0,0 +1,51 @@
+import json
+
+import tracos
+
+from conftest import entrar_admin
+
+PAI = '00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01'
+
+
+def test_traceparent_de_quem_chamou():
+    traco = tracos.Traco('GET /livros', PAI)
+    assert (traco.trace_id, traco.pai_remoto, traco.pedido) == (
+        '0af7651916cd43dd8448eb211c80319c', 'b7ad6b7169203331', True)
+    assert tracos.amostrar(traco, 1, 0.0, 500)
+    assert not tracos.amostrar(tracos.Traco('GET /', 'invalido'), 1, 0.0, 500)
+    assert tracos.amostrar(tracos.Traco('GET /'), 600, 0.0, 500)
+
+
+def test_resumo_aponta_a_consulta_repetida(tmp_path):
+    arquivo = str(tmp_path / 'tracos.jsonl')
+    exportador = tracos.ExportadorJSONL(arquivo)
+    for repeticoes in (12, 1):
+        traco = tracos.Traco('GET /usuarios')
+        for _ in range(repeticoes):
+            traco.consulta('livros.contar', 0.001)
+        exportador.exportar(traco.otlp(traco.inicio + 5 * 10 ** 6, {}))
+
+    lista, por_consulta = tracos.resumir(arquivo, repeticoes=10)
+    assert [(total, repetida) for _, _, total, repetida in lista] == [(12, ('livros.contar', 12)), (1, None)]
+    assert por_consulta[0][:2] == ('livros.contar', 13)
+
+
+def test_requisicao_gravada_com_spans_das_consultas(criar, tmp_path):
+    arquivo = tmp_path / 'tracos.jsonl'
+    app = criar(TRACOS_ARQUIVO=str(arquivo), TRACOS_AMOSTRAGEM=0.0)
+    cliente = app.test_client()
+    cliente.get('/login')
+    assert not arquivo.exists()
+    entrar_admin(cliente)
+    cliente.get('/usuarios', headers={'traceparent': PAI})
+
+    [linha] = arquivo.read_text().splitlines()
+    raiz, *filhos = json.loads(linha)['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert (raiz['name'], raiz['traceId'], raiz['parentSpanId']) == (
+        'GET /usuarios', '0af7651916cd43dd8448eb211c80319c', 'b7ad6b7169203331')
+    consultas = [span for span in filhos if span['kind'] == tracos.CLIENTE]
+    assert 'multas.saldos' in [span['name'] for span in consultas]
+    assert all(span['parentSpanId'] == raiz['spanId'] for span in consultas)
+
+    resultado = app.test_cli_runner().invoke(args=['analisar-tracos'])
+    assert "1 traço(s)" in resultado.output
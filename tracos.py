@@ -0,0 +1,229 @@
+"""Traços das requisições no formato do OpenTelemetry, gravados em JSONL
+
+Cada requisição vira um traço com um span da rota e, dentro dele, um span
+por consulta do registro (pelo observador de consultas.py) e um por
+renderização de template. Os spans ficam na memória da requisição e só no
+fim se decide se o traço é gravado: sempre que a requisição foi lenta,
+quando o cabeçalho `traceparent` de quem chamou pede amostragem e, nas
+demais, numa fração sorteada. Assim as requisições lentas nunca se perdem
+na amostragem.
+
+Cada linha do arquivo é um ExportTraceServiceRequest em OTLP/JSON (o
+formato do exportador "file" do OpenTelemetry Collector), que pode ser
+lido pelo receptor otlpjsonfile ou analisado com `flask analisar-tracos`.
+O span de uma consulta percorrida com iterar() mede só o tempo dentro do
+SQLite e termina no fim da iteração. As operações da fila de escrita rodam
+em outra thread e não entram no traço.
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from consultas import CONSULTAS
+
+SERVICO = 'biblioteca'
+
+# Tipos de span do OTLP
+INTERNO, SERVIDOR, CLIENTE = 1, 2, 3
+
+TRACEPARENT = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_atual = ContextVar('traco_atual', default=None)
+
+
+def _novo_id(bytes_=8):
+    return os.urandom(bytes_).hex()
+
+
+def _atributos(valores):
+    """Atributos no formato do OTLP/JSON ({'key': ..., 'value': {'stringValue': ...}})"""
+    lista = []
+    for chave, valor in valores.items():
+        if valor is None:
+            continue
+        if isinstance(valor, bool):
+            tipo = 'boolValue'
+        elif isinstance(valor, int):
+            tipo, valor = 'intValue', str(valor)
+        elif isinstance(valor, float):
+            tipo = 'doubleValue'
+        else:
+            tipo, valor = 'stringValue', str(valor)
+        lista.append({'key': chave, 'value': {tipo: valor}})
+    return lista
+
+
+class Traco:
+    """Spans de uma requisição, guardados até a decisão de gravar ou descartar"""
+
+    def __init__(self, nome, traceparent=None):
+        pai = TRACEPARENT.match(traceparent or '')
+        self.trace_id = pai.group(1) if pai else _novo_id(16)
+        self.pai_remoto = pai.group(2) if pai else None
+        self.pedido = bool(pai and int(pai.group(3), 16) & 1)
+        self.span_id = _novo_id()
+        self.nome = nome
+        self.inicio = time.time_ns()
+        self.spans = []
+        self._abertos = []
+        self.consultas = 0
+        self.tempo_consultas = 0
+        self.tempo_templates = 0
+
+    def registrar(self, nome, inicio, fim, atributos=None, tipo=INTERNO):
+        """Registra um span já terminado, filho do span aberto no momento"""
+        pai = self._abertos[-1][0] if self._abertos else self.span_id
+        self.spans.append((_novo_id(), pai, nome, tipo, inicio, fim, atributos or {}))
+
+    def consulta(self, nome, duracao):
+        """Registra o span de uma consulta do registro que acabou de terminar"""
+        fim = time.time_ns()
+        inicio = fim - int(duracao * 1e9)
+        self.consultas += 1
+        self.tempo_consultas += fim - inicio
+        self.registrar(nome, inicio, fim, tipo=CLIENTE)
+
+    def abrir(self, nome, atributos=None):
+        self._abertos.append((_novo_id(), nome, time.time_ns(), atributos or {}))
+
+    def fechar(self):
+        if not self._abertos:
+            return
+        span_id, nome, inicio, atributos = self._abertos.pop()
+        fim = time.time_ns()
+        if nome == 'render_template':
+            self.tempo_templates += fim - inicio
+        pai = self._abertos[-1][0] if self._abertos else self.span_id
+        self.spans.append((span_id, pai, nome, INTERNO, inicio, fim, atributos))
+
+    def otlp(self, fim, atributos, erro=False):
+        """O traço como um ExportTraceServiceRequest do OTLP/JSON"""
+        duracao = fim - self.inicio
+        raiz = {
+            'traceId': self.trace_id, 'spanId': self.span_id, 'name': self.nome, 'kind': SERVIDOR,
+            'startTimeUnixNano': str(self.inicio), 'endTimeUnixNano': str(fim),
+            'attributes': _atributos(dict(atributos, **{
+                'biblioteca.db.consultas': self.consultas,
+                'biblioteca.db.tempo_ms': self.tempo_consultas / 1e6,
+                'biblioteca.template.tempo_ms': self.tempo_templates / 1e6,
+                # O que sobra: Python da rota (HTML nas f-strings, regras e a compilação do
+                # template de render_template_string, que acontece antes do sinal de renderização)
+                'biblioteca.python.tempo_ms': (duracao - self.tempo_consultas - self.tempo_templates) / 1e6,
+            })),
+            'status': {'code': 2 if erro else 1},
+        }
+        if self.pai_remoto:
+            raiz['parentSpanId'] = self.pai_remoto
+        spans = [raiz]
+        for span_id, pai, nome, tipo, inicio_span, fim_span, atributos in self.spans:
+            if tipo == CLIENTE:
+                # O texto fixo da consulta, sem os parâmetros
+                atributos = dict(atributos, **{'db.system': 'sqlite', 'db.operation': nome,
+                                               'db.statement': ' '.join(CONSULTAS.get(nome, '').split())})
+            spans.append({
+                'traceId': self.trace_id, 'spanId': span_id, 'parentSpanId': pai, 'name': nome, 'kind': tipo,
+                'startTimeUnixNano': str(inicio_span), 'endTimeUnixNano': str(fim_span),
+                'attributes': _atributos(atributos),
+            })
+        return {'resourceSpans': [{
+            'resource': {'attributes': _atributos({'service.name': SERVICO, 'process.pid': os.getpid()})},
+            'scopeSpans': [{'scope': {'name': SERVICO}, 'spans': spans}],
+        }]}
+
+
+def iniciar(nome, traceparent=None):
+    """Começa o traço da requisição atual"""
+    traco = Traco(nome, traceparent)
+    _atual.set(traco)
+    return traco
+
+
+def atual():
+    return _atual.get()
+
+
+def encerrar():
+    """Retira o traço da requisição atual e o retorna (None se não havia)"""
+    traco = _atual.get()
+    _atual.set(None)
+    return traco
+
+
+def observar_consulta(nome, duracao):
+    """Observador de consultas.py: um span por consulta, se houver traço em andamento"""
+    traco = _atual.get()
+    if traco is not None:
+        traco.consulta(nome, duracao)
+
+
+def amostrar(traco, duracao_ms, fracao, lento_ms):
+    """Decide se o traço é gravado: requisição lenta, pedido de quem chamou ou sorteio"""
+    return (traco.pedido or (lento_ms is not None and duracao_ms >= lento_ms)
+            or random.random() < fracao)
+
+
+class ExportadorJSONL:
+    """Acrescenta os traços a um arquivo, um ExportTraceServiceRequest por linha"""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+
+    def exportar(self, dados):
+        linha = json.dumps(dados, separators=(',', ':')) + '\n'
+        with self._lock:
+            with open(self.caminho, 'a', encoding='utf-8') as saida:
+                saida.write(linha)
+
+
+def ler(caminho):
+    """Percorre os traços gravados como (raiz, spans filhos), no formato OTLP/JSON"""
+    with open(caminho, encoding='utf-8') as entrada:
+        for linha in entrada:
+            if not linha.strip():
+                continue
+            for recurso in json.loads(linha)['resourceSpans']:
+                for escopo in recurso['scopeSpans']:
+                    spans = escopo['spans']
+                    yield spans[0], spans[1:]
+
+
+def duracao_ms(span):
+    return (int(span['endTimeUnixNano']) - int(span['startTimeUnixNano'])) / 1e6
+
+
+def resumir(caminho, repeticoes=10):
+    """Resumo dos traços gravados para achar N+1 e consultas lentas
+
+    Retorna (tracos, consultas): `tracos` é [(duracao_ms, nome, total de
+    consultas, (consulta mais repetida, vezes))] do mais lento ao mais
+    rápido, marcando só repetições a partir de `repeticoes`; `consultas` é
+    [(nome, execuções, tempo total ms, maior ms)] pelo tempo total.
+    """
+    tracos = []
+    por_consulta = defaultdict(lambda: [0, 0.0, 0.0])
+    for raiz, filhos in ler(caminho):
+        nomes = Counter()
+        for span in filhos:
+            if span['kind'] != CLIENTE:
+                continue
+            nomes[span['name']] += 1
+            dados = por_consulta[span['name']]
+            duracao = duracao_ms(span)
+            dados[0] += 1
+            dados[1] += duracao
+            dados[2] = max(dados[2], duracao)
+        repetida = nomes.most_common(1)[0] if nomes else None
+        if repetida and repetida[1] < repeticoes:
+            repetida = None
+        tracos.append((duracao_ms(raiz), raiz['name'], sum(nomes.values()), repetida))
+
+    tracos.sort(reverse=True, key=lambda item: item[0])
+    consultas = sorted(((nome,) + tuple(dados) for nome, dados in por_consulta.items()),
+                       key=lambda item: item[2], reverse=True)
+    return tracos, consultas
@@ -0,0 +1,36 @@
+"""Unidades (bibliotecas dos campi) da rede
+
+Por padrão todas as unidades ficam no mesmo banco e cada exemplar,
+empréstimo e usuário carrega o `unidade_id` da sua unidade. Com
+UNIDADES_SEPARADAS cada unidade tem o seu próprio arquivo SQLite, com
+conexões e fila de escrita próprias, e o tráfego de uma unidade nunca
+disputa o lock de outra. A unidade principal (id 1) continua no banco
+principal, que também guarda o cadastro das unidades e dos administradores.
+Nesse modo o acervo também é de cada arquivo: `livros.quantidade` conta só
+os exemplares da unidade, e o código de barras dos exemplares fora da
+principal leva o id da unidade para continuar único na rede.
+Os relatórios da rede inteira juntam os resultados de cada arquivo.
+"""
+import heapq
+import os
+
+UNIDADE_PRINCIPAL = 1
+
+
+def arquivo_unidade(banco_principal, unidade_id):
+    """Caminho do arquivo SQLite de uma unidade separada"""
+    if int(unidade_id) == UNIDADE_PRINCIPAL:
+        return banco_principal
+    raiz, extensao = os.path.splitext(banco_principal)
+    return f"{raiz}_unidade{int(unidade_id)}{extensao or '.db'}"
+
+
+def mesclar(resultados, chave=None, reverso=False):
+    """Junta resultados já ordenados de várias unidades mantendo a ordem
+
+    Cada resultado é lido sob demanda, então só uma linha de cada unidade
+    fica em memória por vez.
+    """
+    if len(resultados) == 1:
+        return iter(resultados[0])
+    return heapq.merge(*resultados, key=chave, reverse=reverso)